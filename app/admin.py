@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Invoice, Payment, UserBalance, User
+from .models import Invoice, Payment, UserBalance, UserBalanceShard, LedgerEntry, OutboxMessage, User
 from django.contrib.auth.admin import UserAdmin
 
 
@@ -42,5 +42,30 @@ class PaymentAdmin(admin.ModelAdmin):
 
 @admin.register(UserBalance)
 class UserBalanceAdmin(admin.ModelAdmin):
-    list_display = ("user", "balance", "reserved", "updated_at")
-    search_fields = ("user__username", "user__email")
\ No newline at end of file
+    list_display = ("user", "balance", "reserved", "stripes", "ledger_position", "redis_seq", "version", "updated_at")
+    search_fields = ("user__username", "user__email")
+
+
+@admin.register(UserBalanceShard)
+class UserBalanceShardAdmin(admin.ModelAdmin):
+    list_display = ("user", "index", "balance", "reserved", "updated_at")
+    search_fields = ("user__username", "user__email")
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "kind", "account", "amount", "invoice", "created_at")
+    search_fields = ("transaction_id", "user__username", "user__email")
+    list_filter = ("kind", "account")
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ("id", "topic", "created_at")
+    list_filter = ("topic",)
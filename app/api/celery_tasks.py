@@ -1,82 +1,241 @@
-from celery import shared_task
+import random
+from celery import group, shared_task
 from django.db import transaction
-from django.shortcuts import get_object_or_404
-from app.models import Invoice, Payment
-from app.api.payments.services import billing, payment_processor
+from django.utils import timezone
+from app import metrics, task_routing
+from app.models import Invoice, Payment, UserBalance
+from django.conf import settings
+from app.api.payments.services import (
+    batching, billing, capture, invoice_cache, ledger, optimistic_balance, outbox, parking, payment_processor,
+    redis_balance, refund_jobs, striping, sweeper,
+)
+from app.api.payments.serializers import BulkRefundSerializer
+from app.api.payments.services.circuit_breaker import ProviderUnavailable, guarded_call
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task(bind=True, max_retries=3, default_retry_delay=5)
-def process_invoice_task(self, invoice_id: str):
-    try:
-        invoice = get_object_or_404(Invoice, pk=invoice_id)
-    except Exception as e:
-        logger.exception("Invoice not found: %s", invoice_id)
-        return
+def _retry_countdown(retries: int) -> float:
+    """Экспоненциальная задержка с полным джиттером, чтобы ретраи не приходили к провайдеру волной"""
+    cap = min(settings.PROVIDER_RETRY_BACKOFF_MAX, settings.PROVIDER_RETRY_BACKOFF_BASE * 2 ** retries)
+    return random.uniform(0, cap)
 
-    if invoice.status in (Invoice.STATUS_COMPLETED, Invoice.STATUS_REFUNDED):
-        logger.info("Invoice %s already finished with status %s", invoice_id, invoice.status)
-        return
 
+@shared_task(bind=True, max_retries=3)
+def process_invoice_task(self, invoice_id: str):
+    """
+    Обработка счета в две фазы, каждая — одна транзакция с одной блокировкой баланса:
+    1) блокировка счета, резерв средств и создание платежа;
+    2) после ответа провайдера — списание или компенсация вместе со статусами.
+    В двухэтапном потоке (PAYMENT_FLOW = "authorize_capture") во второй фазе платеж
+    только авторизуется, списание делает capture_authorized_payments_task.
+    Если провайдер недоступен (circuit breaker / bulkhead), счет откладывается
+    без траты попытки.
+    Доставка задачи — не менее одного раза: завершенный или неуспешный счет повторно
+    не обрабатывается, а фаза 2 меняет баланс, только если платеж еще pending.
+    """
     try:
-        reserved = billing.reserve_funds(invoice)
+        with transaction.atomic():
+            with metrics.lock_wait("invoice"):
+                invoice = Invoice.objects.select_for_update().filter(pk=invoice_id).first()
+            if invoice is None:
+                logger.warning("Invoice not found: %s", invoice_id)
+                return
+            if invoice.status in (Invoice.STATUS_COMPLETED, Invoice.STATUS_FAILED, Invoice.STATUS_REFUNDED):
+                logger.info("Invoice %s already finished with status %s", invoice_id, invoice.status)
+                return
+            payment = billing.begin_payment(invoice)
     except Exception as exc:
         logger.exception("Error reserving funds for invoice %s: %s", invoice_id, exc)
-        invoice.status = Invoice.STATUS_FAILED
-        invoice.save(update_fields=["status", "updated_at"])
+        Invoice.objects.filter(pk=invoice_id).update(status=Invoice.STATUS_FAILED, updated_at=timezone.now())
+        invoice = Invoice.objects.filter(pk=invoice_id).first()
+        if invoice is not None:
+            invoice_cache.store(invoice)
+            metrics.observe_terminal_on_commit([invoice], Invoice.STATUS_FAILED)
         return
 
-    if not reserved:
+    if payment is None:
         logger.info("Not enough funds to reserve for invoice %s", invoice_id)
         return
 
-    payment, created = Payment.objects.get_or_create(
-        invoice=invoice,
-        defaults={"amount": invoice.amount}
-    )
-
-    if payment.status == Payment.STATUS_SUCCESS:
-        logger.info("Payment for invoice %s already success", invoice_id)
+    if payment.status in (Payment.STATUS_SUCCESS, Payment.STATUS_AUTHORIZED):
+        logger.info("Payment for invoice %s already %s", invoice_id, payment.status)
         return
 
+    two_phase = payment_processor.two_phase()
+    payment.attempts += 1
     try:
-        payment.attempts += 1
-        payment.save(update_fields=["attempts", "updated_at"])
-
-        result = payment_processor.charge(payment)
+        result = guarded_call(payment_processor.authorize if two_phase else payment_processor.charge, payment)
         payment.provider_transaction_id = result.get("provider_id")
-        if result.get("success"):
-            with transaction.atomic():
-                billing.complete_payment(payment)
-                payment.status = Payment.STATUS_SUCCESS
-                payment.save(update_fields=["status", "provider_transaction_id", "updated_at"])
+        if result.get("success") and two_phase:
+            billing.authorize_payments([payment])
+            logger.info("Payment authorized for invoice %s", invoice_id)
+        elif result.get("success"):
+            if billing.complete_payment(payment):
                 logger.info("Payment success for invoice %s", invoice_id)
+            else:
+                logger.info("Payment for invoice %s already finished by another worker", invoice_id)
         else:
             reason = result.get("message", "unknown")
-            payment.last_error = reason
-            payment.status = Payment.STATUS_FAILED
-            payment.save(update_fields=["last_error", "status", "provider_transaction_id", "updated_at"])
-            billing.compensate_payment(payment, reason=reason)
-            logger.info("Payment failed and compensated for invoice %s, reason: %s", invoice_id, reason)
+            if billing.compensate_payment(payment, reason=reason):
+                logger.info("Payment failed and compensated for invoice %s, reason: %s", invoice_id, reason)
+            else:
+                logger.info("Payment for invoice %s already finished by another worker", invoice_id)
+
+    except ProviderUnavailable as exc:
+        parking.park([invoice_id], delay=exc.retry_after)
+        logger.info("Provider unavailable, invoice %s parked for %.1fs: %s", invoice_id, exc.retry_after, exc)
 
     except Exception as exc:
         logger.exception("Exception during payment processing for invoice %s: %s", invoice_id, exc)
+        if self.request.retries < self.max_retries:
+            Payment.objects.filter(pk=payment.pk).update(
+                attempts=payment.attempts, last_error=str(exc), updated_at=timezone.now(),
+            )
+            raise self.retry(exc=exc, countdown=_retry_countdown(self.request.retries))
+        billing.compensate_payment(payment, reason=str(exc))
+
+
+def _dispatch_invoices(invoice_ids: list[str]):
+    """
+    Отправляем счета задачами по каждому счету в их полосы очереди списаний
+    (без буфера пакетной обработки)
+    """
+    for queue, lane_ids in task_routing.invoice_lanes(invoice_ids).items():
+        if len(lane_ids) == 1:
+            process_invoice_task.apply_async(args=[lane_ids[0]], queue=queue)
+        else:
+            group(process_invoice_task.s(invoice_id) for invoice_id in lane_ids).apply_async(queue=queue)
+
+
+def _charge_batch(payments: list[Payment]) -> tuple[list[Payment], list[Payment], list[Payment], list[Payment]]:
+    """
+    Вызываем провайдера по каждому платежу пакета: (успешные, отклоненные, упавшие, отложенные).
+    После отказа breaker/bulkhead остаток пакета откладывается без вызовов провайдера.
+    """
+    succeeded, failed, errored, parked = [], [], [], []
+    retry_after = None
+    call = payment_processor.authorize if payment_processor.two_phase() else payment_processor.charge
+    for payment in payments:
+        if retry_after is not None:
+            parked.append(payment)
+            continue
+        try:
+            result = guarded_call(call, payment)
+        except ProviderUnavailable as exc:
+            retry_after = exc.retry_after
+            parked.append(payment)
+            continue
+        except Exception as exc:
+            logger.exception("Exception during payment processing for invoice %s: %s", payment.invoice_id, exc)
+            errored.append(payment)
+            continue
+        payment.provider_transaction_id = result.get("provider_id")
+        if result.get("success"):
+            succeeded.append(payment)
+        else:
+            payment.last_error = result.get("message", "unknown")
+            failed.append(payment)
+    if parked:
+        parking.park([str(payment.invoice_id) for payment in parked], delay=retry_after)
+    return succeeded, failed, errored, parked
+
+
+def _settle_user_batch(user_id, succeeded: list[Payment], failed: list[Payment]):
+    if payment_processor.two_phase():
+        # Авторизованные ждут пакетного списания, резерв за ними сохраняется
+        billing.authorize_payments(succeeded)
+        succeeded = []
+    billing.settle_payments_batch(user_id, succeeded, failed)
+
+
+def _settle_each(succeeded: list[Payment], failed: list[Payment]):
+    """
+    Пакетное завершение не удалось, а провайдер уже ответил: завершаем платежи по одному.
+    Заново в обработку их не отправляем — это был бы повторный вызов провайдера.
+    """
+    two_phase = payment_processor.two_phase()
+    for payment in succeeded:
+        try:
+            if two_phase:
+                billing.authorize_payments([payment])
+            else:
+                billing.complete_payment(payment)
+        except Exception:
+            logger.exception("Не удалось завершить оплаченный платеж %s, нужна сверка", payment.pk)
+    for payment in failed:
+        try:
+            billing.compensate_payment(payment, reason=payment.last_error)
+        except Exception:
+            logger.exception("Не удалось компенсировать платеж %s", payment.pk)
+
+
+@shared_task
+def process_invoice_batch_task():
+    """
+    Пакетная обработка счетов из буфера Redis.
+    На каждого пользователя — одна блокировка баланса на резерв и одна на списание,
+    статусы обновляются пакетно. Разбитые балансы и режим ledger
+    обрабатываются обычной задачей по каждому счету.
+    Ошибка одного пользователя не останавливает пакет: если не удался резерв, его счета
+    уходят в обычную задачу, если не удалось завершение — платежи завершаются по одному.
+    """
+    invoice_ids, remaining = batching.drain(settings.INVOICE_BATCH_MAX_SIZE)
+    if remaining:
+        process_invoice_batch_task.delay()
+    if not invoice_ids:
+        return
+
+    by_user = {}
+    for invoice_id, user_id in Invoice.objects.filter(
+        pk__in=invoice_ids, status=Invoice.STATUS_PENDING,
+    ).values_list("id", "user_id"):
+        by_user.setdefault(user_id, []).append(invoice_id)
+
+    if ledger.enabled():
+        fallback_users = set(by_user)
+    elif redis_balance.enabled() or optimistic_balance.enabled():
+        # Шарды в режимах redis и optimistic не используются, пакет резервируется одним изменением
+        fallback_users = set()
+    else:
+        fallback_users = set(
+            UserBalance.objects.filter(user_id__in=by_user, stripes__gt=1).values_list("user_id", flat=True)
+        )
+    fallback_ids = [str(invoice_id) for user_id in fallback_users for invoice_id in by_user.pop(user_id)]
+    if fallback_ids:
+        _dispatch_invoices(fallback_ids)
+
+    processed = 0
+    for user_id, user_invoice_ids in by_user.items():
         try:
-            raise self.retry(exc=exc)
+            payments = billing.reserve_funds_batch(user_id, user_invoice_ids)
         except Exception:
-            payment.last_error = str(exc)
-            payment.save(update_fields=["last_error", "updated_at"])
-            billing.compensate_payment(payment, reason=str(exc))\
+            # Транзакция резерва откатилась, счета остались pending
+            logger.exception("Ошибка резерва пакета пользователя %s, счета обрабатываются поштучно", user_id)
+            _dispatch_invoices([str(invoice_id) for invoice_id in user_invoice_ids])
+            continue
+        succeeded, failed, errored, _ = _charge_batch(payments)
+        try:
+            _settle_user_batch(user_id, succeeded, failed)
+        except Exception:
+            logger.exception("Ошибка завершения пакета пользователя %s, платежи завершаются по одному", user_id)
+            _settle_each(succeeded, failed)
+        # Упавшие вызовы провайдера уходят в обычную задачу с ретраями, резерв за ними сохраняется
+        if errored:
+            _dispatch_invoices([str(payment.invoice_id) for payment in errored])
+        processed += len(user_invoice_ids)
 
+    logger.info(
+        "Пакет счетов обработан: счетов=%s пользователей=%s поштучно=%s",
+        processed, len(by_user), len(invoice_ids) - processed,
+    )
 
 
 @shared_task(bind=True)
 def refund_invoice_task(self, payment_id: str):
-    try:
-        payment = Payment.objects.get(pk=payment_id)
-    except Payment.DoesNotExist:
+    payment = Payment.objects.select_related("invoice").filter(pk=payment_id).first()
+    if payment is None:
         logger.warning("Payment not found for refund: %s", payment_id)
         return
 
@@ -90,3 +249,153 @@ def refund_invoice_task(self, payment_id: str):
     except Exception:
         logger.exception("Failed to refund payment %s", payment_id)
         raise
+
+
+@shared_task
+def bulk_refund_task(job_id: str, criteria: dict):
+    """
+    Массовый возврат: отбираем успешные платежи, группируем по пользователю и отправляем
+    пакеты до REFUND_BATCH_SIZE платежей — на пакет одна блокировка баланса
+    """
+    serializer = BulkRefundSerializer(data=criteria)
+    serializer.is_valid(raise_exception=True)
+    params = serializer.validated_data
+
+    queryset = Payment.objects.filter(status=Payment.STATUS_SUCCESS)
+    if "payment_ids" in params:
+        queryset = queryset.filter(pk__in=params["payment_ids"])
+    if "user" in params:
+        queryset = queryset.filter(invoice__user_id=params["user"])
+    if "invoice" in params:
+        queryset = queryset.filter(invoice_id=params["invoice"])
+    if "created_from" in params:
+        queryset = queryset.filter(created_at__gte=params["created_from"])
+    if "created_to" in params:
+        queryset = queryset.filter(created_at__lt=params["created_to"])
+
+    by_user = {}
+    for payment_id, user_id in queryset.values_list("id", "invoice__user_id").iterator(chunk_size=5000):
+        by_user.setdefault(str(user_id), []).append(str(payment_id))
+    matched = sum(len(ids) for ids in by_user.values())
+
+    # Запрошенные по id, но не подходящие платежи учитываем как пропущенные
+    requested = len(set(params["payment_ids"])) if "payment_ids" in params else matched
+    refund_jobs.start(job_id, requested)
+    if requested > matched:
+        refund_jobs.add(job_id, skipped=requested - matched)
+
+    size = settings.REFUND_BATCH_SIZE
+    batches = [
+        refund_user_payments_task.s(job_id, user_id, ids[start:start + size])
+        for user_id, ids in by_user.items()
+        for start in range(0, len(ids), size)
+    ]
+    if batches:
+        group(batches).apply_async()
+    logger.info("Массовый возврат %s: платежей=%s пользователей=%s пакетов=%s",
+                job_id, matched, len(by_user), len(batches))
+
+
+@shared_task
+def refund_user_payments_task(job_id: str, user_id: str, payment_ids: list[str]):
+    try:
+        refunded = billing.refund_payments_batch(user_id, payment_ids)
+    except Exception:
+        logger.exception("Failed to refund batch of %s payments for user %s", len(payment_ids), user_id)
+        refund_jobs.add(job_id, failed=len(payment_ids))
+        return
+    refund_jobs.add(job_id, refunded=len(refunded), skipped=len(payment_ids) - len(refunded))
+
+
+@shared_task
+def rebalance_user_balance_task(user_id: str):
+    if striping.rebalance(user_id):
+        logger.info("Шарды баланса пользователя %s выровнены", user_id)
+
+
+@shared_task
+def rebalance_striped_balances_task():
+    user_ids = UserBalance.objects.filter(stripes__gt=1).values_list("user_id", flat=True)
+    for user_id in user_ids.iterator():
+        rebalance_user_balance_task.delay(str(user_id))
+
+
+@shared_task
+def rollup_ledger_task():
+    """Сворачиваем журнал проводок в снимки балансов"""
+    users = 0
+    entries = 0
+    for user_id in ledger.users_pending_rollup().iterator():
+        entries += ledger.rollup(user_id)
+        users += 1
+    if users:
+        logger.info("Свертка журнала: пользователей=%s проводок=%s", users, entries)
+
+
+@shared_task
+def persist_redis_balances_task():
+    """Отложенная запись балансов из Redis в UserBalance (режим redis)"""
+    if not redis_balance.enabled():
+        return
+    entries = redis_balance.drain()
+    if entries:
+        logger.info("Балансы из Redis записаны: изменений=%s", entries)
+
+
+@shared_task
+def relay_outbox_task():
+    """Страховка ретранслятора outbox: публикуем то, что не успел отдельный процесс"""
+    published = outbox.drain()
+    if published:
+        logger.info("Опубликовано сообщений outbox: %s", published)
+
+
+@shared_task
+def capture_authorized_payments_task():
+    """Пакетное списание авторизованных платежей (двухэтапный поток)"""
+    captured = declined = 0
+    for _ in range(settings.PAYMENT_CAPTURE_MAX_BATCHES):
+        try:
+            batch_captured, batch_declined = capture.capture_due(settings.PAYMENT_CAPTURE_BATCH_SIZE)
+        except ProviderUnavailable as exc:
+            logger.info("Provider unavailable, capture postponed: %s", exc)
+            break
+        except payment_processor.ExternalPaymentError as exc:
+            logger.warning("Capture batch failed, payments stay authorized: %s", exc)
+            break
+        captured += batch_captured
+        declined += batch_declined
+        if batch_captured + batch_declined < settings.PAYMENT_CAPTURE_BATCH_SIZE:
+            break
+    if captured or declined:
+        logger.info("Пакетное списание: списано=%s отклонено=%s", captured, declined)
+
+
+@shared_task
+def release_expired_authorizations_task():
+    """Освобождаем резерв платежей, удержание которых истекло до списания"""
+    released = 0
+    for _ in range(settings.PAYMENT_CAPTURE_MAX_BATCHES):
+        batch = capture.release_expired(settings.PAYMENT_CAPTURE_BATCH_SIZE)
+        released += batch
+        if batch < settings.PAYMENT_CAPTURE_BATCH_SIZE:
+            break
+    if released:
+        logger.info("Освобождены истекшие удержания: %s", released)
+
+
+@shared_task
+def drain_parked_invoices_task():
+    """Возвращаем в обработку отложенные счета, у которых наступило время повтора"""
+    invoice_ids = parking.take_due(settings.PARKED_INVOICES_DRAIN_BATCH)
+    if invoice_ids:
+        _dispatch_invoices(invoice_ids)
+        logger.info("Отложенные счета возвращены в обработку: %s", len(invoice_ids))
+
+
+@shared_task
+def sweep_stuck_invoices_task():
+    """Возвращаем в обработку или компенсируем зависшие pending/reserved счета"""
+    stats = sweeper.sweep(_dispatch_invoices)
+    if stats["scanned"]:
+        logger.info("Восстановление зависших счетов: %s", stats, extra={"sweeper": stats})
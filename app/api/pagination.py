@@ -0,0 +1,130 @@
+import base64
+import json
+import uuid
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничная выдача по ключу (created_at, id) от новых к старым.
+    Курсор хранит последнюю строку страницы, поэтому стоимость выборки не зависит
+    от глубины листания (в отличие от OFFSET). Нужен индекс (created_at DESC, id DESC).
+    """
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+    ordering = ("-created_at", "-id")
+
+    @staticmethod
+    def _query_params(request):
+        # Работает и с запросом DRF, и с обычным HttpRequest (async-представления)
+        return getattr(request, "query_params", request.GET)
+
+    def get_page_size(self, request) -> int:
+        page_size = settings.API_PAGE_SIZE
+        value = self._query_params(request).get(self.page_size_query_param)
+        if value:
+            try:
+                page_size = int(value)
+            except ValueError:
+                raise ValidationError({self.page_size_query_param: "Должно быть целым числом"})
+        return max(1, min(page_size, self.max_page_size))
+
+    @staticmethod
+    def encode_cursor_values(created_at, pk) -> str:
+        payload = json.dumps({"c": created_at.isoformat(), "i": str(pk)})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    @classmethod
+    def encode_cursor(cls, obj) -> str:
+        return cls.encode_cursor_values(obj.created_at, obj.pk)
+
+    def decode_cursor(self, request):
+        value = self._query_params(request).get(self.cursor_query_param)
+        if not value:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(value.encode()))
+            created_at = parse_datetime(payload["c"])
+            pk = uuid.UUID(payload["i"])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            created_at = None
+        if created_at is None:
+            raise ValidationError({self.cursor_query_param: "Неверный курсор"})
+        return created_at, pk
+
+    def filter_after(self, queryset, cursor):
+        created_at, pk = cursor
+        # Первое условие дает индексу границу диапазона, второе — разрешает равные created_at
+        return queryset.filter(
+            Q(created_at__lte=created_at) & (Q(created_at__lt=created_at) | Q(id__lt=pk))
+        )
+
+    def _page_queryset(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = self.filter_after(queryset, cursor)
+        return queryset[:self.page_size + 1]
+
+    def _finish_page(self, rows: list) -> list:
+        page = rows[:self.page_size]
+        self.next_cursor = self.encode_cursor(page[-1]) if len(rows) > self.page_size else None
+        return page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self._finish_page(list(self._page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request) -> list:
+        """Асинхронный вариант для представлений на async ORM"""
+        return self._finish_page([obj async for obj in self._page_queryset(queryset, request)])
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "next_cursor": self.next_cursor,
+            "results": data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "next_cursor": {"type": "string", "nullable": True},
+                "results": schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Курсор следующей страницы (next_cursor из предыдущего ответа)",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": f"Размер страницы (не больше {self.max_page_size})",
+                "schema": {"type": "integer"},
+            },
+        ]
@@ -0,0 +1,254 @@
+"""
+Асинхронные версии API счетов для запуска под ASGI-сервером.
+DRF не поддерживает async-представления, поэтому здесь обычные Django-представления
+на async ORM. Аутентификация — Token и Basic, как в DRF (сессии не поддерживаются,
+поэтому CSRF-проверка не нужна).
+Поток статусов (SSE) и long-poll держат соединение открытым и работают только под ASGI.
+"""
+import base64
+import binascii
+import json
+import math
+import time
+import logging
+from asgiref.sync import sync_to_async
+from django.contrib.auth import aauthenticate
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import APIException
+from app.models import Invoice, Payment, User
+from app.api.pagination import KeysetPagination
+from .serializers import InvoiceCreateSerializer, InvoiceSerializer, PaymentSerializer, PaymentListFilterSerializer
+from .services import idempotency, invoice_cache, invoice_events, invoices as invoice_service, rate_limit
+
+logger = logging.getLogger(__name__)
+
+
+async def _authenticate(request) -> User | None:
+    header = request.headers.get("Authorization", "")
+    scheme, _, credentials = header.partition(" ")
+    scheme = scheme.lower()
+    if scheme == "token" and credentials:
+        token = await Token.objects.select_related("user").filter(key=credentials.strip()).afirst()
+        if token is not None and token.user.is_active:
+            return token.user
+    elif scheme == "basic" and credentials:
+        try:
+            username, _, password = base64.b64decode(credentials.strip()).decode("utf-8").partition(":")
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+        user = await aauthenticate(request, username=username, password=password)
+        if user is not None and user.is_active:
+            return user
+    return None
+
+
+def _unauthorized() -> JsonResponse:
+    response = JsonResponse(
+        {"detail": "Учетные данные не были предоставлены."}, status=status.HTTP_401_UNAUTHORIZED,
+    )
+    response["WWW-Authenticate"] = "Token"
+    return response
+
+
+def _error(exc: APIException) -> JsonResponse:
+    detail = exc.detail if isinstance(exc.detail, (dict, list)) else {"detail": exc.detail}
+    return JsonResponse(detail, status=exc.status_code, safe=False)
+
+
+def _not_found() -> JsonResponse:
+    return JsonResponse({"detail": "Не найдено."}, status=status.HTTP_404_NOT_FOUND)
+
+
+async def _invoice_snapshot(pk) -> tuple[int, dict] | None:
+    """Версия и снимок счета: из кэша, при промахе — из БД с заполнением кэша"""
+    cached = await sync_to_async(invoice_cache.get_versioned, thread_sensitive=False)(pk)
+    if cached is not None:
+        return cached
+    invoice = await Invoice.objects.filter(pk=pk).afirst()
+    if invoice is None:
+        return None
+    await sync_to_async(invoice_cache.store, thread_sensitive=False)(invoice, publish=False)
+    return invoice_cache.snapshot_of(invoice)
+
+
+@csrf_exempt
+@require_POST
+async def invoice_create(request):
+    """Создание счета (async)"""
+    user = await _authenticate(request)
+    if user is None:
+        return _unauthorized()
+
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"detail": "Некорректный JSON"}, status=status.HTTP_400_BAD_REQUEST)
+
+    merchant_id = data.get("user_id") if isinstance(data, dict) else None
+    buckets = rate_limit.invoice_buckets(user, 1, {str(merchant_id): 1} if merchant_id else None)
+    wait = await sync_to_async(rate_limit.take, thread_sensitive=False)(buckets)
+    if wait > 0:
+        response = JsonResponse(
+            {"detail": "Запрос был проигнорирован из-за ограничения частоты."},
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+        )
+        response["Retry-After"] = str(math.ceil(wait))
+        return response
+
+    serializer = InvoiceCreateSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    validated = dict(serializer.validated_data)
+    user_id = validated.pop("user_id")
+    validated["idempotency_key"] = validated.get("idempotency_key") or None
+    idempotency_key = validated["idempotency_key"]
+
+    claimed = False
+    if idempotency_key:
+        try:
+            claimed, cached = await sync_to_async(idempotency.acquire, thread_sensitive=False)(idempotency_key)
+        except APIException as exc:
+            return _error(exc)
+        if cached is not None:
+            return JsonResponse(cached, status=status.HTTP_201_CREATED)
+
+    try:
+        if not await User.objects.filter(pk=user_id).aexists():
+            return JsonResponse({"user_id": ["Пользователь не найден"]}, status=status.HTTP_400_BAD_REQUEST)
+        # Счет и сообщение outbox пишутся одной транзакцией; в async ORM транзакций нет,
+        # поэтому создание идет синхронной функцией, как и сами async-запросы ORM
+        invoice, _ = await sync_to_async(invoice_service.create_invoice)(user_id, validated)
+    except Exception:
+        if claimed:
+            await sync_to_async(idempotency.release, thread_sensitive=False)(idempotency_key)
+        raise
+
+    out = InvoiceSerializer(invoice).data
+    if claimed:
+        await sync_to_async(idempotency.store, thread_sensitive=False)(idempotency_key, out)
+    return JsonResponse(out, status=status.HTTP_201_CREATED)
+
+
+@require_GET
+async def invoice_detail(request, pk):
+    """Получить счет (async)"""
+    if await _authenticate(request) is None:
+        return _unauthorized()
+
+    snapshot = await _invoice_snapshot(pk)
+    if snapshot is None:
+        return _not_found()
+    return JsonResponse(snapshot[1])
+
+
+def _sse(version: int, invoice: dict) -> str:
+    return f"id: {version}\nevent: status\ndata: {json.dumps(invoice)}\n\n"
+
+
+async def _status_events(pk):
+    async with invoice_events.subscription(pk) as pubsub:
+        # Снимок читаем после подписки, чтобы не потерять переход между чтением и подпиской
+        snapshot = await _invoice_snapshot(pk)
+        if snapshot is None:
+            return
+        version, invoice = snapshot
+        yield _sse(version, invoice)
+
+        deadline = time.monotonic() + settings.INVOICE_STREAM_MAX_DURATION
+        while not invoice_events.is_terminal(invoice):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            event = await invoice_events.next_event(pubsub, min(settings.INVOICE_STREAM_HEARTBEAT, remaining))
+            if event is None:
+                # Комментарий SSE не дает прокси закрыть простаивающее соединение
+                yield ": keepalive\n\n"
+                continue
+            if event[0] <= version:
+                continue
+            version, invoice = event
+            yield _sse(version, invoice)
+
+
+@require_GET
+async def invoice_stream(request, pk):
+    """Поток статусов счета (Server-Sent Events) до конечного статуса"""
+    if await _authenticate(request) is None:
+        return _unauthorized()
+    if await _invoice_snapshot(pk) is None:
+        return _not_found()
+
+    response = StreamingHttpResponse(_status_events(pk), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@require_GET
+async def invoice_wait(request, pk):
+    """
+    Long-poll статуса счета: ответ, как только статус отличается от ?status=
+    (или счет в конечном статусе), иначе по истечении ?timeout= секунд с текущим снимком
+    """
+    if await _authenticate(request) is None:
+        return _unauthorized()
+    known_status = request.GET.get("status")
+    try:
+        timeout = float(request.GET.get("timeout", settings.INVOICE_LONG_POLL_TIMEOUT))
+    except ValueError:
+        return JsonResponse({"timeout": ["Ожидается число секунд"]}, status=status.HTTP_400_BAD_REQUEST)
+    timeout = max(0.0, min(timeout, settings.INVOICE_LONG_POLL_MAX_TIMEOUT))
+
+    async with invoice_events.subscription(pk) as pubsub:
+        snapshot = await _invoice_snapshot(pk)
+        if snapshot is None:
+            return _not_found()
+        version, invoice = snapshot
+
+        deadline = time.monotonic() + timeout
+        while invoice["status"] == known_status and not invoice_events.is_terminal(invoice):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            event = await invoice_events.next_event(pubsub, remaining)
+            if event is None:
+                break
+            if event[0] > version:
+                version, invoice = event
+    return JsonResponse(invoice)
+
+
+@require_GET
+async def payment_list(request):
+    """Список платежей (async, постранично по ключу)"""
+    if await _authenticate(request) is None:
+        return _unauthorized()
+
+    filters = PaymentListFilterSerializer(data=request.GET)
+    if not filters.is_valid():
+        return JsonResponse(filters.errors, status=status.HTTP_400_BAD_REQUEST)
+    params = filters.validated_data
+
+    queryset = Payment.objects.all()
+    if "status" in params:
+        queryset = queryset.filter(status=params["status"])
+    if "invoice" in params:
+        queryset = queryset.filter(invoice_id=params["invoice"])
+    if "user" in params:
+        queryset = queryset.filter(invoice__user_id=params["user"])
+
+    paginator = KeysetPagination()
+    try:
+        page = await paginator.apaginate_queryset(queryset, request)
+    except APIException as exc:
+        return _error(exc)
+    return JsonResponse({
+        "next": paginator.get_next_link(),
+        "next_cursor": paginator.next_cursor,
+        "results": PaymentSerializer(page, many=True).data,
+    })
@@ -1,4 +1,6 @@
 from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
 from app.models import Invoice, Payment
 from django.contrib.auth import get_user_model
@@ -22,17 +24,46 @@ class InvoiceCreateSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         user_id = validated_data.pop("user_id")
-        idempotency_key = validated_data.get("idempotency_key")
-        if idempotency_key:
-            existing = Invoice.objects.filter(idempotency_key=idempotency_key).first()
-            if existing:
-                return existing
+        validated_data["idempotency_key"] = validated_data.get("idempotency_key") or None
+        idempotency_key = validated_data["idempotency_key"]
 
         user = User.objects.get(pk=user_id)
-        invoice = Invoice.objects.create(user=user, **validated_data)
+        # Вместо предварительного поиска полагаемся на уникальный индекс:
+        # при гонке двух повторов второй получает уже созданный счет
+        try:
+            with transaction.atomic():
+                invoice = Invoice.objects.create(user=user, **validated_data)
+        except IntegrityError:
+            if not idempotency_key:
+                raise
+            self.created = False
+            return Invoice.objects.get(idempotency_key=idempotency_key)
+        self.created = True
         return invoice
 
 
+class InvoiceBulkCreateSerializer(serializers.Serializer):
+    # Элементы валидируются по отдельности, чтобы вернуть результат по каждому
+    invoices = serializers.ListField(
+        child=serializers.DictField(),
+        allow_empty=False,
+        max_length=settings.INVOICE_BULK_MAX_ITEMS,
+    )
+
+
+class InvoiceBulkResultSerializer(serializers.Serializer):
+    index = serializers.IntegerField()
+    status = serializers.CharField()
+    invoice = serializers.DictField(required=False)
+    errors = serializers.DictField(required=False)
+
+
+class InvoiceBulkCreateResponseSerializer(serializers.Serializer):
+    created = serializers.IntegerField()
+    total = serializers.IntegerField()
+    results = InvoiceBulkResultSerializer(many=True)
+
+
 class InvoiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Invoice
@@ -44,7 +75,65 @@ class PaymentSerializer(serializers.ModelSerializer):
         model = Payment
         fields = (
             "id", "invoice", "amount", "provider_transaction_id", "status",
-            "attempts", "last_error", "created_at", "updated_at"
+            "attempts", "last_error", "authorization_expires_at", "created_at", "updated_at"
         )
         read_only_fields = fields
 
+
+class PaymentListFilterSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Payment.STATUS_CHOICES, required=False)
+    invoice = serializers.UUIDField(required=False)
+    user = serializers.UUIDField(required=False)
+
+
+class ExportFilterSerializer(serializers.Serializer):
+    FORMAT_NDJSON = "ndjson"
+    FORMAT_CSV = "csv"
+
+    # Не "format": этот параметр запроса DRF использует для выбора рендерера
+    export_format = serializers.ChoiceField(choices=[FORMAT_NDJSON, FORMAT_CSV], default=FORMAT_NDJSON)
+    created_from = serializers.DateTimeField(required=False)
+    created_to = serializers.DateTimeField(required=False)
+    user = serializers.UUIDField(required=False)
+
+    def validate(self, attrs):
+        if "created_from" in attrs and "created_to" in attrs and attrs["created_from"] > attrs["created_to"]:
+            raise serializers.ValidationError({"created_to": "Конец периода раньше начала"})
+        return attrs
+
+
+class InvoiceExportFilterSerializer(ExportFilterSerializer):
+    status = serializers.ChoiceField(choices=Invoice.STATUS_CHOICES, required=False)
+
+
+class PaymentExportFilterSerializer(ExportFilterSerializer):
+    status = serializers.ChoiceField(choices=Payment.STATUS_CHOICES, required=False)
+    invoice = serializers.UUIDField(required=False)
+
+
+class BulkRefundSerializer(serializers.Serializer):
+    payment_ids = serializers.ListField(
+        child=serializers.UUIDField(), required=False, allow_empty=False,
+        max_length=settings.REFUND_BULK_MAX_IDS,
+    )
+    user = serializers.UUIDField(required=False)
+    invoice = serializers.UUIDField(required=False)
+    created_from = serializers.DateTimeField(required=False)
+    created_to = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        # Без условий запрос вернул бы все успешные платежи
+        if not attrs:
+            raise serializers.ValidationError("Укажите payment_ids или хотя бы один фильтр")
+        return attrs
+
+
+class RefundJobSerializer(serializers.Serializer):
+    job_id = serializers.CharField()
+    status = serializers.CharField()
+    total = serializers.IntegerField()
+    refunded = serializers.IntegerField()
+    skipped = serializers.IntegerField()
+    failed = serializers.IntegerField()
+    created_at = serializers.CharField()
+    finished_at = serializers.CharField(required=False)
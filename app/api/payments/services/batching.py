@@ -0,0 +1,41 @@
+"""
+Буфер счетов для пакетной обработки (INVOICE_BATCH_ENABLED).
+Id счетов копятся в списке Redis; пакетная задача запускается через
+INVOICE_BATCH_MAX_LINGER секунд после первого id или сразу при заполнении пакета.
+"""
+from django.conf import settings
+from app.redis_client import redis_client
+
+BUFFER_KEY = "invoices:batch:buffer"
+SCHEDULED_KEY = "invoices:batch:scheduled"
+FLUSH_KEY = "invoices:batch:flush"
+
+
+def push(invoice_ids: list[str]) -> float | None:
+    """
+    Кладем id в буфер.
+    Возвращаем задержку запуска пакетной задачи, если ее нужно запланировать, иначе None.
+    """
+    length = redis_client.rpush(BUFFER_KEY, *invoice_ids)
+    linger = settings.INVOICE_BATCH_MAX_LINGER
+    # Флаги живут дольше задержки, чтобы не плодить задачи, пока запланированная не стартовала
+    ttl = max(1, int(linger * 10))
+    if length >= settings.INVOICE_BATCH_MAX_SIZE and redis_client.set(FLUSH_KEY, "1", nx=True, ex=ttl):
+        return 0.0
+    if redis_client.set(SCHEDULED_KEY, "1", nx=True, ex=ttl):
+        return linger
+    return None
+
+
+def drain(max_size: int) -> tuple[list[str], int]:
+    """
+    Атомарно забираем до max_size id и сбрасываем флаги планирования.
+    Возвращаем id и количество оставшихся в буфере.
+    """
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(SCHEDULED_KEY, FLUSH_KEY)
+    pipe.lrange(BUFFER_KEY, 0, max_size - 1)
+    pipe.ltrim(BUFFER_KEY, max_size, -1)
+    pipe.llen(BUFFER_KEY)
+    _, invoice_ids, _, remaining = pipe.execute()
+    return list(dict.fromkeys(invoice_ids)), remaining
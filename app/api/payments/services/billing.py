@@ -1,9 +1,12 @@
+from datetime import timedelta
 from decimal import Decimal
+from django.conf import settings
 from django.db import transaction
-from django.shortcuts import get_object_or_404
-from app.models import Invoice, Payment, UserBalance
+from django.utils import timezone
+from app import metrics
+from app.models import Invoice, Payment, UserBalance, UserBalanceShard
+from app.api.payments.services import invoice_cache, invoice_events, ledger, optimistic_balance, redis_balance, striping
 from django.contrib.auth import get_user_model
-from django.db.utils import IntegrityError
 
 User = get_user_model()
 
@@ -17,88 +20,417 @@ def ensure_user_balance(user: User) -> UserBalance:
     return ub
 
 
-@transaction.atomic
-def reserve_funds(invoice: Invoice) -> bool:
-    user = invoice.user
-    balance = ensure_user_balance(user)
+def lock_user_balance(user_id) -> UserBalance:
+    """Блокируем основную строку баланса одним запросом (создаем, если ее еще нет)"""
+    with metrics.lock_wait("balance"):
+        balance = UserBalance.objects.select_for_update().filter(user_id=user_id).first()
+    if balance is None:
+        UserBalance.objects.get_or_create(user_id=user_id)
+        with metrics.lock_wait("balance"):
+            balance = UserBalance.objects.select_for_update().get(user_id=user_id)
+    return balance
+
+
+def lock_invoice_balance(invoice: Invoice) -> UserBalance | UserBalanceShard:
+    """
+    Блокируем строку баланса, в которой зарезервированы средства счета:
+    шард (если баланс разбит) или основную строку пользователя
+    """
+    if invoice.balance_shard_id:
+        with metrics.lock_wait("shard"):
+            shard = UserBalanceShard.objects.select_for_update().filter(pk=invoice.balance_shard_id).first()
+        if shard is not None:
+            return shard
+    return lock_user_balance(invoice.user_id)
+
+
+def _lock_reserve_target(user_id, amount: Decimal) -> UserBalance | UserBalanceShard | None:
+    # Обычный баланс блокируется сразу; строка разбитого баланса под условие не попадает
+    # и не блокируется, тогда резервируем в шарде
+    with metrics.lock_wait("balance"):
+        balance = UserBalance.objects.select_for_update().filter(user_id=user_id, stripes__lte=1).first()
+    if balance is not None:
+        return balance
+    with metrics.lock_wait("shard"):
+        shard = striping.lock_shard_for_reserve(user_id, amount)
+    if shard is not None:
+        return shard
+    balance, _ = UserBalance.objects.get_or_create(user_id=user_id)
+    if balance.is_striped:
+        return None
+    with metrics.lock_wait("balance"):
+        return UserBalance.objects.select_for_update().get(pk=balance.pk)
+
+
+def _transitioned(invoices: list[Invoice]):
+    """После коммита: снимки счетов в кэш и метрики конечных статусов"""
+    invoice_cache.store_on_commit(invoices)
+    terminal = {}
+    for invoice in invoices:
+        if invoice.status in invoice_events.TERMINAL_STATUSES:
+            terminal.setdefault(invoice.status, []).append(invoice)
+    for status, items in terminal.items():
+        metrics.observe_terminal_on_commit(items, status)
+
 
+# Функции биллинга вызываются как отдельно, так и внутри транзакции задачи.
+# savepoint=False: во вложенном вызове не тратим запросы на SAVEPOINT/RELEASE,
+# на верхнем уровне это обычная транзакция.
+@transaction.atomic(savepoint=False)
+def reserve_funds(invoice: Invoice) -> bool:
     amount = invoice.amount
-    balance = UserBalance.objects.select_for_update().get(pk=balance.pk)
-    success = balance.reserve(amount)
-    if success:
-        invoice.status = Invoice.STATUS_RESERVED
-        invoice.save(update_fields=["status", "updated_at"])
-        return True
+    if ledger.enabled():
+        # Журнал: только вставка проводок, строка баланса не блокируется
+        success = ledger.reserve(invoice, amount)
+    elif redis_balance.enabled():
+        # Остаток проверяется и удерживается скриптом в Redis, в Postgres изменение попадет отложенно
+        success = redis_balance.reserve(invoice, amount)
+    elif optimistic_balance.enabled():
+        # Проверка остатка и резерв одним условным UPDATE, без чтения строки под блокировкой
+        success = optimistic_balance.reserve(invoice.user_id, amount)
+    else:
+        target = _lock_reserve_target(invoice.user_id, amount)
+        success = target is not None and target.reserve(amount)
+        invoice.balance_shard = target if success and isinstance(target, UserBalanceShard) else None
+
+    invoice.status = Invoice.STATUS_RESERVED if success else Invoice.STATUS_FAILED
+    invoice.save(update_fields=["status", "balance_shard", "updated_at"])
+    _transitioned([invoice])
+    return success
+
+
+@transaction.atomic(savepoint=False)
+def begin_payment(invoice: Invoice) -> Payment | None:
+    """
+    Фаза резервирования: резерв средств и платеж в одной транзакции.
+    Счет должен быть заблокирован вызывающим кодом.
+    Возвращает None, если средств недостаточно.
+    """
+    payment = None
+    if invoice.status != Invoice.STATUS_PENDING:
+        # Повторная обработка: платеж мог остаться с прошлой попытки
+        payment = Payment.objects.filter(invoice_id=invoice.pk).first()
+
+    if invoice.status != Invoice.STATUS_RESERVED and not reserve_funds(invoice):
+        return None
+
+    if payment is None:
+        payment = Payment.objects.create(invoice=invoice, amount=invoice.amount)
+    payment.invoice = invoice
+    return payment
+
+
+@transaction.atomic(savepoint=False)
+def reserve_funds_batch(user_id, invoice_ids: list) -> list[Payment]:
+    """
+    Резервируем средства под пакет счетов одного пользователя за одну блокировку баланса.
+    Счета обрабатываются от старых к новым, пока хватает средств; остальные помечаются failed.
+    Счета, заблокированные другим обработчиком, пропускаются.
+    Возвращает созданные платежи для зарезервированных счетов.
+    """
+    invoices = list(
+        Invoice.objects.select_for_update(skip_locked=True)
+        .filter(pk__in=invoice_ids, user_id=user_id, status=Invoice.STATUS_PENDING)
+        .order_by("created_at", "id")
+    )
+    if not invoices:
+        return []
+
+    reserved, failed = [], []
+    if redis_balance.enabled():
+        results = redis_balance.apply(
+            user_id, [(redis_balance.OP_RESERVE, invoice.pk, invoice.amount) for invoice in invoices],
+        )
+        for invoice, ok in zip(invoices, results):
+            (reserved if ok else failed).append(invoice)
+    elif optimistic_balance.enabled():
+        reserved, failed = optimistic_balance.reserve_many(user_id, invoices)
+    else:
+        balance = lock_user_balance(user_id)
+        available = balance.available()
+        for invoice in invoices:
+            if Decimal("0.00") < invoice.amount <= available:
+                available -= invoice.amount
+                reserved.append(invoice)
+            else:
+                failed.append(invoice)
+        if reserved:
+            balance.reserved += sum(invoice.amount for invoice in reserved)
+            balance.save(update_fields=["reserved", "updated_at"])
+
+    now = timezone.now()
+    if reserved:
+        Invoice.objects.filter(pk__in=[i.pk for i in reserved]).update(status=Invoice.STATUS_RESERVED, updated_at=now)
+    if failed:
+        Invoice.objects.filter(pk__in=[i.pk for i in failed]).update(status=Invoice.STATUS_FAILED, updated_at=now)
+    for invoice in reserved:
+        invoice.status, invoice.updated_at = Invoice.STATUS_RESERVED, now
+    for invoice in failed:
+        invoice.status, invoice.updated_at = Invoice.STATUS_FAILED, now
+    _transitioned(invoices)
+
+    return Payment.objects.bulk_create([
+        Payment(invoice=invoice, amount=invoice.amount, attempts=1) for invoice in reserved
+    ])
+
+
+def _settle_balances(user_id, succeeded: list[Payment], failed: list[Payment]):
+    """Списание резерва успешных и освобождение резерва неуспешных платежей одного пользователя"""
+    if ledger.enabled():
+        ok = all([ledger.debit_reserved(p.invoice, p.amount) for p in succeeded]
+                 + [ledger.release(p.invoice, p.amount) for p in failed])
+    elif redis_balance.enabled():
+        ok = all(redis_balance.apply(
+            user_id,
+            [(redis_balance.OP_DEBIT, p.invoice_id, p.amount) for p in succeeded]
+            + [(redis_balance.OP_RELEASE, p.invoice_id, p.amount) for p in failed],
+        ))
+    elif optimistic_balance.enabled():
+        ok = optimistic_balance.settle(
+            user_id,
+            sum((p.amount for p in succeeded), Decimal("0.00")),
+            sum((p.amount for p in failed), Decimal("0.00")),
+        )
     else:
-        invoice.status = Invoice.STATUS_FAILED
-        invoice.save(update_fields=["status", "updated_at"])
+        # Суммы по строкам баланса: основная (None) и шарды; порядок блокировок как в striping
+        amounts = {}
+        for payments, kind in ((succeeded, 0), (failed, 1)):
+            for p in payments:
+                row = amounts.setdefault(p.invoice.balance_shard_id, [Decimal("0.00"), Decimal("0.00")])
+                row[kind] += p.amount
+        rows = []
+        header = amounts.pop(None, None)
+        if header:
+            rows.append((lock_user_balance(user_id), *header))
+        if amounts:
+            with metrics.lock_wait("shard"):
+                shards = list(UserBalanceShard.objects.select_for_update().filter(pk__in=amounts).order_by("index"))
+            rows += [(shard, *amounts[shard.pk]) for shard in shards]
+        ok = True
+        for balance, debit, release in rows:
+            if balance.reserved < debit + release:
+                ok = False
+                break
+            balance.reserved -= debit + release
+            balance.balance = max(Decimal("0.00"), balance.balance - debit)
+            balance.save(update_fields=["balance", "reserved", "updated_at"])
+    if not ok:
+        raise BillingError("Не удается списать зарезервированные средства (недостаточно зарезервировано)")
+
+
+@transaction.atomic(savepoint=False)
+def settle_payments_batch(user_id, succeeded: list[Payment], failed: list[Payment]):
+    """
+    Списываем успешные и освобождаем резерв неуспешных платежей пакета
+    одной блокировкой баланса, статусы обновляются пакетно
+    """
+    if not succeeded and not failed:
+        return
+    _settle_balances(user_id, succeeded, failed)
+
+    now = timezone.now()
+    for payment in succeeded:
+        payment.status = Payment.STATUS_SUCCESS
+        payment.provider_transaction_id = payment.provider_transaction_id or ""
+        payment.updated_at = now
+    for payment in failed:
+        payment.status = Payment.STATUS_FAILED
+        payment.updated_at = now
+    Payment.objects.bulk_update(
+        succeeded + failed, ["status", "provider_transaction_id", "last_error", "updated_at"],
+    )
+    if succeeded:
+        Invoice.objects.filter(pk__in=[p.invoice_id for p in succeeded]).update(
+            status=Invoice.STATUS_COMPLETED, updated_at=now,
+        )
+    if failed:
+        Invoice.objects.filter(pk__in=[p.invoice_id for p in failed]).update(
+            status=Invoice.STATUS_FAILED, updated_at=now,
+        )
+    for payment in succeeded:
+        payment.invoice.status, payment.invoice.updated_at = Invoice.STATUS_COMPLETED, now
+    for payment in failed:
+        payment.invoice.status, payment.invoice.updated_at = Invoice.STATUS_FAILED, now
+    _transitioned([payment.invoice for payment in succeeded + failed])
+
+
+@transaction.atomic(savepoint=False)
+def authorize_payments(payments: list[Payment]):
+    """
+    Провайдер удержал средства: платежи ждут пакетного списания (capture),
+    резерв в балансе сохраняется до списания или истечения удержания
+    """
+    if not payments:
+        return
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.PAYMENT_AUTHORIZATION_TTL)
+    for payment in payments:
+        payment.status = Payment.STATUS_AUTHORIZED
+        payment.authorized_at, payment.authorization_expires_at = now, expires_at
+        payment.updated_at = now
+    Payment.objects.bulk_update(payments, [
+        "status", "provider_transaction_id", "attempts", "authorized_at", "authorization_expires_at", "updated_at",
+    ])
+
+
+@transaction.atomic(savepoint=False)
+def settle_authorized(succeeded: list[Payment], failed: list[Payment]):
+    """
+    Завершаем авторизованные платежи разных пользователей в одной транзакции:
+    списанные — success, отклоненные и истекшие — failed с освобождением резерва.
+    Пользователи обрабатываются по возрастанию id, поэтому параллельные пакеты
+    берут блокировки балансов в одном порядке.
+    """
+    by_user = {}
+    for payment in succeeded:
+        by_user.setdefault(payment.invoice.user_id, ([], []))[0].append(payment)
+    for payment in failed:
+        by_user.setdefault(payment.invoice.user_id, ([], []))[1].append(payment)
+    for user_id in sorted(by_user, key=str):
+        settle_payments_batch(user_id, *by_user[user_id])
+
+
+def _claim_pending(payment: Payment, status: str) -> bool:
+    """
+    Переводим платеж из pending в status условным UPDATE: строка платежа блокируется до конца
+    транзакции, а повторная доставка задачи или параллельный обработчик, завершивший платеж
+    раньше, не меняет баланс второй раз
+    """
+    now = timezone.now()
+    claimed = Payment.objects.filter(pk=payment.pk, status=Payment.STATUS_PENDING).update(
+        status=status,
+        provider_transaction_id=payment.provider_transaction_id or "",
+        attempts=payment.attempts,
+        last_error=payment.last_error,
+        updated_at=now,
+    )
+    if not claimed:
         return False
+    payment.status, payment.updated_at = status, now
+    payment.provider_transaction_id = payment.provider_transaction_id or ""
+    return True
 
 
-@transaction.atomic
+@transaction.atomic(savepoint=False)
 def complete_payment(payment: Payment) -> bool:
+    """Списание резерва успешного платежа. False — платеж уже не pending, баланс не менялся"""
+    if not _claim_pending(payment, Payment.STATUS_SUCCESS):
+        return False
     invoice = payment.invoice
-    user = invoice.user
-    balance = ensure_user_balance(user)
-    balance = UserBalance.objects.select_for_update().get(pk=balance.pk)
-
     amount = payment.amount
-    ok = balance.debit_reserved(amount)
+    if ledger.enabled():
+        ok = ledger.debit_reserved(invoice, amount)
+    elif redis_balance.enabled():
+        ok = redis_balance.debit_reserved(invoice, amount)
+    elif optimistic_balance.enabled():
+        ok = optimistic_balance.debit_reserved(invoice.user_id, amount)
+    else:
+        ok = lock_invoice_balance(invoice).debit_reserved(amount)
     if not ok:
         raise BillingError("Не удается списать зарезервированные средства (недостаточно зарезервировано)")
 
-    payment.status = Payment.STATUS_SUCCESS
-    payment.provider_transaction_id = payment.provider_transaction_id or ""
-    payment.save(update_fields=["status", "provider_transaction_id", "updated_at"])
-
     invoice.status = Invoice.STATUS_COMPLETED
     invoice.save(update_fields=["status", "updated_at"])
+    _transitioned([invoice])
     return True
 
 
-@transaction.atomic
-def compensate_payment(payment: Payment, reason: str = ""):
+@transaction.atomic(savepoint=False)
+def compensate_payment(payment: Payment, reason: str = "") -> bool:
+    """Возврат резерва неуспешного платежа. False — платеж уже не pending, баланс не менялся"""
+    payment.last_error = reason or payment.last_error
+    if not _claim_pending(payment, Payment.STATUS_FAILED):
+        return False
     invoice = payment.invoice
-    user = invoice.user
-    balance = ensure_user_balance(user)
-    balance = UserBalance.objects.select_for_update().get(pk=balance.pk)
-
     amount = payment.amount
-    if balance.reserved >= amount:
-        balance.release(amount)
+    if ledger.enabled():
+        if not ledger.release(invoice, amount):
+            ledger.credit(invoice.user_id, amount, invoice)
+    elif redis_balance.enabled():
+        if not redis_balance.release(invoice, amount):
+            redis_balance.credit(invoice.user_id, amount, invoice)
+    elif optimistic_balance.enabled():
+        if not optimistic_balance.release(invoice.user_id, amount):
+            optimistic_balance.credit(invoice.user_id, amount)
     else:
-        balance.credit(amount)
-
-    payment.status = Payment.STATUS_FAILED
-    payment.last_error = reason or payment.last_error
-    payment.save(update_fields=["status", "last_error", "updated_at"])
+        balance = lock_invoice_balance(invoice)
+        if balance.reserved >= amount:
+            balance.release(amount)
+        else:
+            balance.credit(amount)
 
     invoice.status = Invoice.STATUS_FAILED
     invoice.save(update_fields=["status", "updated_at"])
+    _transitioned([invoice])
+    return True
+
+
+@transaction.atomic(savepoint=False)
+def refund_payments_batch(user_id, payment_ids: list) -> list[Payment]:
+    """
+    Возврат пакета успешных платежей одного пользователя: баланс (и каждый шард) пополняется
+    один раз суммой, статусы платежей и счетов обновляются пакетно.
+    Платежи не в статусе success пропускаются. Возвращает возвращенные платежи.
+    """
+    payments = list(
+        Payment.objects.select_for_update(of=("self",)).select_related("invoice")
+        .filter(pk__in=payment_ids, invoice__user_id=user_id, status=Payment.STATUS_SUCCESS)
+        .order_by("pk")
+    )
+    if not payments:
+        return []
 
+    if ledger.enabled():
+        ledger.credit_many(user_id, [(payment.invoice, payment.amount) for payment in payments])
+    elif redis_balance.enabled():
+        redis_balance.credit_many(user_id, [(payment.invoice, payment.amount) for payment in payments])
+    elif optimistic_balance.enabled():
+        optimistic_balance.credit(user_id, sum((payment.amount for payment in payments), Decimal("0.00")))
+    else:
+        by_shard = {}
+        for payment in payments:
+            shard_id = payment.invoice.balance_shard_id
+            by_shard[shard_id] = by_shard.get(shard_id, Decimal("0.00")) + payment.amount
+        # Порядок блокировок как в striping: основная строка, затем шарды по индексу
+        header_amount = by_shard.pop(None, Decimal("0.00"))
+        if header_amount:
+            lock_user_balance(user_id).credit(header_amount)
+        if by_shard:
+            with metrics.lock_wait("shard"):
+                shards = list(UserBalanceShard.objects.select_for_update().filter(pk__in=by_shard).order_by("index"))
+            for shard in shards:
+                shard.credit(by_shard[shard.pk])
+
+    now = timezone.now()
+    Payment.objects.filter(pk__in=[p.pk for p in payments]).update(status=Payment.STATUS_REFUNDED, updated_at=now)
+    Invoice.objects.filter(pk__in=[p.invoice_id for p in payments]).update(status=Invoice.STATUS_REFUNDED, updated_at=now)
+    for payment in payments:
+        payment.status, payment.updated_at = Payment.STATUS_REFUNDED, now
+        payment.invoice.status, payment.invoice.updated_at = Invoice.STATUS_REFUNDED, now
+    _transitioned([payment.invoice for payment in payments])
+    return payments
 
-@transaction.atomic
+
+@transaction.atomic(savepoint=False)
 def refund_payment(payment: Payment) -> bool:
     if payment.status != Payment.STATUS_SUCCESS:
         return False
 
     invoice = payment.invoice
-    user = invoice.user
-    balance = ensure_user_balance(user)
-    balance = UserBalance.objects.select_for_update().get(pk=balance.pk)
-
     amount = payment.amount
-    balance.credit(amount)
+    if ledger.enabled():
+        ledger.credit(invoice.user_id, amount, invoice)
+    elif redis_balance.enabled():
+        redis_balance.credit(invoice.user_id, amount, invoice)
+    elif optimistic_balance.enabled():
+        optimistic_balance.credit(invoice.user_id, amount)
+    else:
+        lock_invoice_balance(invoice).credit(amount)
 
     payment.status = Payment.STATUS_REFUNDED
     payment.save(update_fields=["status", "updated_at"])
 
     invoice.status = Invoice.STATUS_REFUNDED
     invoice.save(update_fields=["status", "updated_at"])
+    _transitioned([invoice])
     return True
-
-
-
-
-
-
@@ -0,0 +1,64 @@
+"""
+Двухэтапная оплата (PAYMENT_FLOW = "authorize_capture").
+
+Задача обработки счета только авторизует платеж: провайдер удерживает средства,
+резерв в балансе остается, платеж переходит в authorized со сроком удержания.
+Списание идет пакетами: авторизованные платежи выбираются по частичному индексу
+payment_authorized_idx под SELECT ... FOR UPDATE SKIP LOCKED, списываются одним вызовом
+провайдера и завершаются в одной транзакции (по одной блокировке баланса на пользователя).
+Если провайдер недоступен, платежи остаются authorized до следующего прохода.
+Удержания, срок которых истек, освобождаются: платеж и счет — failed, резерв возвращается.
+"""
+from django.db import transaction
+from django.utils import timezone
+from app.models import Payment
+from app.api.payments.services import billing, payment_processor
+from app.api.payments.services.circuit_breaker import guarded_call
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _authorized():
+    return (
+        Payment.objects.select_for_update(skip_locked=True, of=("self",))
+        .select_related("invoice")
+        .filter(status=Payment.STATUS_AUTHORIZED)
+        .order_by("authorization_expires_at")
+    )
+
+
+@transaction.atomic
+def capture_due(limit: int) -> tuple[int, int]:
+    """
+    Списываем один пакет авторизованных платежей с действующим удержанием.
+    Возвращает (списано, отклонено). Ошибки провайдера пробрасываются, пакет остается authorized;
+    платежи, которые провайдер не обработал, остаются authorized до следующего прохода.
+    """
+    payments = list(_authorized().filter(authorization_expires_at__gt=timezone.now())[:limit])
+    if not payments:
+        return 0, 0
+
+    results = guarded_call(payment_processor.capture_batch, payments)
+    succeeded, failed = [], []
+    for payment in payments:
+        result = results[payment.pk]
+        if result.get("retry"):
+            continue
+        if result["success"]:
+            succeeded.append(payment)
+        else:
+            payment.last_error = result.get("message", "unknown")
+            failed.append(payment)
+    billing.settle_authorized(succeeded, failed)
+    return len(succeeded), len(failed)
+
+
+@transaction.atomic
+def release_expired(limit: int) -> int:
+    """Освобождаем один пакет удержаний с истекшим сроком. Возвращает количество платежей"""
+    payments = list(_authorized().filter(authorization_expires_at__lte=timezone.now())[:limit])
+    for payment in payments:
+        payment.last_error = "Срок авторизации истек"
+    billing.settle_authorized([], payments)
+    return len(payments)
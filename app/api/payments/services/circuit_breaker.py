@@ -0,0 +1,262 @@
+"""
+Circuit breaker и bulkhead для вызовов платежного провайдера.
+Состояние хранится в Redis и общее для всех воркеров:
+- closed: вызовы проходят, подряд идущие ошибки считаются;
+- open: после failure_threshold ошибок вызовы сразу отклоняются на recovery_timeout секунд;
+- half_open: пропускается не больше half_open_probes пробных вызовов,
+  столько же успешных подряд закрывают breaker, любая ошибка снова открывает.
+  Пробы — ZSET с временем начала, как у bulkhead: проба упавшего воркера вычищается
+  через probe_ttl и не занимает место навсегда.
+Bulkhead ограничивает число одновременных вызовов провайдера во всем пуле воркеров.
+Если Redis недоступен, защита не мешает вызовам.
+"""
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+from redis.exceptions import RedisError
+from app import metrics
+from app.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# KEYS: состояние, ZSET проб. Возвращает {allowed, state, retry_after, transition}
+_BEFORE_CALL = redis_client.register_script("""
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+local now = tonumber(ARGV[1])
+local recovery = tonumber(ARGV[2])
+local probes = tonumber(ARGV[3])
+local probe_ttl = tonumber(ARGV[4])
+local transition = ''
+if state == 'open' then
+    local opened_at = tonumber(redis.call('HGET', KEYS[1], 'opened_at') or '0')
+    if now - opened_at < recovery then
+        return {0, state, tostring(recovery - (now - opened_at)), ''}
+    end
+    state = 'half_open'
+    transition = 'open->half_open'
+    redis.call('HSET', KEYS[1], 'state', state, 'successes', 0)
+    redis.call('DEL', KEYS[2])
+end
+if state == 'half_open' then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - probe_ttl)
+    if redis.call('ZCARD', KEYS[2]) >= probes then
+        return {0, state, tostring(recovery), transition}
+    end
+    redis.call('ZADD', KEYS[2], now, ARGV[5])
+    redis.call('EXPIRE', KEYS[2], math.ceil(probe_ttl))
+end
+return {1, state, '0', transition}
+""")
+
+# KEYS: состояние, ZSET проб. Возвращает переход состояния или ''
+_RECORD = redis_client.register_script("""
+local state = redis.call('HGET', KEYS[1], 'state') or 'closed'
+local success = ARGV[1] == '1'
+local now = ARGV[2]
+local threshold = tonumber(ARGV[3])
+local probes = tonumber(ARGV[4])
+if state == 'half_open' then
+    if ARGV[5] ~= '' then
+        redis.call('ZREM', KEYS[2], ARGV[5])
+    end
+    if not success then
+        redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', now, 'failures', 0)
+        redis.call('DEL', KEYS[2])
+        return 'half_open->open'
+    end
+    if redis.call('HINCRBY', KEYS[1], 'successes', 1) >= probes then
+        redis.call('HSET', KEYS[1], 'state', 'closed', 'failures', 0)
+        redis.call('DEL', KEYS[2])
+        return 'half_open->closed'
+    end
+    return ''
+end
+if state == 'open' then
+    return ''
+end
+if success then
+    redis.call('HSET', KEYS[1], 'failures', 0)
+    return ''
+end
+if redis.call('HINCRBY', KEYS[1], 'failures', 1) >= threshold then
+    redis.call('HSET', KEYS[1], 'state', 'open', 'opened_at', now, 'failures', 0)
+    return 'closed->open'
+end
+return ''
+""")
+
+# Семафор на ZSET: устаревшие захваты (упавший воркер) вычищаются по ttl
+_BULKHEAD_ACQUIRE = redis_client.register_script("""
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[3]))
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])))
+return 1
+""")
+
+
+class ProviderUnavailable(Exception):
+    """Вызов провайдера не выполнялся; повторить через retry_after секунд"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(ProviderUnavailable):
+    pass
+
+
+class BulkheadFull(ProviderUnavailable):
+    pass
+
+
+class CircuitBreaker:
+
+    def __init__(
+        self, name: str, failure_threshold: int, recovery_timeout: float, half_open_probes: int, probe_ttl: float,
+    ):
+        self.name = name
+        self.key = f"circuit:{name}"
+        self.probes_key = f"circuit:{name}:probes"
+        self.transitions_key = f"circuit:{name}:transitions"
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_probes = half_open_probes
+        self.probe_ttl = probe_ttl
+
+    def _transition(self, transition: str):
+        if not transition:
+            return
+        logger.warning("Circuit breaker %s: %s", self.name, transition)
+        metrics.PROVIDER_BREAKER_TRANSITIONS.labels(transition=transition).inc()
+        try:
+            redis_client.hincrby(self.transitions_key, transition, 1)
+        except RedisError:
+            pass
+
+    def before_call(self) -> str | None:
+        """Проверка перед вызовом. Возвращает токен пробы, если вызов допущен как проба в half_open"""
+        token = uuid.uuid4().hex
+        try:
+            allowed, state, retry_after, transition = _BEFORE_CALL(
+                keys=[self.key, self.probes_key],
+                args=[time.time(), self.recovery_timeout, self.half_open_probes, self.probe_ttl, token],
+            )
+        except RedisError:
+            logger.warning("Circuit breaker %s: Redis недоступен, вызов пропущен без проверки", self.name)
+            return None
+        self._transition(transition)
+        if not int(allowed):
+            raise CircuitOpen(f"Circuit breaker {self.name} is {state}", retry_after=float(retry_after))
+        return token if state == STATE_HALF_OPEN else None
+
+    def release_probe(self, probe: str):
+        """Пробный вызов не состоялся: освобождаем место пробы, результат не засчитывается"""
+        try:
+            redis_client.zrem(self.probes_key, probe)
+        except RedisError:
+            pass
+
+    def record(self, success: bool, probe: str | None = None):
+        try:
+            transition = _RECORD(
+                keys=[self.key, self.probes_key],
+                args=[
+                    "1" if success else "0", time.time(), self.failure_threshold, self.half_open_probes, probe or "",
+                ],
+            )
+        except RedisError:
+            return
+        self._transition(transition)
+
+    def state(self) -> str:
+        return redis_client.hget(self.key, "state") or STATE_CLOSED
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state(),
+            "transitions": {k: int(v) for k, v in redis_client.hgetall(self.transitions_key).items()},
+        }
+
+
+class Bulkhead:
+
+    def __init__(self, name: str, limit: int, ttl: float, retry_after: float):
+        self.name = name
+        self.key = f"bulkhead:{name}"
+        self.limit = limit
+        self.ttl = ttl
+        self.retry_after = retry_after
+
+    @contextmanager
+    def slot(self):
+        token = uuid.uuid4().hex
+        try:
+            acquired = _BULKHEAD_ACQUIRE(keys=[self.key], args=[time.time(), self.limit, self.ttl, token])
+        except RedisError:
+            acquired, token = 1, None
+        if not int(acquired):
+            raise BulkheadFull(f"Bulkhead {self.name} is full", retry_after=self.retry_after)
+        try:
+            yield
+        finally:
+            if token is not None:
+                try:
+                    redis_client.zrem(self.key, token)
+                except RedisError:
+                    pass
+
+    def in_flight(self) -> int:
+        return redis_client.zcard(self.key)
+
+
+def provider_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        "provider",
+        failure_threshold=settings.PROVIDER_BREAKER_FAILURE_THRESHOLD,
+        recovery_timeout=settings.PROVIDER_BREAKER_RECOVERY_TIMEOUT,
+        half_open_probes=settings.PROVIDER_BREAKER_HALF_OPEN_PROBES,
+        probe_ttl=settings.PROVIDER_BREAKER_PROBE_TTL,
+    )
+
+
+def provider_bulkhead() -> Bulkhead:
+    return Bulkhead(
+        "provider",
+        limit=settings.PROVIDER_BULKHEAD_LIMIT,
+        ttl=settings.PROVIDER_BULKHEAD_TTL,
+        retry_after=settings.PROVIDER_BULKHEAD_RETRY_AFTER,
+    )
+
+
+def guarded_call(func, *args, **kwargs):
+    """
+    Вызов провайдера под защитой breaker и bulkhead.
+    Исключение вызова считается отказом провайдера; обычный ответ (в том числе отказ по
+    платежу) — признаком того, что провайдер жив.
+    """
+    breaker = provider_breaker()
+    probe = breaker.before_call()
+    try:
+        with provider_bulkhead().slot():
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                breaker.record(success=False, probe=probe)
+                raise
+    except BulkheadFull:
+        # Пробный вызов не состоялся: место пробы освобождается без записи успеха
+        if probe:
+            breaker.release_probe(probe)
+        raise
+    breaker.record(success=True, probe=probe)
+    return result
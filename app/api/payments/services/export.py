@@ -0,0 +1,171 @@
+"""
+Потоковая выгрузка счетов и платежей в NDJSON или CSV.
+
+Строки читаются серверным курсором (`QuerySet.iterator(chunk_size=...)`) и сразу
+отдаются наружу, поэтому память не растет с размером выгрузки. Порядок тот же, что
+у KeysetPagination (от новых к старым), и каждая строка несет свой курсор в поле `cursor`:
+прерванную выгрузку можно продолжить с последней полученной строки параметром `cursor`.
+
+Если серверные курсоры отключены (pgbouncer в transaction mode), выборка идет порциями
+по ключу (created_at, id) отдельными запросами.
+
+Под ASGI нужен astream: синхронный итератор Django целиком вычитывает через sync_to_async(list)
+и держит всю выгрузку в памяти. astream читает каждую порцию отдельным sync_to_async.
+"""
+import csv
+import io
+import json
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from app.models import Invoice, Payment
+from app.api.pagination import KeysetPagination
+from app.api.payments.serializers import ExportFilterSerializer
+
+INVOICE_FIELDS = ("id", "user_id", "amount", "currency", "status", "description", "created_at", "updated_at")
+PAYMENT_FIELDS = (
+    "id", "invoice_id", "amount", "status", "provider_transaction_id", "attempts", "last_error",
+    "created_at", "updated_at",
+)
+
+CONTENT_TYPES = {
+    ExportFilterSerializer.FORMAT_NDJSON: "application/x-ndjson",
+    ExportFilterSerializer.FORMAT_CSV: "text/csv",
+}
+
+
+def invoices_queryset(params: dict):
+    queryset = _filter_common(Invoice.objects.all(), params, user_field="user_id")
+    if "status" in params:
+        queryset = queryset.filter(status=params["status"])
+    return queryset.values(*INVOICE_FIELDS), INVOICE_FIELDS
+
+
+def payments_queryset(params: dict):
+    queryset = _filter_common(Payment.objects.all(), params, user_field="invoice__user_id")
+    if "status" in params:
+        queryset = queryset.filter(status=params["status"])
+    if "invoice" in params:
+        queryset = queryset.filter(invoice_id=params["invoice"])
+    return queryset.values(*PAYMENT_FIELDS), PAYMENT_FIELDS
+
+
+def _filter_common(queryset, params: dict, user_field: str):
+    if "created_from" in params:
+        queryset = queryset.filter(created_at__gte=params["created_from"])
+    if "created_to" in params:
+        queryset = queryset.filter(created_at__lt=params["created_to"])
+    if "user" in params:
+        queryset = queryset.filter(**{user_field: params["user"]})
+    return queryset
+
+
+def _ordered(queryset, cursor):
+    paginator = KeysetPagination()
+    queryset = queryset.order_by(*paginator.ordering)
+    if cursor is not None:
+        queryset = paginator.filter_after(queryset, cursor)
+    return queryset
+
+
+def _server_side_cursors() -> bool:
+    return not settings.DATABASES[DEFAULT_DB_ALIAS].get("DISABLE_SERVER_SIDE_CURSORS")
+
+
+def _rows(queryset, cursor, chunk_size: int):
+    queryset = _ordered(queryset, cursor)
+    if _server_side_cursors():
+        yield from queryset.iterator(chunk_size=chunk_size)
+        return
+
+    while True:
+        chunk = list(queryset[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        queryset = KeysetPagination().filter_after(queryset, (chunk[-1]["created_at"], chunk[-1]["id"]))
+
+
+async def _arows(queryset, cursor, chunk_size: int):
+    queryset = _ordered(queryset, cursor)
+    if _server_side_cursors():
+        async for row in queryset.aiterator(chunk_size=chunk_size):
+            yield row
+        return
+
+    while True:
+        chunk = [row async for row in queryset[:chunk_size]]
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            return
+        queryset = KeysetPagination().filter_after(queryset, (chunk[-1]["created_at"], chunk[-1]["id"]))
+
+
+def _to_text(value) -> str:
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+class _Encoder:
+    """Строки выгрузки в текст; текст накапливается до chunk_size строк, чтобы не писать по одной"""
+
+    def __init__(self, fields: tuple, export_format: str, chunk_size: int):
+        self.fields = fields
+        self.columns = (*fields, "cursor")
+        self.chunk_size = chunk_size
+        self.buffer = io.StringIO()
+        self.pending = 0
+        self.writer = None
+        if export_format == ExportFilterSerializer.FORMAT_CSV:
+            self.writer = csv.writer(self.buffer)
+            self.writer.writerow(self.columns)
+
+    def add(self, row: dict) -> str | None:
+        """Добавляет строку; возвращает накопленный текст, когда набралась порция"""
+        values = {field: _to_text(row[field]) for field in self.fields}
+        values["cursor"] = KeysetPagination.encode_cursor_values(row["created_at"], row["id"])
+        if self.writer is not None:
+            self.writer.writerow(values[column] for column in self.columns)
+        else:
+            self.buffer.write(json.dumps(values, ensure_ascii=False))
+            self.buffer.write("\n")
+        self.pending += 1
+        if self.pending >= self.chunk_size:
+            return self.flush()
+        return None
+
+    def flush(self) -> str:
+        text = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.pending = 0
+        return text
+
+
+def stream(queryset, fields: tuple, export_format: str, cursor=None, chunk_size: int | None = None):
+    """Генератор строк выгрузки для WSGI"""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    encoder = _Encoder(fields, export_format, chunk_size)
+    for row in _rows(queryset, cursor, chunk_size):
+        text = encoder.add(row)
+        if text:
+            yield text
+    text = encoder.flush()
+    if text:
+        yield text
+
+
+async def astream(queryset, fields: tuple, export_format: str, cursor=None, chunk_size: int | None = None):
+    """Асинхронный генератор строк выгрузки для ASGI: БД читается порциями, память не растет"""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    encoder = _Encoder(fields, export_format, chunk_size)
+    async for row in _arows(queryset, cursor, chunk_size):
+        text = encoder.add(row)
+        if text:
+            yield text
+    text = encoder.flush()
+    if text:
+        yield text
@@ -0,0 +1,81 @@
+"""
+Кэш идемпотентности создания счетов в Redis.
+Первый запрос захватывает ключ (SET NX + TTL) и после создания счета кладет туда ответ.
+Параллельные дубликаты ждут захват и получают готовый ответ, не обращаясь к Postgres.
+Уникальный индекс Invoice.idempotency_key остается последней линией защиты.
+"""
+import json
+import time
+import logging
+from django.conf import settings
+from redis.exceptions import RedisError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from app.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "idempotency:invoice:"
+PENDING = "__pending__"
+
+
+class IdempotencyInProgress(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "Запрос с этим ключом идемпотентности еще обрабатывается"
+    default_code = "idempotency_in_progress"
+
+
+def _key(idempotency_key: str) -> str:
+    return f"{KEY_PREFIX}{idempotency_key}"
+
+
+def acquire(idempotency_key: str) -> tuple[bool, dict | None]:
+    """
+    Захватываем ключ или ждем ответ владельца.
+    Возвращает (claimed, cached_response):
+    - (True, None) — ключ наш, нужно создать счет и вызвать store();
+    - (False, response) — ответ уже есть в кэше;
+    - (False, None) — Redis недоступен, работаем только через БД.
+    """
+    key = _key(idempotency_key)
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+    try:
+        while True:
+            if redis_client.set(key, PENDING, nx=True, ex=settings.IDEMPOTENCY_CLAIM_TTL):
+                return True, None
+            value = redis_client.get(key)
+            if value is not None and value != PENDING:
+                return False, json.loads(value)
+            if time.monotonic() >= deadline:
+                raise IdempotencyInProgress()
+            time.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+    except RedisError:
+        logger.warning("Redis недоступен, идемпотентность проверяется только в БД", exc_info=True)
+        return False, None
+
+
+def store(idempotency_key: str, response: dict):
+    try:
+        redis_client.set(
+            _key(idempotency_key),
+            json.dumps(response, default=str),
+            ex=settings.IDEMPOTENCY_RESULT_TTL,
+        )
+    except RedisError:
+        logger.warning("Не удалось сохранить ответ в кэш идемпотентности", exc_info=True)
+
+
+def release(idempotency_key: str):
+    """Снимаем захват после ошибки, чтобы повтор клиента не ждал истечения TTL"""
+    key = _key(idempotency_key)
+    try:
+        pipe = redis_client.pipeline()
+        pipe.watch(key)
+        if pipe.get(key) == PENDING:
+            pipe.multi()
+            pipe.delete(key)
+            pipe.execute()
+        else:
+            pipe.reset()
+    except RedisError:
+        logger.warning("Не удалось снять захват ключа идемпотентности", exc_info=True)
@@ -0,0 +1,109 @@
+"""
+Кэш снимков счетов в Redis для частого опроса статуса.
+Переходы статусов в биллинге и задачах пишут снимок после коммита (write-through),
+чтение при промахе идет в БД и заполняет кэш.
+Версия снимка — updated_at счета в микросекундах: скрипт записывает снимок, только если
+его версия не старее сохраненной, поэтому запоздавшая запись не перетирает новый статус.
+Каждая запись снимка публикуется в канал счета (invoice_events) для потоковых подписчиков.
+Если Redis недоступен, чтение и запись молча уходят в БД.
+"""
+import json
+import logging
+from django.conf import settings
+from django.db import transaction
+from redis.exceptions import RedisError
+from app.models import Invoice
+from app.api.payments.serializers import InvoiceSerializer
+from app.api.payments.services import invoice_events
+from app.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "invoice:snapshot:"
+
+# KEYS[1] — ключ снимка; ARGV: версия, данные, ttl. Возвращает 1, если снимок записан
+_STORE = redis_client.register_script("""
+local current = tonumber(redis.call('HGET', KEYS[1], 'v') or '-1')
+if tonumber(ARGV[1]) < current then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'v', ARGV[1], 'data', ARGV[2])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+return 1
+""")
+
+
+def _key(invoice_id) -> str:
+    return f"{KEY_PREFIX}{invoice_id}"
+
+
+def _version(invoice: Invoice) -> int:
+    return int(invoice.updated_at.timestamp() * 1_000_000)
+
+
+def _snapshot(invoice: Invoice) -> tuple[int, str]:
+    return _version(invoice), json.dumps(InvoiceSerializer(invoice).data, default=str)
+
+
+def snapshot_of(invoice: Invoice) -> tuple[int, dict]:
+    version, data = _snapshot(invoice)
+    return version, json.loads(data)
+
+
+def _write(snapshots: list[tuple[str, int, str]], publish: bool = True):
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for invoice_id, version, data in snapshots:
+            _STORE(keys=[_key(invoice_id)], args=[version, data, settings.INVOICE_CACHE_TTL], client=pipe)
+            if publish:
+                invoice_events.publish(pipe, invoice_id, version, data)
+        pipe.execute()
+    except RedisError:
+        logger.warning("Не удалось обновить кэш счетов", exc_info=True)
+
+
+def store(invoice: Invoice, publish: bool = True):
+    """
+    Записываем снимок сразу (вне транзакции).
+    publish=False — заполнение кэша после чтения из БД, статус не менялся.
+    """
+    _write([(str(invoice.pk), *_snapshot(invoice))], publish=publish)
+
+
+def store_on_commit(invoices: list[Invoice]):
+    """
+    Снимок фиксируется в момент вызова, запись в Redis — после коммита транзакции,
+    при откате кэш не трогается
+    """
+    snapshots = [(str(invoice.pk), *_snapshot(invoice)) for invoice in invoices]
+    if snapshots:
+        transaction.on_commit(lambda: _write(snapshots))
+
+
+def get_versioned(invoice_id) -> tuple[int, dict] | None:
+    try:
+        version, data = redis_client.hmget(_key(invoice_id), ["v", "data"])
+    except RedisError:
+        logger.warning("Кэш счетов недоступен, читаем из БД", exc_info=True)
+        return None
+    if data is None:
+        return None
+    return int(version), json.loads(data)
+
+
+def get(invoice_id) -> dict | None:
+    cached = get_versioned(invoice_id)
+    return cached[1] if cached is not None else None
+
+
+def get_or_load(invoice_id) -> dict | None:
+    """Снимок счета из кэша, при промахе — из БД с заполнением кэша. None, если счета нет"""
+    cached = get(invoice_id)
+    if cached is not None:
+        return cached
+    invoice = Invoice.objects.filter(pk=invoice_id).first()
+    if invoice is None:
+        return None
+    version, data = _snapshot(invoice)
+    _write([(str(invoice.pk), version, data)], publish=False)
+    return json.loads(data)
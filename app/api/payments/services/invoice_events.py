@@ -0,0 +1,53 @@
+"""
+События смены статуса счета через Redis pub/sub.
+Публикация идет вместе с записью снимка в кэш (invoice_cache) после коммита,
+подписка — в async-представлениях потока (SSE) и long-poll под ASGI.
+Сообщение: {"v": версия снимка, "invoice": данные InvoiceSerializer}. Доставка pub/sub
+не гарантирована и может нарушать порядок, поэтому подписчик сначала читает снимок,
+а события старше уже отданной версии отбрасывает.
+"""
+import json
+import time
+from contextlib import asynccontextmanager
+from app.models import Invoice
+from app.redis_client import async_redis_client
+
+CHANNEL_PREFIX = "invoice:events:"
+
+TERMINAL_STATUSES = (Invoice.STATUS_COMPLETED, Invoice.STATUS_FAILED, Invoice.STATUS_REFUNDED)
+
+
+def channel(invoice_id) -> str:
+    return f"{CHANNEL_PREFIX}{invoice_id}"
+
+
+def publish(client, invoice_id, version: int, data: str):
+    """Публикуем снимок (data — уже сериализованный JSON) клиентом или пайплайном Redis"""
+    client.publish(channel(invoice_id), f'{{"v": {version}, "invoice": {data}}}')
+
+
+def is_terminal(invoice: dict) -> bool:
+    return invoice.get("status") in TERMINAL_STATUSES
+
+
+@asynccontextmanager
+async def subscription(invoice_id):
+    client = async_redis_client()
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    try:
+        await pubsub.subscribe(channel(invoice_id))
+        yield pubsub
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
+
+
+async def next_event(pubsub, timeout: float) -> tuple[int, dict] | None:
+    """Ждем событие до timeout секунд: (версия, снимок) или None"""
+    deadline = time.monotonic() + timeout
+    while (remaining := deadline - time.monotonic()) > 0:
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+        if message is not None and message["type"] == "message":
+            payload = json.loads(message["data"])
+            return payload["v"], payload["invoice"]
+    return None
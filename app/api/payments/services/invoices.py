@@ -0,0 +1,165 @@
+from celery import group
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.contrib.auth import get_user_model
+from app import task_routing
+from app.models import Invoice
+from app.api.payments.serializers import InvoiceCreateSerializer, InvoiceSerializer
+from app.api.celery_tasks import process_invoice_task, process_invoice_batch_task
+from app.api.payments.services import batching, outbox
+import logging
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+RESULT_CREATED = "created"
+RESULT_DUPLICATE = "duplicate"
+RESULT_INVALID = "invalid"
+
+
+def _invoice_result(index: int, result: str, invoice: Invoice) -> dict:
+    return {"index": index, "status": result, "invoice": InvoiceSerializer(invoice).data}
+
+
+def _error_result(index: int, errors) -> dict:
+    return {"index": index, "status": RESULT_INVALID, "errors": errors}
+
+
+def dispatch_invoice_processing(invoice_ids: list[str]):
+    """
+    Отправляем счета на обработку: в буфер пакетной задачи (INVOICE_BATCH_ENABLED)
+    или задачами по каждому счету одной группой на полосу очереди списаний
+    (одно соединение с брокером на всю пачку)
+    """
+    if not invoice_ids:
+        return
+    if settings.INVOICE_BATCH_ENABLED:
+        countdown = batching.push(invoice_ids)
+        if countdown is not None:
+            process_invoice_batch_task.apply_async(countdown=countdown)
+        logger.info("Отправлено на обработку счетов: %s", len(invoice_ids))
+        return
+    for queue, lane_ids in task_routing.invoice_lanes(invoice_ids).items():
+        if len(lane_ids) == 1:
+            process_invoice_task.apply_async(args=[lane_ids[0]], queue=queue)
+        else:
+            group(process_invoice_task.s(invoice_id) for invoice_id in lane_ids).apply_async(queue=queue)
+    logger.info("Отправлено на обработку счетов: %s", len(invoice_ids))
+
+
+def dispatch_outbox(payloads: list[dict]):
+    """Публикация сообщений outbox одной пачкой"""
+    dispatch_invoice_processing([invoice_id for payload in payloads for invoice_id in payload["invoice_ids"]])
+
+
+def enqueue_invoice_processing(invoice_ids: list[str]):
+    """
+    Ставим счета в обработку из транзакции, в которой они созданы:
+    сообщением outbox (OUTBOX_ENABLED) или публикацией после коммита
+    """
+    if not invoice_ids:
+        return
+    if settings.OUTBOX_ENABLED:
+        outbox.enqueue(outbox.TOPIC_INVOICE_PROCESSING, {"invoice_ids": invoice_ids})
+    else:
+        transaction.on_commit(lambda: dispatch_invoice_processing(invoice_ids))
+
+
+@transaction.atomic
+def create_invoice(user_id, data: dict) -> tuple[Invoice, bool]:
+    """
+    Создаем счет вместе с постановкой в обработку.
+    При повторе ключа идемпотентности возвращаем существующий счет: (счет, создан ли)
+    """
+    idempotency_key = data.get("idempotency_key")
+    try:
+        with transaction.atomic():
+            invoice = Invoice.objects.create(user_id=user_id, **data)
+    except IntegrityError:
+        if not idempotency_key:
+            raise
+        return Invoice.objects.get(idempotency_key=idempotency_key), False
+    enqueue_invoice_processing([str(invoice.pk)])
+    return invoice, True
+
+
+@transaction.atomic
+def bulk_create_invoices(items: list[dict]) -> list[dict]:
+    """
+    Пакетное создание счетов.
+    Пользователи и ключи идемпотентности разрешаются одним запросом на весь пакет,
+    вставка идет через bulk_create, весь пакет ставится в обработку одним сообщением outbox.
+    Возвращает результат по каждому элементу в исходном порядке.
+    """
+    results: list[dict | None] = [None] * len(items)
+
+    # Валидация всех элементов за один проход (без обращений к БД)
+    valid = []
+    for index, item in enumerate(items):
+        serializer = InvoiceCreateSerializer(data=item)
+        if serializer.is_valid():
+            data = dict(serializer.validated_data)
+            data["idempotency_key"] = data.get("idempotency_key") or None
+            valid.append((index, data))
+        else:
+            results[index] = _error_result(index, serializer.errors)
+
+    user_ids = {data["user_id"] for _, data in valid}
+    keys = {data["idempotency_key"] for _, data in valid if data["idempotency_key"]}
+
+    existing_users = set(User.objects.filter(pk__in=user_ids).values_list("pk", flat=True)) if user_ids else set()
+    existing_by_key = {
+        invoice.idempotency_key: invoice
+        for invoice in Invoice.objects.filter(idempotency_key__in=keys)
+    } if keys else {}
+
+    to_create = []
+    pending = []  # (index, invoice)
+    batch_by_key = {}
+    for index, data in valid:
+        user_id = data.pop("user_id")
+        key = data["idempotency_key"]
+        if key in existing_by_key:
+            results[index] = _invoice_result(index, RESULT_DUPLICATE, existing_by_key[key])
+            continue
+        if user_id not in existing_users:
+            results[index] = _error_result(index, {"user_id": ["Пользователь не найден"]})
+            continue
+        if key and key in batch_by_key:
+            # Повтор ключа внутри одного пакета ссылается на первый счет
+            pending.append((index, batch_by_key[key]))
+            continue
+
+        invoice = Invoice(user_id=user_id, **data)
+        if key:
+            batch_by_key[key] = invoice
+        to_create.append(invoice)
+        pending.append((index, invoice))
+
+    # Конфликты по idempotency_key с параллельными запросами не роняют весь пакет
+    Invoice.objects.bulk_create(
+        to_create,
+        batch_size=settings.INVOICE_BULK_INSERT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+    winners = {
+        invoice.idempotency_key: invoice
+        for invoice in Invoice.objects.filter(idempotency_key__in=batch_by_key.keys())
+    } if batch_by_key else {}
+
+    created_ids = []
+    seen = set()
+    for index, invoice in pending:
+        winner = winners.get(invoice.idempotency_key, invoice) if invoice.idempotency_key else invoice
+        if winner.pk == invoice.pk and invoice.pk not in seen:
+            seen.add(invoice.pk)
+            created_ids.append(str(invoice.pk))
+            results[index] = _invoice_result(index, RESULT_CREATED, invoice)
+        else:
+            results[index] = _invoice_result(index, RESULT_DUPLICATE, winner)
+
+    enqueue_invoice_processing(created_ids)
+    logger.info("Пакетное создание счетов: получено=%s создано=%s", len(items), len(created_ids))
+    return results
@@ -0,0 +1,174 @@
+"""
+Журнал баланса (режим BILLING_BALANCE_STRATEGY = "ledger").
+
+Операции биллинга только вставляют проводки в LedgerEntry, строка UserBalance
+не переписывается и служит снимком, который периодически сворачивает `rollup`.
+Текущее состояние = снимок + проводки после `UserBalance.ledger_position`.
+
+Блокировки — короткие advisory-локи Postgres вместо блокировки строки:
+- резервирование сериализуется по пользователю (нужна проверка остатка);
+- остальные записи берут разделяемый лок и друг другу не мешают;
+- rollup берет эксклюзивный лок и ждет завершения всех пишущих транзакций,
+  поэтому ни одна проводка с id <= новой позиции не может закоммититься позже.
+"""
+import uuid
+from decimal import Decimal
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, Max, OuterRef, Sum
+from django.db.models.functions import Coalesce
+from app import metrics
+from app.models import Invoice, LedgerEntry, User, UserBalance
+import logging
+
+logger = logging.getLogger(__name__)
+
+STRATEGY = "ledger"
+
+# Пространства ключей advisory-локов
+_RESERVE_LOCK_NS = 7301
+_ROLLUP_LOCK_NS = 7302
+
+ZERO = Decimal("0.00")
+
+
+def enabled() -> bool:
+    return settings.BILLING_BALANCE_STRATEGY == STRATEGY
+
+
+def _lock(sql_func: str, namespace: int, user_id):
+    with metrics.lock_wait("advisory"), connection.cursor() as cursor:
+        cursor.execute(f"SELECT {sql_func}(%s, hashtext(%s))", [namespace, str(user_id)])
+
+
+def _post(user_id, kind: str, source: str, target: str, amount: Decimal, invoice: Invoice | None = None):
+    """Переводим amount со счета source на счет target одной парой проводок"""
+    txn = uuid.uuid4()
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(transaction_id=txn, user_id=user_id, kind=kind, account=source, amount=-amount, invoice=invoice),
+        LedgerEntry(transaction_id=txn, user_id=user_id, kind=kind, account=target, amount=amount, invoice=invoice),
+    ])
+
+
+def _totals(entries) -> dict:
+    totals = {LedgerEntry.ACCOUNT_AVAILABLE: ZERO, LedgerEntry.ACCOUNT_RESERVED: ZERO}
+    for row in entries.values("account").annotate(total=Sum("amount")):
+        if row["account"] in totals:
+            totals[row["account"]] = row["total"]
+    return totals
+
+
+def balance_of(user_id) -> dict:
+    """Текущий баланс: снимок + проводки после него"""
+    snapshot = UserBalance.objects.filter(user_id=user_id).values(
+        "balance", "reserved", "ledger_position",
+    ).first() or {"balance": ZERO, "reserved": ZERO, "ledger_position": 0}
+
+    delta = _totals(LedgerEntry.objects.filter(user_id=user_id, id__gt=snapshot["ledger_position"]))
+    reserved = snapshot["reserved"] + delta[LedgerEntry.ACCOUNT_RESERVED]
+    available = snapshot["balance"] - snapshot["reserved"] + delta[LedgerEntry.ACCOUNT_AVAILABLE]
+    return {"balance": available + reserved, "reserved": reserved, "available": available}
+
+
+def invoice_reserved(invoice: Invoice) -> Decimal:
+    """Сумма, которая сейчас зарезервирована под счет"""
+    return _totals(LedgerEntry.objects.filter(invoice=invoice))[LedgerEntry.ACCOUNT_RESERVED]
+
+
+@transaction.atomic(savepoint=False)
+def reserve(invoice: Invoice, amount: Decimal) -> bool:
+    if amount <= 0:
+        return False
+    _lock("pg_advisory_xact_lock", _RESERVE_LOCK_NS, invoice.user_id)
+    _lock("pg_advisory_xact_lock_shared", _ROLLUP_LOCK_NS, invoice.user_id)
+    if balance_of(invoice.user_id)["available"] < amount:
+        return False
+    _post(invoice.user_id, LedgerEntry.KIND_RESERVE,
+          LedgerEntry.ACCOUNT_AVAILABLE, LedgerEntry.ACCOUNT_RESERVED, amount, invoice)
+    return True
+
+
+@transaction.atomic(savepoint=False)
+def debit_reserved(invoice: Invoice, amount: Decimal) -> bool:
+    if amount <= 0:
+        return False
+    _lock("pg_advisory_xact_lock_shared", _ROLLUP_LOCK_NS, invoice.user_id)
+    if invoice_reserved(invoice) < amount:
+        return False
+    _post(invoice.user_id, LedgerEntry.KIND_DEBIT,
+          LedgerEntry.ACCOUNT_RESERVED, LedgerEntry.ACCOUNT_EXTERNAL, amount, invoice)
+    return True
+
+
+@transaction.atomic(savepoint=False)
+def release(invoice: Invoice, amount: Decimal) -> bool:
+    if amount <= 0:
+        return False
+    _lock("pg_advisory_xact_lock_shared", _ROLLUP_LOCK_NS, invoice.user_id)
+    if invoice_reserved(invoice) < amount:
+        return False
+    _post(invoice.user_id, LedgerEntry.KIND_RELEASE,
+          LedgerEntry.ACCOUNT_RESERVED, LedgerEntry.ACCOUNT_AVAILABLE, amount, invoice)
+    return True
+
+
+@transaction.atomic(savepoint=False)
+def credit(user_id, amount: Decimal, invoice: Invoice | None = None):
+    if amount <= 0:
+        return
+    _lock("pg_advisory_xact_lock_shared", _ROLLUP_LOCK_NS, user_id)
+    _post(user_id, LedgerEntry.KIND_CREDIT,
+          LedgerEntry.ACCOUNT_EXTERNAL, LedgerEntry.ACCOUNT_AVAILABLE, amount, invoice)
+
+
+@transaction.atomic(savepoint=False)
+def credit_many(user_id, items: list[tuple[Invoice, Decimal]]):
+    """Пополнения по нескольким счетам одного пользователя: один лок и одна вставка"""
+    items = [(invoice, amount) for invoice, amount in items if amount > 0]
+    if not items:
+        return
+    _lock("pg_advisory_xact_lock_shared", _ROLLUP_LOCK_NS, user_id)
+    entries = []
+    for invoice, amount in items:
+        txn = uuid.uuid4()
+        entries += [
+            LedgerEntry(transaction_id=txn, user_id=user_id, kind=LedgerEntry.KIND_CREDIT,
+                        account=LedgerEntry.ACCOUNT_EXTERNAL, amount=-amount, invoice=invoice),
+            LedgerEntry(transaction_id=txn, user_id=user_id, kind=LedgerEntry.KIND_CREDIT,
+                        account=LedgerEntry.ACCOUNT_AVAILABLE, amount=amount, invoice=invoice),
+        ]
+    LedgerEntry.objects.bulk_create(entries)
+
+
+@transaction.atomic
+def rollup(user_id) -> int:
+    """
+    Сворачиваем новые проводки в снимок UserBalance.
+    Возвращает количество учтенных проводок.
+    """
+    _lock("pg_advisory_xact_lock", _ROLLUP_LOCK_NS, user_id)
+    snapshot, _ = UserBalance.objects.get_or_create(user_id=user_id)
+    snapshot = UserBalance.objects.select_for_update().get(pk=snapshot.pk)
+
+    entries = LedgerEntry.objects.filter(user_id=user_id, id__gt=snapshot.ledger_position)
+    stats = entries.aggregate(last=Max("id"))
+    if stats["last"] is None:
+        return 0
+    entries = entries.filter(id__lte=stats["last"])
+    delta = _totals(entries)
+    count = entries.count()
+
+    snapshot.reserved += delta[LedgerEntry.ACCOUNT_RESERVED]
+    snapshot.balance += delta[LedgerEntry.ACCOUNT_AVAILABLE] + delta[LedgerEntry.ACCOUNT_RESERVED]
+    snapshot.ledger_position = stats["last"]
+    snapshot.save(update_fields=["balance", "reserved", "ledger_position", "updated_at"])
+    return count
+
+
+def users_pending_rollup():
+    """Пользователи, у которых есть проводки после снимка"""
+    newer = LedgerEntry.objects.filter(
+        user_id=OuterRef("pk"),
+        id__gt=Coalesce(OuterRef("balance__ledger_position"), 0),
+    )
+    return User.objects.filter(Exists(newer)).values_list("pk", flat=True)
@@ -0,0 +1,116 @@
+"""
+Оптимистичное изменение баланса (режим BILLING_BALANCE_STRATEGY = "optimistic").
+
+Вместо SELECT ... FOR UPDATE и записи прочитанной строки каждое изменение — один
+условный UPDATE с выражениями F(): проверка остатка стоит в WHERE, а число обновленных
+строк заменяет чтение. Строку держит только сам UPDATE (до коммита транзакции),
+запроса на чтение и блокировки на время вычислений нет.
+
+Где новое значение не выражается одним условием (пакетный резерв: какие счета поместятся,
+зависит от остатка), баланс читается без блокировки и записывается с условием
+version = прочитанной; при конфликте — повтор, после OPTIMISTIC_BALANCE_MAX_RETRIES
+конфликтов — обычная блокировка строки.
+Разбиение баланса на шарды в этом режиме не используется.
+"""
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from app import metrics
+from app.models import Invoice, UserBalance
+import logging
+
+logger = logging.getLogger(__name__)
+
+STRATEGY = "optimistic"
+
+ZERO = Decimal("0.00")
+
+
+def enabled() -> bool:
+    return settings.BILLING_BALANCE_STRATEGY == STRATEGY
+
+
+def _update(user_id, condition: Q, **changes) -> bool:
+    updated = UserBalance.objects.filter(condition, user_id=user_id).update(
+        version=F("version") + 1, updated_at=timezone.now(), **changes,
+    )
+    return updated == 1
+
+
+def reserve(user_id, amount: Decimal) -> bool:
+    if amount <= 0:
+        return False
+    return _update(user_id, Q(balance__gte=F("reserved") + amount), reserved=F("reserved") + amount)
+
+
+def debit_reserved(user_id, amount: Decimal) -> bool:
+    if amount <= 0:
+        return False
+    return _update(
+        user_id, Q(reserved__gte=amount),
+        reserved=F("reserved") - amount, balance=Greatest(F("balance") - amount, Value(ZERO)),
+    )
+
+
+def release(user_id, amount: Decimal) -> bool:
+    if amount <= 0:
+        return False
+    return _update(user_id, Q(reserved__gte=amount), reserved=F("reserved") - amount)
+
+
+def credit(user_id, amount: Decimal):
+    if amount <= 0:
+        return
+    if not _update(user_id, Q(), balance=F("balance") + amount):
+        UserBalance.objects.get_or_create(user_id=user_id)
+        _update(user_id, Q(), balance=F("balance") + amount)
+
+
+def settle(user_id, debit: Decimal, release_amount: Decimal) -> bool:
+    """Списание debit и освобождение release_amount из резерва одним UPDATE"""
+    total = debit + release_amount
+    if total <= 0:
+        return True
+    return _update(
+        user_id, Q(reserved__gte=total),
+        reserved=F("reserved") - total, balance=Greatest(F("balance") - debit, Value(ZERO)),
+    )
+
+
+def _fit(invoices: list[Invoice], available: Decimal) -> tuple[list[Invoice], list[Invoice]]:
+    reserved, failed = [], []
+    for invoice in invoices:
+        if ZERO < invoice.amount <= available:
+            available -= invoice.amount
+            reserved.append(invoice)
+        else:
+            failed.append(invoice)
+    return reserved, failed
+
+
+def reserve_many(user_id, invoices: list[Invoice]) -> tuple[list[Invoice], list[Invoice]]:
+    """
+    Резерв под пакет счетов (от старых к новым, пока хватает средств) записью по версии.
+    Возвращает (зарезервированные, отклоненные).
+    """
+    for _ in range(settings.OPTIMISTIC_BALANCE_MAX_RETRIES):
+        snapshot = UserBalance.objects.filter(user_id=user_id).values("balance", "reserved", "version").first()
+        if snapshot is None:
+            return [], list(invoices)
+        reserved, failed = _fit(invoices, snapshot["balance"] - snapshot["reserved"])
+        amount = sum((invoice.amount for invoice in reserved), ZERO)
+        if not amount or _update(user_id, Q(version=snapshot["version"]), reserved=F("reserved") + amount):
+            return reserved, failed
+        metrics.BILLING_OPTIMISTIC_CONFLICTS.labels(operation="reserve_many").inc()
+
+    # Горячий баланс: повторы не проходят, ждем блокировку строки
+    logger.info("Оптимистичный резерв пользователя %s уступил блокировке после повторов", user_id)
+    with metrics.lock_wait("balance"):
+        balance = UserBalance.objects.select_for_update().get(user_id=user_id)
+    reserved, failed = _fit(invoices, balance.available())
+    amount = sum((invoice.amount for invoice in reserved), ZERO)
+    if amount:
+        _update(user_id, Q(), reserved=F("reserved") + amount)
+    return reserved, failed
@@ -0,0 +1,68 @@
+"""
+Transactional outbox для отправки задач.
+
+Счет и сообщение outbox пишутся в одной транзакции: если транзакция закоммичена,
+сообщение обязательно будет опубликовано, и API не ждет брокер.
+Ретранслятор (`manage.py outbox_relay` или задача relay_outbox_task) забирает сообщения
+порциями под SELECT ... FOR UPDATE SKIP LOCKED, публикует их пачкой по теме
+и удаляет в той же транзакции. Параллельные ретрансляторы не пересекаются.
+Если публикация упала, транзакция откатывается и сообщения остаются на следующий проход.
+Доставка — не менее одного раза: обработчики задач должны быть идемпотентны.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from app import metrics
+from app.models import OutboxMessage
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOPIC_INVOICE_PROCESSING = "invoice.processing"
+
+
+def _handlers() -> dict:
+    # Импорт при вызове: сервис счетов импортирует задачи Celery, а они — этот модуль
+    from app.api.payments.services import invoices
+    return {TOPIC_INVOICE_PROCESSING: invoices.dispatch_outbox}
+
+
+def enqueue(topic: str, payload: dict) -> OutboxMessage:
+    """Пишем сообщение в текущей транзакции вызывающего кода"""
+    return OutboxMessage.objects.create(topic=topic, payload=payload)
+
+
+def relay(limit: int | None = None) -> int:
+    """Публикуем одну порцию сообщений. Возвращает количество обработанных сообщений"""
+    limit = limit or settings.OUTBOX_RELAY_BATCH_SIZE
+    handlers = _handlers()
+    with transaction.atomic():
+        messages = list(OutboxMessage.objects.select_for_update(skip_locked=True).order_by("id")[:limit])
+        if not messages:
+            return 0
+        by_topic = {}
+        for message in messages:
+            by_topic.setdefault(message.topic, []).append(message.payload)
+        for topic, payloads in by_topic.items():
+            handler = handlers.get(topic)
+            if handler is None:
+                # Неизвестная тема не должна блокировать очередь: сообщение удаляется
+                logger.error("Сообщения outbox с неизвестной темой %s удалены: %s", topic, len(payloads))
+                continue
+            handler(payloads)
+        OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).delete()
+
+    now = timezone.now()
+    for message in messages:
+        metrics.OUTBOX_LAG.labels(topic=message.topic).observe((now - message.created_at).total_seconds())
+    return len(messages)
+
+
+def drain(limit: int | None = None) -> int:
+    limit = limit or settings.OUTBOX_RELAY_BATCH_SIZE
+    total = 0
+    while True:
+        processed = relay(limit)
+        total += processed
+        if processed < limit:
+            return total
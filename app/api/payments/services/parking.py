@@ -0,0 +1,44 @@
+"""
+Очередь отложенных счетов.
+Пока провайдер недоступен (открыт circuit breaker или заполнен bulkhead), счета
+не тратят попытки и не держат воркеры: id кладется в ZSET Redis со временем
+следующей попытки, периодическая задача возвращает созревшие счета в обработку.
+Резерв средств за счетом при этом сохраняется.
+"""
+import time
+from app.redis_client import redis_client
+
+PARKED_KEY = "invoices:parked"
+
+# Атомарно забираем созревшие id, чтобы два запуска задачи не взяли один счет
+_TAKE_DUE = redis_client.register_script("""
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #ids > 0 then
+    redis.call('ZREM', KEYS[1], unpack(ids))
+end
+return ids
+""")
+
+
+def park(invoice_ids: list[str], delay: float):
+    """Откладываем счета на delay секунд (более раннее время уже отложенного счета не сдвигается)"""
+    if not invoice_ids:
+        return
+    due = time.time() + delay
+    redis_client.zadd(PARKED_KEY, {str(invoice_id): due for invoice_id in invoice_ids}, lt=True)
+
+
+def take_due(limit: int) -> list[str]:
+    return _TAKE_DUE(keys=[PARKED_KEY], args=[time.time(), limit])
+
+
+def size() -> int:
+    return redis_client.zcard(PARKED_KEY)
+
+
+def parked(invoice_ids: list[str]) -> set[str]:
+    """Какие из счетов сейчас отложены"""
+    if not invoice_ids:
+        return set()
+    scores = redis_client.zmscore(PARKED_KEY, invoice_ids)
+    return {invoice_id for invoice_id, score in zip(invoice_ids, scores) if score is not None}
@@ -1,15 +1,33 @@
+import time
 import uuid
 from decimal import Decimal
-from app.models import Payment
+from django.conf import settings
+from app import metrics
+from app.models import Invoice, Payment
+from app.api.payments.services.provider_simulator import (
+    OUTCOME_ERROR, OUTCOME_SUCCESS, OUTCOME_TIMEOUT, ProviderSimulator, SimulatedOutcome, get_simulator,
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Поток оплаты (PAYMENT_FLOW): списание одним вызовом или удержание с последующим пакетным списанием
+FLOW_CHARGE = "charge"
+FLOW_AUTHORIZE_CAPTURE = "authorize_capture"
+
 
 class ExternalPaymentError(Exception):
     pass
 
 
+class ProviderTimeoutError(ExternalPaymentError):
+    pass
+
+
+def two_phase() -> bool:
+    return settings.PAYMENT_FLOW == FLOW_AUTHORIZE_CAPTURE
+
+
 def _deterministic_outcome_from_uuid(u: uuid.UUID) -> bool:
     last_char = u.hex[-1]
     try:
@@ -19,13 +37,25 @@ def _deterministic_outcome_from_uuid(u: uuid.UUID) -> bool:
     return (val % 2) == 0
 
 
-def charge(payment: Payment) -> dict:
-    """Симулируем charge"""
+def _simulate(payment: Payment, simulator: ProviderSimulator | None) -> tuple[ProviderSimulator, SimulatedOutcome]:
     invoice = payment.invoice
-    success = _deterministic_outcome_from_uuid(invoice.id)
-    provider_txn_id = f"sim-{uuid.uuid4().hex}"
+    simulator = simulator or get_simulator()
+    outcome = simulator.simulate(
+        invoice.id, invoice.user_id, payment.attempts, _deterministic_outcome_from_uuid(invoice.id),
+    )
+    return simulator, outcome
+
+
+def _result(invoice: Invoice, outcome: SimulatedOutcome) -> dict:
+    if outcome.outcome == OUTCOME_TIMEOUT:
+        logger.warning("Имитация поставщика: таймаут при выставлении счета %s", invoice.id)
+        raise ProviderTimeoutError(f"Simulated timeout after {outcome.latency_ms:.0f} ms")
+    if outcome.outcome == OUTCOME_ERROR:
+        logger.warning("Имитация поставщика: ошибка поставщика для счета %s", invoice.id)
+        raise ExternalPaymentError("Simulated provider error")
 
-    if success:
+    provider_txn_id = f"sim-{uuid.uuid4().hex}"
+    if outcome.outcome == OUTCOME_SUCCESS:
         logger.info("Имитация поставщика: успешное выставление счета %s", invoice.id)
         return {"success": True, "provider_id": provider_txn_id, "message": "OK"}
     else:
@@ -33,9 +63,74 @@ def charge(payment: Payment) -> dict:
         return {"success": False, "provider_id": provider_txn_id, "message": "Simulated failure"}
 
 
-def capture(payment: Payment) -> dict:
+def _call(operation: str, payment: Payment, simulator: ProviderSimulator | None) -> dict:
+    started = time.perf_counter()
+    simulator, outcome = _simulate(payment, simulator)
+    simulator.wait(outcome)
+    metrics.PROVIDER_CALL.labels(operation=operation, outcome=outcome.outcome).observe(time.perf_counter() - started)
+    return _result(payment.invoice, outcome)
+
+
+def charge(payment: Payment, simulator: ProviderSimulator | None = None) -> dict:
+    """Симулируем charge"""
+    return _call("charge", payment, simulator)
+
+
+def authorize(payment: Payment, simulator: ProviderSimulator | None = None) -> dict:
+    """Симулируем authorize: провайдер удерживает средства, списание — отдельным capture"""
+    return _call("authorize", payment, simulator)
+
+
+async def acharge(payment: Payment, simulator: ProviderSimulator | None = None) -> dict:
+    """Симулируем charge (asyncio): задержка провайдера не блокирует event loop"""
+    started = time.perf_counter()
+    simulator, outcome = _simulate(payment, simulator)
+    await simulator.await_latency(outcome)
+    metrics.PROVIDER_CALL.labels(operation="charge", outcome=outcome.outcome).observe(time.perf_counter() - started)
+    return _result(payment.invoice, outcome)
+
+
+def capture_batch(payments: list[Payment], simulator: ProviderSimulator | None = None) -> dict:
     """
-    Симулируем capture (Если двух-этапный поток). Пока такое-же как charge
+    Симулируем capture пакета авторизованных платежей одним вызовом провайдера.
+    Ошибка или таймаут всего вызова — исключение, иначе — результат по каждому платежу:
+    {payment.pk: {"success": ..., "retry": ..., "provider_id": ..., "message": ...}}
+    Исход каждого платежа свой; retry=True — провайдер не обработал платеж, он остается authorized.
+    Каждый вызов получает свой nonce, поэтому повтор не повторяет исход предыдущего вызова.
     """
-    return charge(payment)
+    if not payments:
+        return {}
+    started = time.perf_counter()
+    simulator = simulator or get_simulator()
+    nonce = uuid.uuid4().hex
+    # Задержка и доступность — на весь вызов, по профилю провайдера по умолчанию
+    outcome = simulator.simulate("capture", None, nonce, True)
+    simulator.wait(outcome)
+    metrics.PROVIDER_CALL.labels(operation="capture_batch", outcome=outcome.outcome).observe(
+        time.perf_counter() - started,
+    )
+    if outcome.outcome == OUTCOME_TIMEOUT:
+        raise ProviderTimeoutError(f"Simulated capture timeout after {outcome.latency_ms:.0f} ms")
+    if outcome.outcome == OUTCOME_ERROR:
+        raise ExternalPaymentError("Simulated provider error on capture")
+
+    results = {}
+    for payment in payments:
+        item = simulator.simulate(f"capture:{payment.pk}", payment.invoice.user_id, nonce, True)
+        retry = item.outcome in (OUTCOME_ERROR, OUTCOME_TIMEOUT)
+        success = item.outcome == OUTCOME_SUCCESS
+        results[payment.pk] = {
+            "success": success,
+            "retry": retry,
+            "provider_id": payment.provider_transaction_id,
+            "message": "OK" if success else f"Simulated capture {item.outcome}",
+        }
+    captured = sum(1 for result in results.values() if result["success"])
+    logger.info("Имитация поставщика: capture пакета из %s платежей, успешно %s", len(payments), captured)
+    return results
+
+
+def capture(payment: Payment) -> dict:
+    """Симулируем capture одного авторизованного платежа"""
+    return capture_batch([payment])[payment.pk]
 
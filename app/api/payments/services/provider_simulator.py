@@ -0,0 +1,108 @@
+"""
+Движок симулятора платежного провайдера.
+
+Профиль задает распределение задержки (fixed / lognormal / histogram),
+таймаут, долю ошибок провайдера и долю отказов. Профили можно переопределить
+для отдельных мерчантов (id пользователя счета).
+
+Случайность детерминирована: генератор инициализируется от seed, id счета и номера
+попытки, поэтому исход не зависит от порядка и параллельности вызовов.
+Если decline_rate не задан, отказ определяется по id счета, как раньше.
+
+Настройка — PROVIDER_SIMULATOR в settings, например:
+{"seed": 1, "default": {"latency": {"kind": "lognormal", "median_ms": 120, "sigma": 0.6},
+ "timeout_ms": 2000, "error_rate": 0.01}, "merchants": {"<user_id>": {"decline_rate": 0.3}}}
+"""
+import math
+import time
+import asyncio
+import random
+from functools import lru_cache
+from typing import Literal
+from django.conf import settings
+from pydantic import BaseModel
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_DECLINE = "decline"
+OUTCOME_ERROR = "error"
+OUTCOME_TIMEOUT = "timeout"
+
+
+class LatencyConfig(BaseModel):
+    kind: Literal["fixed", "lognormal", "histogram"] = "fixed"
+    fixed_ms: float = 0.0
+    median_ms: float = 100.0
+    sigma: float = 0.5
+    # Пары (задержка в мс, вес) — например, выгрузка гистограммы реального провайдера
+    histogram: list[tuple[float, float]] = []
+
+    def sample_ms(self, rng: random.Random) -> float:
+        if self.kind == "lognormal":
+            return rng.lognormvariate(math.log(self.median_ms), self.sigma)
+        if self.kind == "histogram" and self.histogram:
+            values, weights = zip(*self.histogram)
+            return rng.choices(values, weights=weights)[0]
+        return self.fixed_ms
+
+
+class ProviderProfile(BaseModel):
+    latency: LatencyConfig = LatencyConfig()
+    timeout_ms: float | None = None
+    error_rate: float = 0.0
+    decline_rate: float | None = None
+
+
+class SimulatedOutcome(BaseModel):
+    outcome: str
+    latency_ms: float
+
+
+class ProviderSimulator:
+
+    def __init__(self, default: ProviderProfile | None = None,
+                 merchants: dict[str, ProviderProfile] | None = None, seed: int = 0):
+        self.default = default or ProviderProfile()
+        self.merchants = merchants or {}
+        self.seed = seed
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ProviderSimulator":
+        return cls(
+            default=ProviderProfile(**config.get("default", {})),
+            merchants={
+                str(merchant): ProviderProfile(**profile)
+                for merchant, profile in config.get("merchants", {}).items()
+            },
+            seed=config.get("seed", 0),
+        )
+
+    def profile_for(self, merchant_id) -> ProviderProfile:
+        return self.merchants.get(str(merchant_id), self.default)
+
+    def simulate(self, invoice_id, merchant_id, attempt: int, deterministic_success: bool) -> SimulatedOutcome:
+        profile = self.profile_for(merchant_id)
+        rng = random.Random(f"{self.seed}:{invoice_id}:{attempt}")
+        latency_ms = profile.latency.sample_ms(rng)
+
+        if profile.timeout_ms is not None and latency_ms > profile.timeout_ms:
+            return SimulatedOutcome(outcome=OUTCOME_TIMEOUT, latency_ms=profile.timeout_ms)
+        if rng.random() < profile.error_rate:
+            return SimulatedOutcome(outcome=OUTCOME_ERROR, latency_ms=latency_ms)
+        if profile.decline_rate is None:
+            success = deterministic_success
+        else:
+            success = rng.random() >= profile.decline_rate
+        return SimulatedOutcome(outcome=OUTCOME_SUCCESS if success else OUTCOME_DECLINE, latency_ms=latency_ms)
+
+    def wait(self, outcome: SimulatedOutcome):
+        if outcome.latency_ms > 0:
+            time.sleep(outcome.latency_ms / 1000)
+
+    async def await_latency(self, outcome: SimulatedOutcome):
+        if outcome.latency_ms > 0:
+            await asyncio.sleep(outcome.latency_ms / 1000)
+
+
+@lru_cache(maxsize=1)
+def get_simulator() -> ProviderSimulator:
+    return ProviderSimulator.from_config(settings.PROVIDER_SIMULATOR)
@@ -0,0 +1,110 @@
+"""
+Ограничение частоты создания счетов: token bucket в Redis.
+Все корзины запроса (пользователь с лимитом его роли, мерчант счета, общий лимит)
+проверяются и списываются одним Lua-скриптом атомарно — один запрос в Redis на вызов API.
+Время берется из Redis (TIME), поэтому часы серверов приложения не влияют на лимиты.
+Настройка — INVOICE_RATE_LIMITS в settings: {"user": {"rate": 20, "burst": 40},
+"roles": {"administrator": {...}}, "merchant": {...}, "global": {...}}; rate — токенов в секунду,
+burst — емкость корзины. Отсутствующая область не ограничивается.
+Пакетное создание ограничивается своими корзинами (область "bulk" с той же структурой,
+емкость — не меньше INVOICE_BULK_MAX_ITEMS): из корзин пользователя и общей списывается
+число счетов, из корзины каждого мерчанта — число его счетов. Запрос дороже емкости корзины
+не пройдет никогда и отклоняется сразу (CostExceedsBurst).
+Если Redis недоступен, запросы пропускаются.
+"""
+import logging
+from django.conf import settings
+from redis.exceptions import RedisError
+from app.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ratelimit:invoice:"
+
+# KEYS — корзины, ARGV: тройки (стоимость, rate, burst) на каждую корзину.
+# Возвращает "0", если токены списаны, иначе секунды до появления нужных токенов в самой пустой корзине
+_TAKE = redis_client.register_script("""
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local tokens = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local cost = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local burst = tonumber(ARGV[i * 3])
+    local state = redis.call('HMGET', key, 't', 'ts')
+    local available = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    available = math.min(burst, available + math.max(0, now - ts) * rate)
+    tokens[i] = available
+    if available < cost then
+        wait = math.max(wait, (cost - available) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local cost = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local burst = tonumber(ARGV[i * 3])
+    redis.call('HSET', key, 't', tokens[i] - cost, 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return '0'
+""")
+
+
+class CostExceedsBurst(Exception):
+    """Стоимость запроса больше емкости корзины: запрос не пройдет ни при каком ожидании"""
+
+    def __init__(self, cost: int, burst: float):
+        super().__init__(f"Cost {cost} exceeds bucket capacity {burst}")
+        self.cost = cost
+        self.burst = burst
+
+
+def invoice_buckets(user, cost: int = 1, merchants: dict | None = None,
+                    bulk: bool = False) -> list[tuple[str, int, float, float]]:
+    """
+    Корзины (ключ, стоимость, rate, burst) для создания cost счетов пользователем user.
+    merchants — {id мерчанта: число его счетов в запросе}; bulk — корзины пакетного создания.
+    """
+    limits = settings.INVOICE_RATE_LIMITS
+    prefix = KEY_PREFIX
+    if bulk:
+        limits = limits.get("bulk", {})
+        prefix = f"{prefix}bulk:"
+    buckets = []
+    if user is not None and user.is_authenticated:
+        user_limit = limits.get("roles", {}).get(getattr(user, "role", None)) or limits.get("user")
+        if user_limit:
+            buckets.append((f"{prefix}user:{user.pk}", cost, user_limit["rate"], user_limit["burst"]))
+    if merchants and limits.get("merchant"):
+        merchant_limit = limits["merchant"]
+        for merchant_id, count in merchants.items():
+            buckets.append(
+                (f"{prefix}merchant:{merchant_id}", count, merchant_limit["rate"], merchant_limit["burst"]),
+            )
+    if limits.get("global"):
+        buckets.append((f"{prefix}global", cost, limits["global"]["rate"], limits["global"]["burst"]))
+    return buckets
+
+
+def take(buckets: list[tuple[str, int, float, float]]) -> float:
+    """
+    Списываем стоимость каждой корзины. 0 — разрешено, иначе через сколько секунд повторить.
+    Если стоимость больше емкости корзины — CostExceedsBurst.
+    """
+    if not buckets:
+        return 0.0
+    args = []
+    for _, cost, rate, burst in buckets:
+        if cost > burst:
+            raise CostExceedsBurst(cost, burst)
+        args += [cost, rate, burst]
+    try:
+        return float(_TAKE(keys=[key for key, _, _, _ in buckets], args=args))
+    except RedisError:
+        logger.warning("Redis недоступен, ограничение частоты не применяется", exc_info=True)
+        return 0.0
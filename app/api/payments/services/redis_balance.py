@@ -0,0 +1,347 @@
+"""
+Баланс в Redis (режим BILLING_BALANCE_STRATEGY = "redis").
+
+Состояние пользователя — хэш `balance:{user_id}` (balance, reserved, seq в копейках)
+и хэш удержаний `balance:{user_id}:holds` (счет -> сумма). Все изменения делает один
+Lua-скрипт: проверка остатка и резерв атомарны, блокировок в Postgres нет.
+Скрипт выполняется внутри транзакции Postgres, и ее откат изменение в Redis не отменяет,
+поэтому все операции со счетом идемпотентны и сходятся к тому, что в итоге закоммитит Postgres:
+- резерв: повтор находит уже сделанное удержание;
+- списание и освобождение удержания запоминаются по счету (`balance:{user_id}:settled`):
+  повтор той же операции ничего не меняет, а противоположная операция после отката
+  (списали, но транзакция откатилась, и счет в итоге не оплачен) разворачивает прежнюю;
+- пополнение по счету (возврат, компенсация) выполняется один раз.
+Записи о завершенных счетах хранятся REDIS_BALANCE_SETTLED_TTL секунд — дольше, чем
+счет может ждать повторной обработки (ретраи, восстановление зависших).
+
+Каждый вызов, изменивший баланс, пишет в поток `balance:changes` итоговое состояние
+с номером seq. Запись в UserBalance отложенная (write-behind): `persist` читает поток
+группой потребителей, оставляет по пользователю последнее состояние и обновляет строку,
+только если ее redis_seq меньше — повторная или запоздалая запись ничего не портит.
+Записи удаляются из потока только после коммита в Postgres.
+
+Состояние пользователя загружается из Postgres при первом обращении (`load`):
+balance из UserBalance, удержания — по счетам в статусе reserved.
+`rebuild` после потери или расхождения данных Redis: дописывает поток в Postgres,
+удаляет состояние и загружает его заново. Запускается при остановленном биллинге.
+
+Redis должен работать с AOF (appendonly) и без вытеснения ключей (maxmemory-policy noeviction).
+Разбиение баланса на шарды в этом режиме не используется.
+"""
+import os
+import socket
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from redis.exceptions import ResponseError
+from app.models import Invoice, UserBalance
+from app.redis_client import redis_client
+import logging
+
+logger = logging.getLogger(__name__)
+
+STRATEGY = "redis"
+
+KEY_PREFIX = "balance:"
+STREAM_KEY = "balance:changes"
+GROUP = "balance-writer"
+
+OP_RESERVE = "reserve"
+OP_DEBIT = "debit"
+OP_RELEASE = "release"
+OP_CREDIT = "credit"
+
+ZERO = Decimal("0.00")
+
+# KEYS: баланс, удержания, поток, завершенные счета (счет -> операция), время завершения (ZSET);
+# ARGV: user_id, текущее время, срок хранения завершенных, затем тройки (операция, счет, сумма в копейках).
+# Возвращает результат (1/0) по каждой операции или {-1}, если состояние пользователя не загружено
+_APPLY = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {-1}
+end
+local now = tonumber(ARGV[2])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[5], '-inf', now - tonumber(ARGV[3]), 'LIMIT', 0, 100)
+if #expired > 0 then
+    redis.call('HDEL', KEYS[4], unpack(expired))
+    redis.call('ZREM', KEYS[5], unpack(expired))
+end
+local balance = tonumber(redis.call('HGET', KEYS[1], 'balance'))
+local reserved = tonumber(redis.call('HGET', KEYS[1], 'reserved'))
+local results = {}
+local changed = false
+local function settle(invoice, op)
+    redis.call('HSET', KEYS[4], invoice, op)
+    redis.call('ZADD', KEYS[5], now, invoice)
+end
+for i = 4, #ARGV, 3 do
+    local op, invoice, amount = ARGV[i], ARGV[i + 1], tonumber(ARGV[i + 2])
+    local ok = 0
+    if amount > 0 then
+        local settled = invoice ~= '' and redis.call('HGET', KEYS[4], invoice) or false
+        if op == 'reserve' then
+            if redis.call('HEXISTS', KEYS[2], invoice) == 1 then
+                ok = 1
+            elseif balance - reserved >= amount then
+                reserved = reserved + amount
+                redis.call('HSET', KEYS[2], invoice, amount)
+                ok, changed = 1, true
+            end
+        elseif op == 'credit' then
+            if settled == 'credit' then
+                ok = 1
+            else
+                balance = balance + amount
+                if invoice ~= '' then
+                    settle(invoice, op)
+                end
+                ok, changed = 1, true
+            end
+        else
+            local held = tonumber(redis.call('HGET', KEYS[2], invoice)) or 0
+            if held >= amount then
+                reserved = reserved - amount
+                if op == 'debit' then
+                    balance = math.max(0, balance - amount)
+                end
+                if held == amount then
+                    redis.call('HDEL', KEYS[2], invoice)
+                else
+                    redis.call('HSET', KEYS[2], invoice, held - amount)
+                end
+                settle(invoice, op)
+                ok, changed = 1, true
+            elseif settled == op then
+                ok = 1
+            elseif settled == 'release' and op == 'debit' then
+                -- Освобождение откатилось в Postgres, счет все-таки оплачен
+                if balance - reserved >= amount then
+                    balance = balance - amount
+                    settle(invoice, op)
+                    ok, changed = 1, true
+                end
+            elseif settled == 'debit' and op == 'release' then
+                -- Списание откатилось в Postgres, счет в итоге не оплачен
+                balance = balance + amount
+                settle(invoice, op)
+                ok, changed = 1, true
+            end
+        end
+    end
+    results[#results + 1] = ok
+end
+if changed then
+    local seq = redis.call('HINCRBY', KEYS[1], 'seq', 1)
+    redis.call('HSET', KEYS[1], 'balance', balance, 'reserved', reserved)
+    redis.call('XADD', KEYS[3], '*', 'user', ARGV[1], 'seq', seq, 'balance', balance, 'reserved', reserved)
+end
+return results
+""")
+
+# KEYS: баланс, удержания; ARGV: balance, reserved, seq, затем пары (счет, сумма).
+# Не перезаписывает уже загруженное состояние
+_LOAD = redis_client.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('DEL', KEYS[2])
+redis.call('HSET', KEYS[1], 'balance', ARGV[1], 'reserved', ARGV[2], 'seq', ARGV[3])
+for i = 4, #ARGV, 2 do
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+return 1
+""")
+
+
+def enabled() -> bool:
+    return settings.BILLING_BALANCE_STRATEGY == STRATEGY
+
+
+def _keys(user_id) -> list[str]:
+    # Хэш-тег {user_id}: ключи пользователя в одном слоте кластера
+    return [f"{KEY_PREFIX}{{{user_id}}}", f"{KEY_PREFIX}{{{user_id}}}:holds"]
+
+
+def _settled_keys(user_id) -> list[str]:
+    return [f"{KEY_PREFIX}{{{user_id}}}:settled", f"{KEY_PREFIX}{{{user_id}}}:settled_at"]
+
+
+def _cents(amount: Decimal) -> int:
+    return int((amount * 100).to_integral_value())
+
+
+def _amount(cents) -> Decimal:
+    return (Decimal(int(cents)) / 100).quantize(ZERO)
+
+
+def load(user_id) -> bool:
+    """Загружаем состояние пользователя из Postgres, если его еще нет в Redis"""
+    snapshot, _ = UserBalance.objects.get_or_create(user_id=user_id)
+    holds = {
+        str(pk): _cents(amount)
+        for pk, amount in Invoice.objects.filter(
+            user_id=user_id, status=Invoice.STATUS_RESERVED,
+        ).values_list("id", "amount")
+    }
+    reserved = sum(holds.values())
+    if reserved != _cents(snapshot.reserved):
+        logger.warning(
+            "Резерв пользователя %s в UserBalance (%s) не совпадает с удержаниями счетов (%s), берем удержания",
+            user_id, snapshot.reserved, _amount(reserved),
+        )
+    args = [_cents(snapshot.balance), reserved, snapshot.redis_seq]
+    for invoice_id, cents in holds.items():
+        args += [invoice_id, cents]
+    return bool(_LOAD(keys=_keys(user_id), args=args))
+
+
+def apply(user_id, operations: list[tuple[str, object, Decimal]]) -> list[bool]:
+    """
+    Выполняем операции (операция, id счета, сумма) над балансом пользователя одним вызовом Lua.
+    Возвращает результат каждой операции. Повтор операции со счетом (после отката транзакции
+    Postgres) не меняет баланс второй раз.
+    """
+    if not operations:
+        return []
+    args = [str(user_id), time.time(), settings.REDIS_BALANCE_SETTLED_TTL]
+    for op, invoice_id, amount in operations:
+        args += [op, str(invoice_id or ""), _cents(amount)]
+    keys = [*_keys(user_id), STREAM_KEY, *_settled_keys(user_id)]
+    for _ in range(2):
+        results = _APPLY(keys=keys, args=args)
+        if results != [-1]:
+            return [bool(result) for result in results]
+        load(user_id)
+    raise RuntimeError(f"Не удалось загрузить баланс пользователя {user_id} в Redis")
+
+
+def reserve(invoice: Invoice, amount: Decimal) -> bool:
+    return apply(invoice.user_id, [(OP_RESERVE, invoice.pk, amount)])[0]
+
+
+def debit_reserved(invoice: Invoice, amount: Decimal) -> bool:
+    return apply(invoice.user_id, [(OP_DEBIT, invoice.pk, amount)])[0]
+
+
+def release(invoice: Invoice, amount: Decimal) -> bool:
+    return apply(invoice.user_id, [(OP_RELEASE, invoice.pk, amount)])[0]
+
+
+def credit(user_id, amount: Decimal, invoice: Invoice | None = None):
+    apply(user_id, [(OP_CREDIT, invoice.pk if invoice else None, amount)])
+
+
+def credit_many(user_id, items: list[tuple[Invoice, Decimal]]):
+    apply(user_id, [(OP_CREDIT, invoice.pk, amount) for invoice, amount in items])
+
+
+def balance_of(user_id) -> dict:
+    state = redis_client.hgetall(_keys(user_id)[0])
+    if not state:
+        load(user_id)
+        state = redis_client.hgetall(_keys(user_id)[0])
+    balance, reserved = _amount(state["balance"]), _amount(state["reserved"])
+    return {"balance": balance, "reserved": reserved, "available": balance - reserved}
+
+
+def forget(user_ids):
+    """Удаляем состояние пользователей из Redis (следующее обращение загрузит его из Postgres)"""
+    keys = [key for user_id in user_ids for key in (*_keys(user_id), *_settled_keys(user_id))]
+    if keys:
+        redis_client.delete(*keys)
+
+
+def ensure_group():
+    try:
+        redis_client.xgroup_create(STREAM_KEY, GROUP, id="0", mkstream=True)
+    except ResponseError as exc:
+        if "BUSYGROUP" not in str(exc):
+            raise
+
+
+def consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def persist(consumer: str, count: int | None = None, block_ms: int | None = None,
+            claim_idle_ms: int | None = None) -> int:
+    """
+    Одна порция отложенной записи: сначала забираем записи упавших потребителей,
+    затем новые. Возвращает количество обработанных записей потока.
+    """
+    count = count or settings.REDIS_BALANCE_PERSIST_BATCH
+    claim_idle_ms = settings.REDIS_BALANCE_CLAIM_IDLE_MS if claim_idle_ms is None else claim_idle_ms
+    ensure_group()
+
+    entries = redis_client.xautoclaim(
+        STREAM_KEY, GROUP, consumer, min_idle_time=claim_idle_ms, start_id="0-0", count=count,
+    )[1]
+    if not entries:
+        response = redis_client.xreadgroup(GROUP, consumer, {STREAM_KEY: ">"}, count=count, block=block_ms)
+        entries = response[0][1] if response else []
+    if not entries:
+        return 0
+
+    latest = {}
+    for _, fields in entries:
+        # Запись, удаленная из потока, приходит без полей
+        if not fields:
+            continue
+        seq = int(fields["seq"])
+        if seq > latest.get(fields["user"], {"seq": 0})["seq"]:
+            latest[fields["user"]] = {"seq": seq, "balance": fields["balance"], "reserved": fields["reserved"]}
+
+    now = timezone.now()
+    with transaction.atomic():
+        for user_id, state in latest.items():
+            UserBalance.objects.filter(user_id=user_id, redis_seq__lt=state["seq"]).update(
+                balance=_amount(state["balance"]),
+                reserved=_amount(state["reserved"]),
+                redis_seq=state["seq"],
+                updated_at=now,
+            )
+
+    entry_ids = [entry_id for entry_id, _ in entries]
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.xack(STREAM_KEY, GROUP, *entry_ids)
+    pipe.xdel(STREAM_KEY, *entry_ids)
+    pipe.execute()
+    return len(entries)
+
+
+def drain(consumer: str | None = None, claim_idle_ms: int | None = None) -> int:
+    """Записываем в Postgres все накопленные изменения"""
+    consumer = consumer or consumer_name()
+    count = settings.REDIS_BALANCE_PERSIST_BATCH
+    total = 0
+    while True:
+        processed = persist(consumer, count=count, claim_idle_ms=claim_idle_ms)
+        total += processed
+        if processed < count:
+            return total
+
+
+def rebuild(user_ids=None, warm: bool = False) -> int:
+    """
+    Пересобираем состояние Redis из Postgres: дописываем поток (включая записи
+    других потребителей), удаляем состояние пользователей и загружаем его заново.
+    Без user_ids удаляется состояние всех пользователей; warm — загрузить сразу, а не при обращении.
+    Возвращает количество загруженных пользователей.
+    """
+    drain(claim_idle_ms=0)
+    if user_ids is None:
+        keys = list(redis_client.scan_iter(match=f"{KEY_PREFIX}{{*", count=1000))
+        for start in range(0, len(keys), 1000):
+            redis_client.delete(*keys[start:start + 1000])
+        if not warm:
+            return 0
+        user_ids = UserBalance.objects.values_list("user_id", flat=True).iterator()
+    else:
+        forget(user_ids)
+
+    loaded = 0
+    for user_id in user_ids:
+        loaded += load(user_id)
+    return loaded
@@ -0,0 +1,62 @@
+"""
+Прогресс массовых возвратов в Redis.
+Задание — хэш со счетчиками: total (сколько платежей отобрано), refunded, skipped
+(платеж уже не в статусе success), failed (ошибка пакета) и статусом задания.
+Пакеты по пользователям обрабатываются параллельно и увеличивают счетчики сами,
+задание завершено, когда refunded + skipped + failed == total.
+"""
+import uuid
+from django.conf import settings
+from django.utils import timezone
+from app.redis_client import redis_client
+
+KEY_PREFIX = "refund:job:"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+
+
+def _key(job_id) -> str:
+    return f"{KEY_PREFIX}{job_id}"
+
+
+def create() -> str:
+    job_id = uuid.uuid4().hex
+    key = _key(job_id)
+    pipe = redis_client.pipeline()
+    pipe.hset(key, mapping={
+        "status": STATUS_QUEUED, "total": 0, "refunded": 0, "skipped": 0, "failed": 0,
+        "created_at": timezone.now().isoformat(),
+    })
+    pipe.expire(key, settings.REFUND_JOB_TTL)
+    pipe.execute()
+    return job_id
+
+
+def start(job_id, total: int):
+    redis_client.hset(_key(job_id), mapping={
+        "status": STATUS_RUNNING if total else STATUS_DONE, "total": total,
+    })
+
+
+def add(job_id, refunded: int = 0, skipped: int = 0, failed: int = 0):
+    key = _key(job_id)
+    pipe = redis_client.pipeline()
+    pipe.hincrby(key, "refunded", refunded)
+    pipe.hincrby(key, "skipped", skipped)
+    pipe.hincrby(key, "failed", failed)
+    pipe.hget(key, "total")
+    done_refunded, done_skipped, done_failed, total = pipe.execute()
+    if total is not None and done_refunded + done_skipped + done_failed >= int(total):
+        redis_client.hset(key, mapping={"status": STATUS_DONE, "finished_at": timezone.now().isoformat()})
+
+
+def get(job_id) -> dict | None:
+    data = redis_client.hgetall(_key(job_id))
+    if not data:
+        return None
+    for name in ("total", "refunded", "skipped", "failed"):
+        data[name] = int(data[name])
+    data["job_id"] = job_id
+    return data
@@ -0,0 +1,13 @@
+from app.api.celery_tasks import bulk_refund_task
+from app.api.payments.services import refund_jobs
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def start_bulk_refund(criteria: dict) -> str:
+    """Создаем задание массового возврата; criteria — данные BulkRefundSerializer в виде JSON"""
+    job_id = refund_jobs.create()
+    bulk_refund_task.delay(job_id, criteria)
+    logger.info("Массовый возврат %s поставлен в очередь: %s", job_id, criteria)
+    return job_id
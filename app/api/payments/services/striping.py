@@ -0,0 +1,114 @@
+from decimal import Decimal, ROUND_DOWN
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from app.models import UserBalance, UserBalanceShard
+import logging
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+
+
+def lock_shard_for_reserve(user_id, amount: Decimal) -> UserBalanceShard | None:
+    """
+    Блокируем шард с достаточными свободными средствами.
+    Сначала берем случайный незаблокированный шард (SKIP LOCKED),
+    если все подходящие заняты — ждем на шарде с наибольшим остатком.
+    Вызывать внутри транзакции.
+    """
+    candidates = (
+        UserBalanceShard.objects
+        .filter(user_id=user_id)
+        .alias(free=F("balance") - F("reserved"))
+        .filter(free__gte=amount)
+    )
+    shard = candidates.select_for_update(skip_locked=True).order_by("?").first()
+    if shard is None:
+        shard = candidates.select_for_update().order_by("-free").first()
+    return shard
+
+
+def _lock_all(user_id) -> tuple[UserBalance, list[UserBalanceShard]]:
+    # Порядок блокировок: заголовок, затем шарды по индексу
+    header, _ = UserBalance.objects.get_or_create(user_id=user_id)
+    header = UserBalance.objects.select_for_update().get(pk=header.pk)
+    shards = list(UserBalanceShard.objects.select_for_update().filter(user_id=user_id).order_by("index"))
+    return header, shards
+
+
+def _redistribute(header: UserBalance, shards: list[UserBalanceShard]):
+    """
+    Делим все свободные средства поровну между шардами.
+    Зарезервированные суммы остаются на своих строках.
+    """
+    pool = header.available() + sum((shard.available() for shard in shards), Decimal("0.00"))
+    share = (pool / len(shards)).quantize(CENT, rounding=ROUND_DOWN)
+    remainder = pool - share * len(shards)
+
+    header.balance = header.reserved
+    header.save(update_fields=["balance", "updated_at"])
+    now = timezone.now()
+    for i, shard in enumerate(shards):
+        shard.balance = shard.reserved + share + (remainder if i == 0 else Decimal("0.00"))
+        shard.updated_at = now
+    UserBalanceShard.objects.bulk_update(shards, ["balance", "updated_at"])
+
+
+@transaction.atomic
+def set_stripes(user_id, stripes: int) -> UserBalance:
+    """
+    Включаем/выключаем разбиение баланса пользователя на шарды.
+    Лишние шарды схлопываются в основную строку вместе с их резервами:
+    счета удаленных шардов теряют ссылку и дальше работают с основной строкой.
+    """
+    stripes = max(1, stripes)
+    header, shards = _lock_all(user_id)
+
+    keep = [shard for shard in shards if shard.index < stripes] if stripes > 1 else []
+    drop = [shard for shard in shards if shard not in keep]
+    for shard in drop:
+        header.balance += shard.balance
+        header.reserved += shard.reserved
+    if drop:
+        UserBalanceShard.objects.filter(pk__in=[shard.pk for shard in drop]).delete()
+
+    existing = {shard.index for shard in keep}
+    new_shards = [
+        UserBalanceShard(user_id=user_id, index=index)
+        for index in range(stripes) if stripes > 1 and index not in existing
+    ]
+    if new_shards:
+        UserBalanceShard.objects.bulk_create(new_shards)
+        keep = sorted(keep + new_shards, key=lambda shard: shard.index)
+
+    header.stripes = stripes
+    header.save(update_fields=["balance", "reserved", "stripes", "updated_at"])
+    if keep:
+        _redistribute(header, keep)
+
+    logger.info("Баланс пользователя %s разбит на %s шардов", user_id, stripes)
+    return header
+
+
+@transaction.atomic
+def rebalance(user_id) -> bool:
+    """Выравниваем свободные средства между шардами пользователя"""
+    header, shards = _lock_all(user_id)
+    if not header.is_striped or not shards:
+        return False
+    _redistribute(header, shards)
+    return True
+
+
+def total_balance(user_id) -> dict:
+    """Суммарный баланс пользователя: основная строка плюс все шарды"""
+    header = UserBalance.objects.filter(user_id=user_id).values("balance", "reserved").first() or {
+        "balance": Decimal("0.00"), "reserved": Decimal("0.00"),
+    }
+    shards = UserBalanceShard.objects.filter(user_id=user_id).aggregate(
+        balance=Sum("balance"), reserved=Sum("reserved"),
+    )
+    balance = header["balance"] + (shards["balance"] or Decimal("0.00"))
+    reserved = header["reserved"] + (shards["reserved"] or Decimal("0.00"))
+    return {"balance": balance, "reserved": reserved, "available": balance - reserved}
@@ -0,0 +1,129 @@
+"""
+Восстановление зависших счетов.
+Счет может навсегда остаться в pending/reserved (потерян .delay, воркер упал посреди задачи),
+а его резерв — висеть в балансе. Периодическая задача находит счета, не менявшиеся дольше
+STUCK_INVOICE_AFTER секунд, по частичному индексу invoice_stuck_idx и обрабатывает их
+порциями под SELECT ... FOR UPDATE SKIP LOCKED, поэтому параллельные запуски не пересекаются.
+- pending: заново отправляем в обработку;
+- reserved: заново отправляем, пока у платежа остались попытки, иначе компенсируем резерв.
+Отложенные из-за недоступности провайдера счета (parking) и авторизованные платежи,
+которые ждут пакетного списания (services/capture.py), не трогаем. Счета авторизованных
+платежей исключаются в самом запросе: они ждут capture до PAYMENT_AUTHORIZATION_TTL и,
+когда провайдер недоступен, копятся — иначе они занимали бы весь бюджет прохода.
+"""
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from redis.exceptions import RedisError
+from app.models import Invoice, Payment
+from app.api.payments.services import billing, parking
+from app.redis_client import redis_client
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = "sweeper:stuck_invoices"
+
+STUCK_STATUSES = (Invoice.STATUS_PENDING, Invoice.STATUS_RESERVED)
+
+
+@transaction.atomic
+def _sweep_chunk(status: str, cutoff, chunk_size: int, after, requeue, stats: dict) -> list[Invoice]:
+    queryset = Invoice.objects.select_for_update(skip_locked=True).filter(status=status, updated_at__lt=cutoff)
+    if status == Invoice.STATUS_RESERVED:
+        queryset = queryset.exclude(Exists(
+            Payment.objects.filter(invoice=OuterRef("pk"), status=Payment.STATUS_AUTHORIZED),
+        ))
+    if after is not None:
+        # Продолжаем после последнего просмотренного: отложенные счета не сканируются повторно
+        queryset = queryset.filter(Q(updated_at__gt=after[0]) | Q(updated_at=after[0], id__gt=after[1]))
+    invoices = list(queryset.order_by("updated_at", "id")[:chunk_size])
+    if not invoices:
+        return invoices
+
+    now = timezone.now()
+    stats["max_lag_seconds"] = max(stats["max_lag_seconds"], (now - invoices[0].updated_at).total_seconds())
+    try:
+        skip = parking.parked([str(invoice.pk) for invoice in invoices])
+    except RedisError:
+        skip = set()
+
+    payments = {}
+    if status == Invoice.STATUS_RESERVED:
+        payments = {p.invoice_id: p for p in Payment.objects.filter(invoice__in=invoices)}
+
+    to_requeue = []
+    for invoice in invoices:
+        if str(invoice.pk) in skip:
+            stats["parked"] += 1
+            continue
+        payment = payments.get(invoice.pk)
+        # Платеж мог стать authorized уже после выборки
+        if payment is not None and payment.status == Payment.STATUS_AUTHORIZED:
+            stats["authorized"] += 1
+            continue
+        if payment is not None and payment.attempts >= settings.STUCK_INVOICE_MAX_ATTEMPTS:
+            payment.invoice = invoice
+            billing.compensate_payment(payment, reason="Обработка счета зависла")
+            stats["compensated"] += 1
+        else:
+            to_requeue.append(invoice.pk)
+
+    if to_requeue:
+        # Сдвигаем updated_at, чтобы следующий проход не отправил счет повторно раньше срока
+        Invoice.objects.filter(pk__in=to_requeue).update(updated_at=now)
+        ids = [str(pk) for pk in to_requeue]
+        transaction.on_commit(lambda: requeue(ids))
+        stats["requeued"] += len(to_requeue)
+    stats["scanned"] += len(invoices)
+    return invoices
+
+
+def sweep(requeue) -> dict:
+    """
+    Один проход по зависшим счетам. requeue(invoice_ids) вызывается после коммита каждой порции.
+    Возвращает метрики прохода.
+    """
+    started = time.monotonic()
+    cutoff = timezone.now() - timedelta(seconds=settings.STUCK_INVOICE_AFTER)
+    stats = {"scanned": 0, "requeued": 0, "compensated": 0, "parked": 0, "authorized": 0, "max_lag_seconds": 0.0}
+
+    chunk_size = settings.STUCK_INVOICE_CHUNK_SIZE
+    for status in STUCK_STATUSES:
+        after = None
+        for _ in range(settings.STUCK_INVOICE_MAX_CHUNKS):
+            invoices = _sweep_chunk(status, cutoff, chunk_size, after, requeue, stats)
+            if len(invoices) < chunk_size:
+                break
+            after = (invoices[-1].updated_at, invoices[-1].pk)
+
+    duration = time.monotonic() - started
+    stats["duration_seconds"] = round(duration, 3)
+    stats["throughput_per_second"] = round(stats["scanned"] / duration, 1) if duration else 0.0
+    _record(stats)
+    return stats
+
+
+def _record(stats: dict):
+    """Накопленные счетчики и показатели последнего прохода в Redis"""
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for name in ("scanned", "requeued", "compensated"):
+            pipe.hincrby(STATS_KEY, f"{name}_total", stats[name])
+        pipe.hincrby(STATS_KEY, "runs_total", 1)
+        pipe.hset(STATS_KEY, mapping={
+            "last_max_lag_seconds": stats["max_lag_seconds"],
+            "last_duration_seconds": stats["duration_seconds"],
+            "last_throughput_per_second": stats["throughput_per_second"],
+            "last_run_at": time.time(),
+        })
+        pipe.execute()
+    except RedisError:
+        logger.warning("Не удалось сохранить метрики восстановления счетов", exc_info=True)
+
+
+def stats() -> dict:
+    return redis_client.hgetall(STATS_KEY)
@@ -1,10 +1,26 @@
 from django.urls import path
-from .views import InvoiceCreateView, InvoiceDetailView, PaymentListView
+from . import async_views
+from .views import (
+    InvoiceCreateView, InvoiceBulkCreateView, InvoiceDetailView, PaymentListView,
+    InvoiceExportView, PaymentExportView, PaymentBulkRefundView, RefundJobDetailView,
+)
 
 app_name = "payments"
 
 urlpatterns = [
     path("invoices/create/", InvoiceCreateView.as_view(), name="invoice-create"),
+    path("invoices/bulk-create/", InvoiceBulkCreateView.as_view(), name="invoice-bulk-create"),
     path("invoices/get-one/<uuid:pk>/", InvoiceDetailView.as_view(), name="invoice-detail"),
     path("payments/", PaymentListView.as_view(), name="payment-list"),
+    path("invoices/export/", InvoiceExportView.as_view(), name="invoice-export"),
+    path("payments/export/", PaymentExportView.as_view(), name="payment-export"),
+    path("payments/bulk-refund/", PaymentBulkRefundView.as_view(), name="payment-bulk-refund"),
+    path("payments/bulk-refund/<str:job_id>/", RefundJobDetailView.as_view(), name="refund-job-detail"),
+
+    # Асинхронные версии (запускать под ASGI-сервером)
+    path("async/invoices/create/", async_views.invoice_create, name="async-invoice-create"),
+    path("async/invoices/get-one/<uuid:pk>/", async_views.invoice_detail, name="async-invoice-detail"),
+    path("async/invoices/stream/<uuid:pk>/", async_views.invoice_stream, name="async-invoice-stream"),
+    path("async/invoices/wait/<uuid:pk>/", async_views.invoice_wait, name="async-invoice-wait"),
+    path("async/payments/", async_views.payment_list, name="async-payment-list"),
 ]
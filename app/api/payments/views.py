@@ -1,14 +1,26 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from drf_spectacular.types import OpenApiTypes
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
-from .serializers import InvoiceCreateSerializer, InvoiceSerializer, PaymentSerializer
+from rest_framework.permissions import IsAdminUser
+from rest_framework.exceptions import NotFound
+from .serializers import (
+    InvoiceCreateSerializer, InvoiceSerializer, PaymentSerializer,
+    InvoiceBulkCreateSerializer, InvoiceBulkCreateResponseSerializer, PaymentListFilterSerializer,
+    InvoiceExportFilterSerializer, PaymentExportFilterSerializer, BulkRefundSerializer, RefundJobSerializer,
+)
+from app.api.pagination import KeysetPagination
+from app.api.throttling import InvoiceBulkCreateThrottle, InvoiceCreateThrottle
+from .services import export, idempotency, invoice_cache, invoices as invoice_service, refund_jobs, refunds
 from app.models import Invoice, Payment
-from app.api.celery_tasks import process_invoice_task
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 
 
 class InvoiceCreateView(APIView):
+    throttle_classes = [InvoiceCreateThrottle]
 
     @extend_schema(
         tags=["Payments"],
@@ -18,22 +30,174 @@ class InvoiceCreateView(APIView):
     def post(self, request, *args, **kwargs):
         serializer = InvoiceCreateSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        invoice = serializer.save()
-        process_invoice_task.delay(str(invoice.id))
+
+        idempotency_key = serializer.validated_data.get("idempotency_key") or None
+        claimed = False
+        if idempotency_key:
+            claimed, cached = idempotency.acquire(idempotency_key)
+            if cached is not None:
+                return Response(cached, status=status.HTTP_201_CREATED)
+
+        try:
+            # Счет и сообщение outbox — в одной транзакции, брокер API не ждет
+            with transaction.atomic():
+                invoice = serializer.save()
+                if serializer.created:
+                    invoice_service.enqueue_invoice_processing([str(invoice.id)])
+        except Exception:
+            if claimed:
+                idempotency.release(idempotency_key)
+            raise
+
         out = InvoiceSerializer(invoice)
+        if claimed:
+            idempotency.store(idempotency_key, out.data)
         return Response(out.data, status=status.HTTP_201_CREATED)
 
 
+class InvoiceBulkCreateView(APIView):
+    throttle_classes = [InvoiceBulkCreateThrottle]
+
+    @extend_schema(
+        tags=["Payments"],
+        request=InvoiceBulkCreateSerializer,
+        responses=InvoiceBulkCreateResponseSerializer,
+    )
+    def post(self, request, *args, **kwargs):
+        """
+        Пакетное создание счетов \n
+        Результат возвращается по каждому элементу: `created`, `duplicate` или `invalid`
+        """
+        serializer = InvoiceBulkCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = invoice_service.bulk_create_invoices(serializer.validated_data["invoices"])
+        created = sum(1 for r in results if r["status"] == invoice_service.RESULT_CREATED)
+        return Response(
+            {"created": created, "total": len(results), "results": results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+
 @extend_schema(tags=["Payments"])
 class InvoiceDetailView(generics.RetrieveAPIView):
     queryset = Invoice.objects.all()
     serializer_class = InvoiceSerializer
     lookup_field = "pk"
 
+    def retrieve(self, request, *args, **kwargs):
+        # Снимок из кэша Redis, при промахе — из БД
+        data = invoice_cache.get_or_load(kwargs[self.lookup_field])
+        if data is None:
+            raise NotFound()
+        return Response(data)
 
-@extend_schema(tags=["Payments"])
+
+@extend_schema(tags=["Payments"], parameters=[PaymentListFilterSerializer])
 class PaymentListView(generics.ListAPIView):
-    queryset = Payment.objects.select_related("invoice").all()
+    queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        filters = PaymentListFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        params = filters.validated_data
+
+        queryset = super().get_queryset()
+        if "status" in params:
+            queryset = queryset.filter(status=params["status"])
+        if "invoice" in params:
+            queryset = queryset.filter(invoice_id=params["invoice"])
+        if "user" in params:
+            queryset = queryset.filter(invoice__user_id=params["user"])
+        return queryset
+
+
+class _ExportView(APIView):
+    filter_serializer_class = None
+    filename = None
+
+    def get_queryset(self, params: dict):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        filters = self.filter_serializer_class(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        params = filters.validated_data
+        cursor = KeysetPagination().decode_cursor(request)
+        queryset, fields = self.get_queryset(params)
+
+        export_format = params["export_format"]
+        # Под ASGI синхронный итератор был бы целиком прочитан в память до отправки
+        stream = export.astream if isinstance(request._request, ASGIRequest) else export.stream
+        response = StreamingHttpResponse(
+            stream(queryset, fields, export_format, cursor=cursor),
+            content_type=export.CONTENT_TYPES[export_format],
+        )
+        response["Content-Disposition"] = f'attachment; filename="{self.filename}.{export_format}"'
+        return response
+
+
+@extend_schema(
+    tags=["Payments"],
+    parameters=[InvoiceExportFilterSerializer, OpenApiParameter("cursor", OpenApiTypes.STR)],
+    responses={(200, "application/x-ndjson"): OpenApiTypes.STR, (200, "text/csv"): OpenApiTypes.STR},
+)
+class InvoiceExportView(_ExportView):
+    """
+    Потоковая выгрузка счетов (NDJSON или CSV) \n
+    Каждая строка содержит `cursor`: передайте его, чтобы продолжить выгрузку после этой строки
+    """
+    filter_serializer_class = InvoiceExportFilterSerializer
+    filename = "invoices"
+
+    def get_queryset(self, params: dict):
+        return export.invoices_queryset(params)
+
+
+@extend_schema(
+    tags=["Payments"],
+    parameters=[PaymentExportFilterSerializer, OpenApiParameter("cursor", OpenApiTypes.STR)],
+    responses={(200, "application/x-ndjson"): OpenApiTypes.STR, (200, "text/csv"): OpenApiTypes.STR},
+)
+class PaymentExportView(_ExportView):
+    """
+    Потоковая выгрузка платежей (NDJSON или CSV) \n
+    Каждая строка содержит `cursor`: передайте его, чтобы продолжить выгрузку после этой строки
+    """
+    filter_serializer_class = PaymentExportFilterSerializer
+    filename = "payments"
+
+    def get_queryset(self, params: dict):
+        return export.payments_queryset(params)
+
+
+class PaymentBulkRefundView(APIView):
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        tags=["Payments"],
+        request=BulkRefundSerializer,
+        responses={202: RefundJobSerializer},
+    )
+    def post(self, request, *args, **kwargs):
+        """
+        Массовый возврат успешных платежей по списку id или фильтру \n
+        Возвраты выполняются в фоне пакетами по пользователям, прогресс — в `payments/bulk-refund/<job_id>/`
+        """
+        serializer = BulkRefundSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job_id = refunds.start_bulk_refund(serializer.data)
+        return Response(refund_jobs.get(job_id), status=status.HTTP_202_ACCEPTED)
+
 
+class RefundJobDetailView(APIView):
+    permission_classes = [IsAdminUser]
 
+    @extend_schema(tags=["Payments"], responses=RefundJobSerializer)
+    def get(self, request, job_id, *args, **kwargs):
+        """Прогресс массового возврата"""
+        job = refund_jobs.get(job_id)
+        if job is None:
+            raise NotFound()
+        return Response(RefundJobSerializer(job).data)
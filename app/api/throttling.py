@@ -0,0 +1,54 @@
+import math
+from collections import Counter
+from rest_framework.exceptions import ValidationError
+from rest_framework.throttling import BaseThrottle
+from app.api.payments.services import rate_limit
+
+
+class InvoiceCreateThrottle(BaseThrottle):
+    """
+    Token bucket в Redis на создание счетов (см. services/rate_limit.py).
+    Стоимость запроса — число создаваемых счетов, для мерчанта — число его счетов;
+    DRF вернет 429 с заголовком Retry-After. Запрос дороже емкости корзины — 400.
+    """
+    bulk = False
+
+    def __init__(self):
+        self.retry_after = None
+
+    def get_items(self, request) -> list:
+        data = request.data
+        if not hasattr(data, "get"):
+            return []
+        invoices = data.get("invoices")
+        if isinstance(invoices, list) and invoices:
+            return invoices
+        return [data]
+
+    def get_merchants(self, items: list) -> dict:
+        return dict(Counter(
+            str(item["user_id"]) for item in items if hasattr(item, "get") and item.get("user_id")
+        ))
+
+    def allow_request(self, request, view):
+        items = self.get_items(request)
+        cost = max(1, len(items))
+        buckets = rate_limit.invoice_buckets(request.user, cost, self.get_merchants(items), bulk=self.bulk)
+        try:
+            wait = rate_limit.take(buckets)
+        except rate_limit.CostExceedsBurst as exc:
+            raise ValidationError({"invoices": [
+                f"Слишком много счетов в одном запросе: {exc.cost}, допустимо не больше {int(exc.burst)}",
+            ]})
+        if wait > 0:
+            self.retry_after = wait
+            return False
+        return True
+
+    def wait(self):
+        return math.ceil(self.retry_after) if self.retry_after else None
+
+
+class InvoiceBulkCreateThrottle(InvoiceCreateThrottle):
+    """Пакетное создание: свои корзины с емкостью под INVOICE_BULK_MAX_ITEMS"""
+    bulk = True
@@ -7,6 +7,7 @@ from rest_framework.parsers import FormParser, MultiPartParser
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 
 from app.models import User
+from app.api.pagination import KeysetPagination
 from .serializers import UserSerializer, UserCreateUpdateSerializer
 
 logger = logging.getLogger(__name__)
@@ -71,19 +72,33 @@ class UserInfoView(APIView):
 class UsersListView(APIView):
     permission_classes = [IsAuthenticated]
 
-    @extend_schema(tags=['Users'])
+    @extend_schema(
+        tags=['Users'],
+        parameters=[
+            OpenApiParameter(name="cursor", description="Курсор следующей страницы", type=str),
+            OpenApiParameter(name="page_size", description="Размер страницы", type=int),
+            OpenApiParameter(name="role", description="Фильтр по роли", type=str),
+        ],
+        responses=UserSerializer(many=True),
+    )
     def get(self, request):
         """
-        Получить всех пользователей
+        Получить пользователей (постранично, от новых к старым)
         """
         user = request.user
         assert isinstance(user, User)
 
         users = User.objects.all()
-        serializer = UserSerializer(users, many=True)
+        role = request.query_params.get("role")
+        if role:
+            users = users.filter(role=role)
+
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(users, request, view=self)
+        serializer = UserSerializer(page, many=True)
 
         logger.info("Успешный запрос информации пользователей")
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return paginator.get_paginated_response(serializer.data)
 
 
 class ChangeUserView(APIView):
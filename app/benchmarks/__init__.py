@@ -0,0 +1,19 @@
+"""
+Бенчмарки горячих путей.
+Сценарии регистрируются декоратором `scenario` и запускаются командой `manage.py bench`.
+"""
+SCENARIOS = {}
+
+
+def scenario(name: str):
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+def load_scenarios() -> dict:
+    from app.benchmarks import (  # noqa: F401
+        api, billing_ops, capture, http, pipeline, provider, queries, queues, strategies, striping,
+    )
+    return SCENARIOS
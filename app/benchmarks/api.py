@@ -0,0 +1,70 @@
+import json
+import threading
+from contextlib import nullcontext
+from decimal import Decimal
+from unittest import mock
+from django.conf import settings
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from app.api.payments.services import invoices as invoice_service
+from app.benchmarks import scenario
+from app.benchmarks.fixtures import create_invoices_for, create_users
+from app.benchmarks.runner import BenchConfig, run_concurrent
+
+_local = threading.local()
+
+
+def _client() -> Client:
+    # Отдельный клиент на поток
+    if not hasattr(_local, "client"):
+        _local.client = Client(HTTP_HOST=settings.ALLOWED_HOSTS[0])
+    return _local.client
+
+
+def _check(response, expected: int):
+    if response.status_code != expected:
+        raise RuntimeError(f"HTTP {response.status_code}: {response.content[:200]!r}")
+
+
+@scenario("api")
+def api_latency(config: BenchConfig) -> list[dict]:
+    """
+    Задержка создания и получения счета через тестовый клиент Django (весь стек DRF).
+    Публикация задач в брокер отключена, если не задано dispatch=1.
+    outbox=0 — публикация сразу после коммита вместо сообщения outbox (для сравнения p99 с dispatch=1).
+    Ограничение частоты создания счетов отключено: измеряется стек, а не ответы 429.
+    """
+    users = create_users(config.users, balance=Decimal(config.iterations) * 10)
+    token = Token.objects.create(user=users[0])
+    auth = {"HTTP_AUTHORIZATION": f"Token {token.key}"}
+    sequence = config.user_sequence()
+
+    create_url = reverse("payments:invoice-create")
+    bodies = [
+        json.dumps({"user_id": str(users[index].pk), "amount": "1.00", "currency": "USD"})
+        for index in sequence
+    ]
+
+    def create(i):
+        response = _client().post(create_url, bodies[i], content_type="application/json", **auth)
+        _check(response, 201)
+
+    invoices = create_invoices_for(users, sequence)
+
+    def detail(i):
+        response = _client().get(reverse("payments:invoice-detail", kwargs={"pk": invoices[i].pk}), **auth)
+        _check(response, 200)
+
+    results = []
+    if config.params.get("dispatch") == "1":
+        dispatch = nullcontext()
+    else:
+        dispatch = mock.patch.object(invoice_service, "dispatch_invoice_processing", lambda ids: None)
+    outbox = config.params.get("outbox")
+    outbox_settings = override_settings(OUTBOX_ENABLED=outbox == "1") if outbox is not None else nullcontext()
+    with dispatch, outbox_settings, override_settings(INVOICE_RATE_LIMITS={}):
+        for name, operation in (("invoice_create", create), ("invoice_detail", detail)):
+            stats = run_concurrent(operation, config.iterations, config.workers)
+            results.append({"endpoint": name, **config.describe(), **stats})
+    return results
@@ -0,0 +1,40 @@
+from decimal import Decimal
+from app.models import Invoice, Payment
+from app.api.payments.services import billing
+from app.benchmarks import scenario
+from app.benchmarks.fixtures import add_reserved, create_invoices_for, create_payments, create_users
+from app.benchmarks.runner import BenchConfig, run_concurrent
+
+FUNCTIONS = ("reserve_funds", "complete_payment", "compensate_payment", "refund_payment")
+
+
+def _prepare(function: str, config: BenchConfig) -> list:
+    users = create_users(config.users, balance=Decimal(config.iterations) * 10)
+    sequence = config.user_sequence()
+    if function == "reserve_funds":
+        return create_invoices_for(users, sequence)
+    if function == "refund_payment":
+        invoices = create_invoices_for(users, sequence, status=Invoice.STATUS_COMPLETED)
+        return create_payments(invoices, status=Payment.STATUS_SUCCESS)
+    # complete/compensate работают с уже зарезервированными средствами
+    invoices = create_invoices_for(users, sequence, status=Invoice.STATUS_RESERVED)
+    add_reserved(invoices)
+    return create_payments(invoices)
+
+
+@scenario("billing")
+def billing_functions(config: BenchConfig) -> list[dict]:
+    """
+    Каждая функция billing.py отдельно под конкурентной нагрузкой.
+    Параметры: functions=reserve_funds,complete_payment,compensate_payment,refund_payment
+    """
+    functions = config.params.get("functions", ",".join(FUNCTIONS)).split(",")
+    results = []
+    for function in functions:
+        if function not in FUNCTIONS:
+            raise ValueError(f"Неизвестная функция биллинга: {function}")
+        targets = _prepare(function, config)
+        call = getattr(billing, function)
+        stats = run_concurrent(lambda i: call(targets[i]), config.iterations, config.workers)
+        results.append({"function": function, **config.describe(), **stats})
+    return results
@@ -0,0 +1,43 @@
+import math
+from datetime import timedelta
+from decimal import Decimal
+from django.utils import timezone
+from app.models import Invoice, Payment
+from app.api.payments.services import capture
+from app.benchmarks import scenario
+from app.benchmarks.fixtures import add_reserved, create_invoices_for, create_payments, create_users
+from app.benchmarks.runner import BenchConfig, run_concurrent
+
+
+@scenario("capture_batch")
+def capture_batch(config: BenchConfig) -> list[dict]:
+    """
+    Пакетное списание авторизованных платежей в зависимости от размера пакета.
+    Операция — один пакет (вызов провайдера и транзакция), пропускная способность в платежах — payments_per_s.
+    Параметры: batch_sizes=1,10,100,500
+    """
+    batch_sizes = [int(v) for v in config.params.get("batch_sizes", "1,10,100,500").split(",")]
+    results = []
+    for batch_size in batch_sizes:
+        users = create_users(config.users, balance=Decimal(config.iterations) * 10)
+        invoices = create_invoices_for(users, config.user_sequence(), status=Invoice.STATUS_RESERVED)
+        add_reserved(invoices)
+        payments = create_payments(invoices, status=Payment.STATUS_AUTHORIZED)
+        now = timezone.now()
+        Payment.objects.filter(pk__in=[p.pk for p in payments]).update(
+            authorized_at=now, authorization_expires_at=now + timedelta(hours=1),
+        )
+
+        batches = math.ceil(len(payments) / batch_size)
+        stats = run_concurrent(lambda i: capture.capture_due(batch_size), batches, config.workers)
+        captured = Payment.objects.filter(
+            pk__in=[p.pk for p in payments], status__in=[Payment.STATUS_SUCCESS, Payment.STATUS_FAILED],
+        ).count()
+        results.append({
+            "batch_size": batch_size,
+            "payments": captured,
+            "payments_per_s": round(captured / stats["elapsed_s"], 2) if stats["elapsed_s"] else 0.0,
+            **config.describe(),
+            **stats,
+        })
+    return results
@@ -0,0 +1,55 @@
+import uuid
+from decimal import Decimal
+from django.db.models import F
+from app.models import Invoice, Payment, User, UserBalance
+
+BENCH_USER_PREFIX = "bench-"
+
+
+def create_user(balance: Decimal = Decimal("0.00")) -> User:
+    suffix = uuid.uuid4().hex[:12]
+    user = User.objects.create(
+        username=f"{BENCH_USER_PREFIX}{suffix}",
+        email=f"{BENCH_USER_PREFIX}{suffix}@bench.local",
+        role="user",
+    )
+    UserBalance.objects.create(user=user, balance=balance)
+    return user
+
+
+def create_users(count: int, balance: Decimal = Decimal("0.00")) -> list[User]:
+    return [create_user(balance=balance) for _ in range(max(1, count))]
+
+
+def create_invoices(user: User, count: int, amount: Decimal = Decimal("1.00")) -> list[Invoice]:
+    invoices = [Invoice(user=user, amount=amount) for _ in range(count)]
+    return Invoice.objects.bulk_create(invoices, batch_size=1000)
+
+
+def create_invoices_for(users: list[User], sequence: list[int], amount: Decimal = Decimal("1.00"),
+                        status: str = Invoice.STATUS_PENDING) -> list[Invoice]:
+    """Счета по одному на операцию; sequence — индекс пользователя для каждой операции"""
+    invoices = [Invoice(user=users[index], amount=amount, status=status) for index in sequence]
+    return Invoice.objects.bulk_create(invoices, batch_size=1000)
+
+
+def create_payments(invoices: list[Invoice], status: str = Payment.STATUS_PENDING) -> list[Payment]:
+    payments = [
+        Payment(invoice=invoice, amount=invoice.amount, status=status, attempts=1)
+        for invoice in invoices
+    ]
+    return Payment.objects.bulk_create(payments, batch_size=1000)
+
+
+def add_reserved(invoices: list[Invoice]):
+    """Отражаем в балансах резерв под уже зарезервированные счета"""
+    totals = {}
+    for invoice in invoices:
+        totals[invoice.user_id] = totals.get(invoice.user_id, Decimal("0.00")) + invoice.amount
+    for user_id, amount in totals.items():
+        UserBalance.objects.filter(user_id=user_id).update(reserved=F("reserved") + amount)
+
+
+def cleanup():
+    """Удаляем все данные бенчмарков (каскадом вместе со счетами и балансами)"""
+    User.objects.filter(username__startswith=BENCH_USER_PREFIX).delete()
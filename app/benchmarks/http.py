@@ -0,0 +1,38 @@
+import urllib.request
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from app.benchmarks import scenario
+from app.benchmarks.fixtures import create_user, create_invoices
+from app.benchmarks.runner import BenchConfig, run_concurrent
+
+
+def _get(url: str, token: str):
+    request = urllib.request.Request(url, headers={"Authorization": f"Token {token}"})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+        response.read()
+
+
+@scenario("http_status_poll")
+def http_status_poll(config: BenchConfig) -> list[dict]:
+    """
+    Опрос статуса счета через работающие серверы: WSGI (DRF) против ASGI (async ORM).
+    Оба сервера должны смотреть в ту же БД.
+    Параметры: wsgi_url=http://127.0.0.1:8009 asgi_url=http://127.0.0.1:8010
+    """
+    user = create_user()
+    token = Token.objects.create(user=user)
+    invoice = create_invoices(user, 1)[0]
+
+    targets = {
+        "wsgi": config.params.get("wsgi_url", "http://127.0.0.1:8009").rstrip("/")
+        + reverse("payments:invoice-detail", kwargs={"pk": invoice.pk}),
+        "asgi": config.params.get("asgi_url", "http://127.0.0.1:8010").rstrip("/")
+        + reverse("payments:async-invoice-detail", kwargs={"pk": invoice.pk}),
+    }
+    results = []
+    for server, url in targets.items():
+        stats = run_concurrent(lambda i: _get(url, token.key), config.iterations, config.workers)
+        results.append({"server": server, "url": url, "in_flight": config.workers, **stats})
+    return results
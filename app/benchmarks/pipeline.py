@@ -0,0 +1,18 @@
+from decimal import Decimal
+from app.api.celery_tasks import process_invoice_task
+from app.benchmarks import scenario
+from app.benchmarks.fixtures import create_invoices_for, create_users
+from app.benchmarks.runner import BenchConfig, run_concurrent
+
+
+@scenario("invoice_task")
+def invoice_task(config: BenchConfig) -> list[dict]:
+    """Полный прогон process_invoice_task в eager-режиме (без брокера)"""
+    users = create_users(config.users, balance=Decimal(config.iterations) * 10)
+    invoices = create_invoices_for(users, config.user_sequence())
+    stats = run_concurrent(
+        lambda i: process_invoice_task.apply(args=[str(invoices[i].pk)], throw=True),
+        config.iterations,
+        config.workers,
+    )
+    return [{"task": "process_invoice_task", **config.describe(), **stats}]
@@ -0,0 +1,29 @@
+import json
+import uuid
+from decimal import Decimal
+from app.models import Invoice, Payment
+from app.api.payments.services import payment_processor
+from app.api.payments.services.provider_simulator import ProviderSimulator, get_simulator
+from app.benchmarks import scenario
+from app.benchmarks.runner import BenchConfig, run_concurrent
+
+
+@scenario("provider_charge")
+def provider_charge(config: BenchConfig) -> list[dict]:
+    """
+    Вызов payment_processor.charge без обращений к БД (объекты в памяти).
+    Параметры: profile='{"latency": {"kind": "lognormal", "median_ms": 120}, "error_rate": 0.01}'
+    """
+    profile = config.params.get("profile")
+    if profile:
+        simulator = ProviderSimulator.from_config({"default": json.loads(profile), "seed": config.seed})
+    else:
+        simulator = get_simulator()
+    payments = [
+        Payment(invoice=Invoice(id=uuid.uuid4(), amount=Decimal("1.00")), amount=Decimal("1.00"))
+        for _ in range(config.iterations)
+    ]
+    stats = run_concurrent(
+        lambda i: payment_processor.charge(payments[i], simulator=simulator), config.iterations, config.workers,
+    )
+    return [{"function": "charge", **config.describe(), **stats}]
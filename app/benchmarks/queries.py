@@ -0,0 +1,79 @@
+import uuid
+from decimal import Decimal
+from unittest import mock
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from app.models import Invoice
+from app.api.celery_tasks import process_invoice_task
+from app.api.payments.services import payment_processor
+from app.benchmarks import scenario
+from app.benchmarks.fixtures import create_user
+from app.benchmarks.runner import BenchConfig
+
+# Бюджет SQL-запросов на один прогон process_invoice_task (стратегия locking, обычный баланс),
+# с BEGIN/COMMIT каждой транзакции: их тоже записывает CaptureQueriesContext.
+# Успех/отказ провайдера: 5 запросов фазы резерва + 4 запроса фазы списания/компенсации
+# и по BEGIN/COMMIT на каждую фазу. Проверяется тестом app/tests/test_invoice_queries.py.
+QUERY_BUDGETS = {
+    "success": 13,
+    "insufficient_funds": 5,
+    "provider_failure": 13,
+    "retry": 18,
+}
+
+
+def _invoice_id(success: bool) -> uuid.UUID:
+    # Исход симулятора провайдера определяется четностью последней hex-цифры id счета
+    while True:
+        value = uuid.uuid4()
+        if (int(value.hex[-1], 16) % 2 == 0) == success:
+            return value
+
+
+def _flaky_charge():
+    real_charge = payment_processor.charge
+    calls = {"count": 0}
+
+    def charge(payment):
+        calls["count"] += 1
+        if calls["count"] == 1:
+            raise payment_processor.ExternalPaymentError("Simulated timeout")
+        return real_charge(payment)
+    return charge
+
+
+def prepare_outcome(outcome: str) -> tuple[Invoice, object]:
+    """Счет и функция списания провайдера, при которых прогон задачи завершится исходом outcome"""
+    balance = Decimal("0.00") if outcome == "insufficient_funds" else Decimal("100.00")
+    user = create_user(balance=balance)
+    invoice = Invoice.objects.create(
+        id=_invoice_id(success=outcome != "provider_failure"),
+        user=user,
+        amount=Decimal("10.00"),
+    )
+    charge = _flaky_charge() if outcome == "retry" else payment_processor.charge
+    return invoice, charge
+
+
+def _run(outcome: str) -> int:
+    invoice, charge = prepare_outcome(outcome)
+    with mock.patch.object(payment_processor, "charge", charge):
+        with CaptureQueriesContext(connection) as ctx:
+            process_invoice_task.apply(args=[str(invoice.pk)])
+    return len(ctx.captured_queries)
+
+
+@scenario("invoice_queries")
+def invoice_queries(config: BenchConfig) -> list[dict]:
+    """
+    Количество SQL-запросов на один прогон задачи для каждого исхода
+    в сравнении с бюджетом QUERY_BUDGETS. Параметры: fail_over_budget=1
+    """
+    results = []
+    for outcome, budget in QUERY_BUDGETS.items():
+        queries = _run(outcome)
+        results.append({"outcome": outcome, "queries": queries, "budget": budget, "ok": queries <= budget})
+
+    if config.params.get("fail_over_budget") == "1" and not all(r["ok"] for r in results):
+        raise AssertionError(f"Превышен бюджет запросов: {results}")
+    return results
@@ -0,0 +1,63 @@
+import time
+from decimal import Decimal
+from celery import group
+from django.utils import timezone
+from app.models import Invoice, Payment
+from app.api.celery_tasks import refund_invoice_task
+from app.api.payments.services import invoices as invoice_service
+from app.benchmarks import scenario
+from app.benchmarks.fixtures import create_invoices_for, create_payments, create_users
+from app.benchmarks.runner import BenchConfig, summarize
+
+TERMINAL = (Invoice.STATUS_COMPLETED, Invoice.STATUS_FAILED)
+
+
+def _charge_latency(users, sequence, timeout: float) -> dict:
+    """Отправляем счета через брокер и ждем конечного статуса; задержка — от отправки до updated_at"""
+    invoices = create_invoices_for(users, sequence)
+    invoice_ids = [str(invoice.pk) for invoice in invoices]
+    dispatched_at = timezone.now()
+    started = time.perf_counter()
+    invoice_service.dispatch_invoice_processing(invoice_ids)
+
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        if Invoice.objects.filter(pk__in=invoice_ids).exclude(status__in=TERMINAL).count() == 0:
+            break
+        time.sleep(0.2)
+    elapsed = time.perf_counter() - started
+
+    latencies = [
+        (updated_at - dispatched_at).total_seconds()
+        for updated_at in Invoice.objects.filter(pk__in=invoice_ids, status__in=TERMINAL)
+        .values_list("updated_at", flat=True)
+    ]
+    return summarize(latencies, len(invoice_ids) - len(latencies), elapsed)
+
+
+@scenario("queue_isolation")
+def queue_isolation(config: BenchConfig) -> list[dict]:
+    """
+    Задержка списаний через настоящий брокер и воркеры: без нагрузки и во время массовых возвратов.
+    Нужны запущенные воркеры очередей charges и refunds (docker-compose).
+    iterations — число счетов в каждом замере.
+    Параметры: storm=5000 (задач возврата), timeout=300 (секунд на замер)
+    """
+    storm = int(config.params.get("storm", 5000))
+    timeout = float(config.params.get("timeout", 300))
+    users = create_users(config.users, balance=Decimal(config.iterations + storm) * 10)
+    sequence = config.user_sequence()
+
+    results = [{"phase": "baseline", **config.describe(), **_charge_latency(users, sequence, timeout)}]
+
+    refunded_invoices = create_invoices_for(users, config.user_sequence(storm), status=Invoice.STATUS_COMPLETED)
+    payments = create_payments(refunded_invoices, status=Payment.STATUS_SUCCESS)
+    group(refund_invoice_task.s(str(payment.pk)) for payment in payments).apply_async()
+
+    charges = _charge_latency(users, sequence, timeout)
+    refunds_done = Payment.objects.filter(
+        pk__in=[payment.pk for payment in payments], status=Payment.STATUS_REFUNDED,
+    ).count()
+    results.append({"phase": "refund_storm", "storm": storm, "refunds_done": refunds_done,
+                    **config.describe(), **charges})
+    return results
@@ -0,0 +1,101 @@
+import time
+import random
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from pydantic import BaseModel
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+DISTRIBUTION_UNIFORM = "uniform"
+DISTRIBUTION_HOTKEY = "hotkey"
+
+
+class BenchConfig(BaseModel):
+    iterations: int = 2000
+    workers: int = 8
+    # Распределение операций по пользователям
+    users: int = 1
+    distribution: str = DISTRIBUTION_UNIFORM
+    hot_share: float = 0.9
+    seed: int = 42
+    params: dict[str, str] = {}
+
+    def user_sequence(self, count: int | None = None) -> list[int]:
+        """
+        Индекс пользователя для каждой операции.
+        uniform — равномерно; hotkey — доля hot_share операций приходится на пользователя 0.
+        """
+        count = self.iterations if count is None else count
+        rng = random.Random(self.seed)
+        if self.users <= 1:
+            return [0] * count
+        if self.distribution == DISTRIBUTION_HOTKEY:
+            return [0 if rng.random() < self.hot_share else rng.randrange(1, self.users) for _ in range(count)]
+        return [rng.randrange(self.users) for _ in range(count)]
+
+    def describe(self) -> dict:
+        return self.model_dump(exclude={"params"})
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    ops = len(latencies)
+    return {
+        "ops": ops,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_ops_s": round(ops / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+            "p50": round(_percentile(latencies, 50) * 1000, 3),
+            "p95": round(_percentile(latencies, 95) * 1000, 3),
+            "p99": round(_percentile(latencies, 99) * 1000, 3),
+            "max": round(max(latencies) * 1000, 3) if latencies else 0.0,
+        },
+    }
+
+
+def run_concurrent(operation, iterations: int, workers: int) -> dict:
+    """
+    Выполняем operation(i) для i в range(iterations) в `workers` потоках.
+    У каждого потока свое соединение с БД, поэтому блокировки конкурируют по-настоящему.
+    """
+    latencies = []
+    errors = 0
+
+    def timed(i):
+        started = time.perf_counter()
+        try:
+            operation(i)
+        except Exception:
+            logger.exception("Ошибка в операции бенчмарка")
+            return None
+        return time.perf_counter() - started
+
+    def worker(indexes):
+        try:
+            return [timed(i) for i in indexes]
+        finally:
+            connection.close()
+
+    chunks = [range(w, iterations, workers) for w in range(workers)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for chunk in pool.map(worker, chunks):
+            for latency in chunk:
+                if latency is None:
+                    errors += 1
+                else:
+                    latencies.append(latency)
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, errors, elapsed)
@@ -0,0 +1,62 @@
+import time
+from decimal import Decimal
+from django.test import override_settings
+from app.api.payments.services import billing, optimistic_balance, redis_balance
+from app.benchmarks import scenario
+from app.benchmarks.fixtures import create_invoices_for, create_users
+from app.benchmarks.runner import BenchConfig, DISTRIBUTION_UNIFORM, run_concurrent
+
+STRATEGIES = ("locking", "ledger", redis_balance.STRATEGY, optimistic_balance.STRATEGY)
+
+# high — все операции на одном балансе; low — равномерно по --users пользователям (не меньше 10 на поток)
+CONTENTION_HIGH = "high"
+CONTENTION_LOW = "low"
+
+
+def _run(strategy: str, config: BenchConfig) -> dict:
+    users = create_users(config.users, balance=Decimal(config.iterations) * 10)
+    invoices = create_invoices_for(users, config.user_sequence())
+    result = {"strategy": strategy}
+    with override_settings(BILLING_BALANCE_STRATEGY=strategy):
+        if strategy == redis_balance.STRATEGY:
+            for user in users:
+                redis_balance.load(user.pk)
+        try:
+            stats = run_concurrent(lambda i: billing.reserve_funds(invoices[i]), config.iterations, config.workers)
+            if strategy == redis_balance.STRATEGY:
+                started = time.perf_counter()
+                result["write_behind"] = {
+                    "entries": redis_balance.drain(),
+                    "elapsed_s": round(time.perf_counter() - started, 4),
+                }
+        finally:
+            if strategy == redis_balance.STRATEGY:
+                redis_balance.forget([user.pk for user in users])
+    return {**result, **config.describe(), **stats}
+
+
+@scenario("balance_strategy")
+def balance_strategy(config: BenchConfig) -> list[dict]:
+    """
+    Резервирование средств (reserve_funds) в разных стратегиях баланса при высокой
+    (один пользователь) и низкой (--users пользователей, равномерно) конкуренции.
+    Для redis дополнительно измеряется время отложенной записи накопленных изменений в Postgres.
+    Параметры: strategies=locking,optimistic,redis contention=high,low
+    """
+    strategies = config.params.get(
+        "strategies", f"locking,{optimistic_balance.STRATEGY},{redis_balance.STRATEGY}",
+    ).split(",")
+    contentions = config.params.get("contention", f"{CONTENTION_HIGH},{CONTENTION_LOW}").split(",")
+    results = []
+    for contention in contentions:
+        if contention not in (CONTENTION_HIGH, CONTENTION_LOW):
+            raise ValueError(f"Неизвестный уровень конкуренции: {contention}")
+        run_config = config.model_copy(update={
+            "users": 1 if contention == CONTENTION_HIGH else max(config.users, config.workers * 10),
+            "distribution": DISTRIBUTION_UNIFORM,
+        })
+        for strategy in strategies:
+            if strategy not in STRATEGIES:
+                raise ValueError(f"Неизвестная стратегия баланса: {strategy}")
+            results.append({"contention": contention, **_run(strategy, run_config)})
+    return results
@@ -0,0 +1,24 @@
+from decimal import Decimal
+from app.api.payments.services import billing, striping
+from app.benchmarks import scenario
+from app.benchmarks.fixtures import create_user, create_invoices
+from app.benchmarks.runner import BenchConfig, run_concurrent
+
+
+@scenario("balance_striping")
+def balance_striping(config: BenchConfig) -> list[dict]:
+    """
+    Пропускная способность резервирования для одного горячего пользователя
+    в зависимости от количества шардов баланса.
+    Параметры: stripes=1,2,4,8,16
+    """
+    stripe_counts = [int(v) for v in config.params.get("stripes", "1,2,4,8,16").split(",")]
+    results = []
+    for stripes in stripe_counts:
+        user = create_user(balance=Decimal(config.iterations) * 10)
+        striping.set_stripes(user.pk, stripes)
+        invoices = create_invoices(user, config.iterations)
+
+        stats = run_concurrent(lambda i: billing.reserve_funds(invoices[i]), config.iterations, config.workers)
+        results.append({"stripes": stripes, "workers": config.workers, **stats})
+    return results
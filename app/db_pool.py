@@ -0,0 +1,114 @@
+"""
+Пул соединений с Postgres (DB_POOL_MODE в settings).
+- "pool": psycopg_pool внутри каждого процесса (DATABASES OPTIONS "pool");
+- "pgbouncer": постоянные соединения к pgbouncer в transaction mode,
+  без серверных курсоров и подготовленных запросов;
+- "none": соединение на запрос, как раньше.
+Здесь — обслуживание пула в процессе: сброс после fork и метрики.
+Статистику публикует каждый процесс с пулом: веб и ASGI после запросов (report_after_requests
+в wsgi.py и asgi.py), воркеры Celery после задач, ретранслятор outbox после каждой порции.
+"""
+import os
+import time
+import logging
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connections
+from django.db.backends.postgresql.base import DatabaseWrapper
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+_last_logged = 0.0
+_last_published = 0.0
+# Накопительные счетчики пула на момент последней публикации: в метрики уходит прирост
+_published_totals: dict[str, int] = {}
+_EVENTS = ("checkouts", "waits", "timeouts", "connections_lost")
+
+
+def reset_after_fork():
+    """
+    Забываем соединения и пулы, унаследованные от родительского процесса.
+    Не закрываем их: сокеты общие с родителем, а потоки пула после fork не существуют.
+    Новый пул создается лениво при первом запросе.
+    """
+    for conn in connections.all(initialized_only=True):
+        conn.connection = None
+    DatabaseWrapper._connection_pools.clear()
+    _published_totals.clear()
+
+
+def stats(alias: str = "default") -> dict | None:
+    """
+    Накопленная статистика пула текущего процесса (None, если пул не используется или еще не создан):
+    checkouts — выдано соединений, waits — запросов, ждавших свободное соединение,
+    timeouts — запросов, не дождавшихся соединения за timeout.
+    """
+    pool = DatabaseWrapper._connection_pools.get(alias)
+    if pool is None:
+        return None
+    raw = pool.get_stats()
+    return {
+        "pid": os.getpid(),
+        "size": raw.get("pool_size", 0),
+        "available": raw.get("pool_available", 0),
+        "min_size": raw.get("pool_min", 0),
+        "max_size": raw.get("pool_max", 0),
+        "checkouts": raw.get("requests_num", 0),
+        "waits": raw.get("requests_queued", 0),
+        "wait_ms": raw.get("requests_wait_ms", 0),
+        "timeouts": raw.get("requests_errors", 0),
+        "waiting_now": raw.get("requests_waiting", 0),
+        "connections_opened": raw.get("connections_num", 0),
+        "connections_lost": raw.get("connections_lost", 0),
+        "bad_returns": raw.get("returns_bad", 0),
+    }
+
+
+def _publish(pool_stats: dict):
+    for state in ("size", "available", "max_size"):
+        metrics.DB_POOL_CONNECTIONS.labels(state=state).set(pool_stats[state])
+    metrics.DB_POOL_WAITING.set(pool_stats["waiting_now"])
+    for event in _EVENTS + ("wait_ms",):
+        # Пул пересоздан (после fork или закрытия) — счетчики начались заново
+        delta = pool_stats[event] - _published_totals.get(event, 0)
+        if delta < 0:
+            delta = pool_stats[event]
+        _published_totals[event] = pool_stats[event]
+        if not delta:
+            continue
+        if event == "wait_ms":
+            metrics.DB_POOL_WAIT.inc(delta / 1000)
+        else:
+            metrics.DB_POOL_EVENTS.labels(event=event).inc(delta)
+
+
+def report(alias: str = "default"):
+    """
+    Статистика пула текущего процесса: в метрики Prometheus не чаще раза в DB_POOL_METRICS_INTERVAL
+    секунд, в лог — не чаще раза в DB_POOL_STATS_LOG_INTERVAL
+    """
+    global _last_logged, _last_published
+    now = time.monotonic()
+    publish = now - _last_published >= settings.DB_POOL_METRICS_INTERVAL
+    log = now - _last_logged >= settings.DB_POOL_STATS_LOG_INTERVAL
+    if not publish and not log:
+        return
+    pool_stats = stats(alias)
+    if pool_stats is None:
+        return
+    if publish:
+        _last_published = now
+        _publish(pool_stats)
+    if log:
+        _last_logged = now
+        logger.info("Пул соединений БД: %s", pool_stats, extra={"db_pool": pool_stats})
+
+
+def _report_on_request_finished(**kwargs):
+    report()
+
+
+def report_after_requests():
+    """Публикуем статистику пула после запросов веба (WSGI и ASGI)"""
+    request_finished.connect(_report_on_request_finished, dispatch_uid="db_pool_report")
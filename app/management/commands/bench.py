@@ -0,0 +1,92 @@
+import json
+import platform
+import subprocess
+import django
+from django.conf import settings
+from django.db import connection
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from app.benchmarks import load_scenarios
+from app.benchmarks.fixtures import cleanup
+from app.benchmarks.runner import BenchConfig, DISTRIBUTION_HOTKEY, DISTRIBUTION_UNIFORM
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Запуск бенчмарков горячих путей (нужна локальная БД PostgreSQL)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", nargs="+", choices=sorted(load_scenarios()))
+        parser.add_argument("--iterations", type=int, default=2000)
+        parser.add_argument("--workers", type=int, default=8, help="Количество конкурентных потоков")
+        parser.add_argument("--users", type=int, default=1, help="Количество пользователей")
+        parser.add_argument(
+            "--distribution", choices=[DISTRIBUTION_UNIFORM, DISTRIBUTION_HOTKEY], default=DISTRIBUTION_UNIFORM,
+            help="Распределение операций по пользователям",
+        )
+        parser.add_argument("--hot-share", type=float, default=0.9, help="Доля операций горячего пользователя")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--param", action="append", default=[],
+            help="Параметр сценария в виде key=value (можно указывать несколько раз)",
+        )
+        parser.add_argument("--output", help="Путь к JSON-файлу с результатами")
+        parser.add_argument("--keep-data", action="store_true", help="Не удалять созданные данные")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Бенчмарки запускаются только на PostgreSQL")
+
+        params = {}
+        for item in options["param"]:
+            key, sep, value = item.partition("=")
+            if not sep:
+                raise CommandError(f"Параметр должен быть в виде key=value: {item}")
+            params[key] = value
+
+        config = BenchConfig(
+            iterations=options["iterations"],
+            workers=options["workers"],
+            users=options["users"],
+            distribution=options["distribution"],
+            hot_share=options["hot_share"],
+            seed=options["seed"],
+            params=params,
+        )
+
+        scenarios = load_scenarios()
+        report = {
+            "started_at": timezone.now().isoformat(),
+            "environment": {
+                "git_revision": _git_revision(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "database_host": settings.DATABASES["default"].get("HOST"),
+                "balance_strategy": settings.BILLING_BALANCE_STRATEGY,
+            },
+            "config": config.describe(),
+            "params": params,
+            "scenarios": {},
+        }
+        try:
+            for name in options["scenarios"]:
+                self.stderr.write(f"Сценарий {name}...")
+                report["scenarios"][name] = scenarios[name](config)
+        finally:
+            if not options["keep_data"]:
+                cleanup()
+
+        payload = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(payload)
+        self.stdout.write(payload)
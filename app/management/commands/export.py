@@ -0,0 +1,66 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+from app.api.pagination import KeysetPagination
+from app.api.payments.serializers import (
+    ExportFilterSerializer, InvoiceExportFilterSerializer, PaymentExportFilterSerializer,
+)
+from app.api.payments.services import export
+
+TARGETS = {
+    "invoices": (InvoiceExportFilterSerializer, export.invoices_queryset),
+    "payments": (PaymentExportFilterSerializer, export.payments_queryset),
+}
+
+
+class _CursorSource:
+    """Курсор из аргумента командной строки в интерфейсе запроса для KeysetPagination.decode_cursor"""
+
+    def __init__(self, cursor: str | None):
+        self.GET = {"cursor": cursor} if cursor else {}
+
+
+class Command(BaseCommand):
+    help = "Потоковая выгрузка счетов или платежей в NDJSON/CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("target", choices=sorted(TARGETS))
+        parser.add_argument(
+            "--format", dest="export_format", choices=[ExportFilterSerializer.FORMAT_NDJSON, ExportFilterSerializer.FORMAT_CSV],
+            default=ExportFilterSerializer.FORMAT_NDJSON,
+        )
+        parser.add_argument("--status")
+        parser.add_argument("--user", help="id пользователя")
+        parser.add_argument("--invoice", help="id счета (только для платежей)")
+        parser.add_argument("--created-from", help="Начало периода (ISO 8601, включительно)")
+        parser.add_argument("--created-to", help="Конец периода (ISO 8601, не включительно)")
+        parser.add_argument("--cursor", help="Продолжить после строки с этим курсором")
+        parser.add_argument("--chunk-size", type=int, help="Строк на одну выборку курсора")
+        parser.add_argument("--output", help="Путь к файлу (по умолчанию stdout)")
+
+    def handle(self, *args, **options):
+        filter_serializer_class, build_queryset = TARGETS[options["target"]]
+        data = {
+            key: options[key]
+            for key in ("export_format", "status", "user", "invoice", "created_from", "created_to")
+            if options.get(key) is not None
+        }
+        filters = filter_serializer_class(data=data)
+        if not filters.is_valid():
+            raise CommandError(filters.errors)
+        params = filters.validated_data
+
+        try:
+            cursor = KeysetPagination().decode_cursor(_CursorSource(options["cursor"]))
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+
+        queryset, fields = build_queryset(params)
+        chunks = export.stream(queryset, fields, params["export_format"], cursor=cursor, chunk_size=options["chunk_size"])
+        output = open(options["output"], "w", encoding="utf-8", newline="") if options["output"] else sys.stdout
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,43 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from app import db_pool, metrics
+from app.api.payments.services import outbox
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Ретранслятор transactional outbox: публикует сообщения в брокер порциями"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Опубликовать накопленное и выйти")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--poll-interval", type=float, default=None,
+            help="Пауза, когда outbox пуст (по умолчанию OUTBOX_RELAY_POLL_INTERVAL)",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"] or settings.OUTBOX_RELAY_BATCH_SIZE
+        if options["once"]:
+            self.stdout.write(f"Опубликовано сообщений: {outbox.drain(batch_size)}")
+            return
+
+        poll_interval = options["poll_interval"] or settings.OUTBOX_RELAY_POLL_INTERVAL
+        metrics.start_metrics_server()
+        self.stderr.write("Ретранслятор outbox запущен")
+        while True:
+            close_old_connections()
+            try:
+                published = outbox.relay(batch_size)
+                db_pool.report()
+            except Exception:
+                # Брокер или БД недоступны: сообщения остались в outbox, повторим после паузы
+                logger.exception("Ошибка публикации outbox")
+                time.sleep(max(poll_interval, 1.0))
+                continue
+            if published < batch_size:
+                time.sleep(poll_interval)
@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from app.api.payments.services import redis_balance
+
+
+class Command(BaseCommand):
+    help = "Балансы в Redis (режим redis): отложенная запись в Postgres и пересборка состояния"
+
+    def add_arguments(self, parser):
+        subcommands = parser.add_subparsers(dest="action", required=True)
+
+        persist = subcommands.add_parser("persist", help="Записать изменения из потока в UserBalance")
+        persist.add_argument("--follow", action="store_true", help="Работать постоянно, ожидая новые изменения")
+        persist.add_argument("--block-ms", type=int, default=1000, help="Ожидание новых записей потока")
+
+        rebuild = subcommands.add_parser("rebuild", help="Пересобрать состояние Redis из Postgres")
+        rebuild.add_argument("--user", action="append", dest="users", help="id пользователя (можно несколько)")
+        rebuild.add_argument("--warm", action="store_true", help="Сразу загрузить всех пользователей")
+
+    def handle(self, *args, **options):
+        if options["action"] == "rebuild":
+            loaded = redis_balance.rebuild(options["users"], warm=options["warm"])
+            self.stdout.write(f"Состояние пересобрано, загружено пользователей: {loaded}")
+            return
+
+        if not options["follow"]:
+            self.stdout.write(f"Записано изменений: {redis_balance.drain()}")
+            return
+
+        consumer = redis_balance.consumer_name()
+        self.stderr.write(f"Отложенная запись балансов, потребитель {consumer}")
+        while True:
+            started = time.perf_counter()
+            processed = redis_balance.persist(consumer, block_ms=options["block_ms"])
+            if processed:
+                self.stderr.write(f"Записано изменений: {processed} за {time.perf_counter() - started:.3f} с")
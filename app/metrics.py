@@ -0,0 +1,175 @@
+"""
+Метрики Prometheus: ожидание блокировок биллинга, вызовы провайдера, задачи Celery
+и время от создания счета до конечного статуса.
+
+Если задана переменная окружения PROMETHEUS_MULTIPROC_DIR, значения пишутся в файлы
+этой директории и собираются со всех процессов одного контейнера (воркеры uvicorn, пул Celery).
+Директория своя у каждого контейнера: номера процессов в разных контейнерах совпадают.
+Она должна быть пустой при старте (в docker-compose — tmpfs).
+Веб отдает /metrics, остальные процессы (воркер Celery, ретранслятор outbox) — отдельный
+HTTP-сервер на порту METRICS_PORT (start_metrics_server).
+"""
+import os
+import time
+from contextlib import contextmanager
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client import multiprocess, start_http_server
+
+# Границы от миллисекунд (свободная строка) до десятков секунд (очередь на горячем балансе)
+LOCK_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+BILLING_LOCK_WAIT = Histogram(
+    "billing_lock_wait_seconds",
+    "Время получения блокировки баланса или счета",
+    ["target"],
+    buckets=LOCK_BUCKETS,
+)
+BILLING_OPTIMISTIC_CONFLICTS = Counter(
+    "billing_optimistic_conflicts_total",
+    "Конфликты версий при оптимистичном изменении баланса",
+    ["operation"],
+)
+PROVIDER_CALL = Histogram(
+    "provider_call_seconds",
+    "Длительность вызова платежного провайдера",
+    ["operation", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+PROVIDER_BREAKER_TRANSITIONS = Counter(
+    "provider_breaker_transitions_total",
+    "Переходы состояния circuit breaker провайдера",
+    ["transition"],
+)
+INVOICE_END_TO_END = Histogram(
+    "invoice_end_to_end_seconds",
+    "Время от создания счета до конечного статуса",
+    ["status"],
+    buckets=LATENCY_BUCKETS,
+)
+INVOICE_TERMINAL = Counter(
+    "invoice_terminal_total",
+    "Счета, перешедшие в конечный статус",
+    ["status"],
+)
+TASK_DURATION = Histogram(
+    "celery_task_duration_seconds",
+    "Длительность выполнения задачи Celery",
+    ["task", "state"],
+    buckets=LATENCY_BUCKETS,
+)
+PROFILE_QUERIES = Histogram(
+    "sql_queries_per_unit",
+    "Число SQL-запросов на запрос API или задачу",
+    ["kind", "name"],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+PROFILE_DB_TIME = Histogram(
+    "sql_time_per_unit_seconds",
+    "Время в БД на запрос API или задачу",
+    ["kind", "name"],
+    buckets=LOCK_BUCKETS,
+)
+PROFILE_DUPLICATE_QUERIES = Counter(
+    "sql_duplicate_queries_total",
+    "Повторы одинаковых SQL-запросов внутри запроса API или задачи (признак N+1)",
+    ["kind", "name"],
+)
+OUTBOX_LAG = Histogram(
+    "outbox_publish_lag_seconds",
+    "Время от записи сообщения outbox до публикации в брокер",
+    ["topic"],
+    buckets=LOCK_BUCKETS,
+)
+TASK_RETRIES = Counter(
+    "celery_task_retries_total",
+    "Повторы задач Celery",
+    ["task"],
+)
+# Пул соединений с БД (app/db_pool.py): размеры суммируются по живым процессам контейнера
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Соединения пула БД: открытые (size), свободные (available) и предел (max_size)",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_WAITING = Gauge(
+    "db_pool_waiting_requests",
+    "Запросы, ждущие свободное соединение пула БД",
+    multiprocess_mode="livesum",
+)
+DB_POOL_EVENTS = Counter(
+    "db_pool_events_total",
+    "События пула БД: выдачи соединений, ожидания, таймауты ожидания, потерянные соединения",
+    ["event"],
+)
+DB_POOL_WAIT = Counter(
+    "db_pool_wait_seconds_total",
+    "Суммарное время ожидания свободного соединения пула БД",
+)
+
+
+@contextmanager
+def lock_wait(target: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        BILLING_LOCK_WAIT.labels(target=target).observe(time.perf_counter() - started)
+
+
+def observe_terminal_on_commit(invoices, status: str):
+    """Фиксируем время до конечного статуса сейчас, учитываем после коммита транзакции"""
+    now = timezone.now()
+    durations = [(now - invoice.created_at).total_seconds() for invoice in invoices]
+    if not durations:
+        return
+
+    def observe():
+        histogram = INVOICE_END_TO_END.labels(status=status)
+        for duration in durations:
+            histogram.observe(duration)
+        INVOICE_TERMINAL.labels(status=status).inc(len(durations))
+
+    transaction.on_commit(observe)
+
+
+_task_started: dict[str, float] = {}
+
+
+def task_started(task_id: str):
+    _task_started[task_id] = time.perf_counter()
+
+
+def task_finished(task_id: str, task_name: str, state: str | None):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.labels(task=task_name, state=state or "UNKNOWN").observe(time.perf_counter() - started)
+
+
+def mark_process_dead(pid: int):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
+
+
+def _registry():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def start_metrics_server():
+    """HTTP-сервер метрик для процессов без веба; порт — METRICS_PORT, без него не запускается"""
+    port = os.environ.get("METRICS_PORT")
+    if port:
+        start_http_server(int(port), registry=_registry())
+
+
+def metrics_view(request):
+    """Метрики в формате Prometheus"""
+    return HttpResponse(generate_latest(_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-18 10:12
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbalance',
+            name='stripes',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.CreateModel(
+            name='UserBalanceShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('reserved', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('index', models.PositiveSmallIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_shards', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Шард баланса',
+                'verbose_name_plural': 'Шарды балансов',
+                'constraints': [models.UniqueConstraint(fields=('user', 'index'), name='uniq_balance_shard_user_index')],
+            },
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='balance_shard',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoices', to='app.userbalanceshard'),
+        ),
+    ]
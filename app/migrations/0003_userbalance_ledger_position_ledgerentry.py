@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 11:40
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_userbalance_stripes_userbalanceshard_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbalance',
+            name='ledger_position',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('transaction_id', models.UUIDField(default=uuid.uuid4, editable=False)),
+                ('account', models.CharField(choices=[('available', 'Available'), ('reserved', 'Reserved'), ('external', 'External')], max_length=16)),
+                ('kind', models.CharField(choices=[('reserve', 'Reserve'), ('release', 'Release'), ('debit', 'Debit'), ('credit', 'Credit')], max_length=16)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=18)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='app.invoice')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Проводка',
+                'verbose_name_plural': 'Журнал проводок',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['user', 'id'], name='ledger_user_id_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_userbalance_ledger_position_ledgerentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['-created_at', '-id'], name='user_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='invoice_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['-created_at', '-id'], name='payment_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='payment_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['invoice', '-created_at', '-id'], name='payment_invoice_created_idx'),
+        ),
+    ]
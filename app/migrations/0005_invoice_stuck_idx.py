@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'reserved'])), fields=['status', 'updated_at'], name='invoice_stuck_idx'),
+        ),
+    ]
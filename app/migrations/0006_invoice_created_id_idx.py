@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_invoice_stuck_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['-created_at', '-id'], name='invoice_created_id_idx'),
+        ),
+    ]
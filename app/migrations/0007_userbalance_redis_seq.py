@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_invoice_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbalance',
+            name='redis_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_payment_authorization'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('topic', models.CharField(max_length=64)),
+                ('payload', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Сообщение outbox',
+                'verbose_name_plural': 'Outbox',
+                'ordering': ['id'],
+            },
+        ),
+    ]
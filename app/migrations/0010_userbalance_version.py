@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbalance',
+            name='version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
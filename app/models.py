@@ -39,17 +39,18 @@ class User(AbstractUser):
     class Meta:
         verbose_name = "Пользователь"
         verbose_name_plural = "Пользователи"
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="user_created_id_idx"),
+        ]
 
 
-class UserBalance(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="balance")
+class AbstractBalance(models.Model):
     balance = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal("0.00"))
     reserved = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal("0.00"))
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        verbose_name = "Баланс пользователя"
-        verbose_name_plural = "Баланс пользователей"
+        abstract = True
 
     def available(self) -> Decimal:
         return self.balance - self.reserved
@@ -89,6 +90,46 @@ class UserBalance(models.Model):
         return True
 
 
+class UserBalance(AbstractBalance):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="balance")
+    # Количество шардов баланса (1 — без разбиения)
+    stripes = models.PositiveSmallIntegerField(default=1)
+    # Последняя запись журнала, учтенная в снимке (режим ledger)
+    ledger_position = models.BigIntegerField(default=0)
+    # Номер последнего изменения из Redis, записанного в строку (режим redis)
+    redis_seq = models.BigIntegerField(default=0)
+    # Версия строки: увеличивается каждым изменением в режиме optimistic
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Баланс пользователя"
+        verbose_name_plural = "Баланс пользователей"
+
+    @property
+    def is_striped(self) -> bool:
+        return self.stripes > 1
+
+
+class UserBalanceShard(AbstractBalance):
+    """
+    Шард баланса пользователя.
+    Средства горячего пользователя распределены по нескольким строкам,
+    чтобы параллельные резервирования не ждали одну блокировку.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="balance_shards")
+    index = models.PositiveSmallIntegerField()
+
+    class Meta:
+        verbose_name = "Шард баланса"
+        verbose_name_plural = "Шарды балансов"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "index"], name="uniq_balance_shard_user_index"),
+        ]
+
+    def __str__(self):
+        return f"BalanceShard user={self.user_id} index={self.index} balance={self.balance} reserved={self.reserved}"
+
+
 class Invoice(models.Model):
     STATUS_PENDING = "pending"
     STATUS_RESERVED = "reserved"
@@ -113,11 +154,30 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     description = models.TextField(blank=True, default="")
+    # Шард, в котором зарезервированы средства (только для разбитых балансов)
+    balance_shard = models.ForeignKey(
+        UserBalanceShard,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="invoices",
+    )
 
     class Meta:
         ordering = ["-created_at"]
         verbose_name = "Счет"
         verbose_name_plural = "Счета"
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-id"], name="invoice_user_created_idx"),
+            # Выгрузка всей истории по ключу (created_at, id)
+            models.Index(fields=["-created_at", "-id"], name="invoice_created_id_idx"),
+            # Поиск зависших счетов: индекс только по незавершенным, он остается маленьким
+            models.Index(
+                fields=["status", "updated_at"],
+                name="invoice_stuck_idx",
+                condition=models.Q(status__in=["pending", "reserved"]),
+            ),
+        ]
 
     def __str__(self):
         return f"Invoice {self.id} user={self.user_id} amount={self.amount} status={self.status}"
@@ -125,12 +185,14 @@ class Invoice(models.Model):
 
 class Payment(models.Model):
     STATUS_PENDING = "pending"
+    STATUS_AUTHORIZED = "authorized"
     STATUS_SUCCESS = "success"
     STATUS_FAILED = "failed"
     STATUS_REFUNDED = "refunded"
 
     STATUS_CHOICES = [
         (STATUS_PENDING, "Pending"),
+        (STATUS_AUTHORIZED, "Authorized"),
         (STATUS_SUCCESS, "Success"),
         (STATUS_FAILED, "Failed"),
         (STATUS_REFUNDED, "Refunded"),
@@ -143,6 +205,9 @@ class Payment(models.Model):
     status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
     attempts = models.PositiveIntegerField(default=0)
     last_error = models.TextField(blank=True, default="")
+    # Двухэтапная оплата: средства удержаны провайдером до authorization_expires_at
+    authorized_at = models.DateTimeField(null=True, blank=True)
+    authorization_expires_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -150,7 +215,95 @@ class Payment(models.Model):
         ordering = ["-created_at"]
         verbose_name = "Платеж"
         verbose_name_plural = "Платежи"
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="payment_created_id_idx"),
+            models.Index(fields=["status", "-created_at", "-id"], name="payment_status_created_idx"),
+            models.Index(fields=["invoice", "-created_at", "-id"], name="payment_invoice_created_idx"),
+            # Пакетное списание и освобождение истекших удержаний: только авторизованные платежи
+            models.Index(
+                fields=["authorization_expires_at"],
+                name="payment_authorized_idx",
+                condition=models.Q(status="authorized"),
+            ),
+        ]
 
     def __str__(self):
         return f"Payment {self.id} invoice={self.invoice_id} amount={self.amount} status={self.status}"
 
+
+class LedgerEntry(models.Model):
+    """
+    Неизменяемая проводка журнала баланса (двойная запись).
+    Каждая операция — пара строк с общим transaction_id, сумма которых равна нулю:
+    деньги уходят с одного счета пользователя и приходят на другой.
+    """
+    ACCOUNT_AVAILABLE = "available"
+    ACCOUNT_RESERVED = "reserved"
+    ACCOUNT_EXTERNAL = "external"
+
+    ACCOUNT_CHOICES = [
+        (ACCOUNT_AVAILABLE, "Available"),
+        (ACCOUNT_RESERVED, "Reserved"),
+        (ACCOUNT_EXTERNAL, "External"),
+    ]
+
+    KIND_RESERVE = "reserve"
+    KIND_RELEASE = "release"
+    KIND_DEBIT = "debit"
+    KIND_CREDIT = "credit"
+
+    KIND_CHOICES = [
+        (KIND_RESERVE, "Reserve"),
+        (KIND_RELEASE, "Release"),
+        (KIND_DEBIT, "Debit"),
+        (KIND_CREDIT, "Credit"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    transaction_id = models.UUIDField(default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="ledger_entries")
+    account = models.CharField(max_length=16, choices=ACCOUNT_CHOICES)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    amount = models.DecimalField(max_digits=18, decimal_places=2)
+    invoice = models.ForeignKey(
+        Invoice, on_delete=models.SET_NULL, null=True, blank=True, related_name="ledger_entries",
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["id"]
+        verbose_name = "Проводка"
+        verbose_name_plural = "Журнал проводок"
+        indexes = [
+            models.Index(fields=["user", "id"], name="ledger_user_id_idx"),
+        ]
+
+    def __str__(self):
+        return f"LedgerEntry {self.id} user={self.user_id} {self.kind} {self.account} {self.amount}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Проводки журнала неизменяемы")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Проводки журнала неизменяемы")
+
+
+class OutboxMessage(models.Model):
+    """
+    Сообщение transactional outbox: пишется в той же транзакции, что и данные,
+    и публикуется в брокер ретранслятором (app/api/payments/services/outbox.py).
+    """
+    id = models.BigAutoField(primary_key=True)
+    topic = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["id"]
+        verbose_name = "Сообщение outbox"
+        verbose_name_plural = "Outbox"
+
+    def __str__(self):
+        return f"OutboxMessage {self.id} {self.topic}"
@@ -0,0 +1,222 @@
+"""
+Профилирование SQL по запросам API и задачам Celery.
+
+Для каждого запроса/задачи считаются число SQL-запросов, время в БД, повторы одинаковых
+запросов (признак N+1) и общее время. Дешевые счетчики всегда уходят в метрики Prometheus,
+полный образец (самые частые запросы с местом вызова в коде) пишется в JSON-лог только для
+самых медленных SQL_PROFILING_SAMPLE_PERCENT процентов и для всех дольше SQL_PROFILING_SLOW_MS.
+
+Под WSGI и в задачах профиль подключается к соединениям текущего потока.
+Под ASGI запросы к БД идут из потоков sync_to_async, соединения которых делят конкурентные
+запросы, поэтому профиль запроса лежит в contextvar (asgiref переносит контекст в поток),
+а на каждое соединение один раз ставится общий execute_wrapper, который пишет запрос
+в профиль текущего контекста.
+"""
+import sys
+import time
+import logging
+import threading
+from bisect import bisect_left, insort
+from collections import deque
+from contextvars import ContextVar
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+_PROJECT_ROOT = str(Path(__file__).resolve().parent)
+_THIS_FILE = __file__
+
+
+def _call_site() -> str:
+    """Ближайший к запросу кадр кода проекта: "app/...py:123 function" """
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_PROJECT_ROOT) and filename != _THIS_FILE:
+            return f"{Path(filename).relative_to(Path(_PROJECT_ROOT).parent)}:{frame.f_lineno} {frame.f_code.co_name}"
+        frame = frame.f_back
+    return ""
+
+
+class QueryProfile:
+    """Счетчики SQL одного запроса или задачи; подключается к соединениям как execute_wrapper"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.name = ""
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.by_sql: dict[str, list] = {}  # sql -> [count, seconds, место вызова]
+        self.started = 0.0
+        self.wall_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_seconds += elapsed
+            entry = self.by_sql.get(sql)
+            if entry is None:
+                # Место вызова ищем один раз на каждый уникальный запрос
+                self.by_sql[sql] = [1, elapsed, _call_site()]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def start(self):
+        self.started = time.perf_counter()
+        for conn in connections.all():
+            conn.execute_wrappers.append(self)
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self.started
+        for conn in connections.all():
+            if self in conn.execute_wrappers:
+                conn.execute_wrappers.remove(self)
+
+    @property
+    def duplicates(self) -> int:
+        return sum(count - 1 for count, _, _ in self.by_sql.values() if count > 1)
+
+    def sample(self) -> dict:
+        top = sorted(self.by_sql.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "wall_ms": round(self.wall_seconds * 1000, 2),
+            "db_ms": round(self.db_seconds * 1000, 2),
+            "queries": self.queries,
+            "unique_queries": len(self.by_sql),
+            "duplicate_queries": self.duplicates,
+            "top_queries": [
+                {"sql": sql[:1000], "count": count, "ms": round(seconds * 1000, 2), "call_site": call_site}
+                for sql, (count, seconds, call_site) in top[:settings.SQL_PROFILING_SAMPLE_QUERIES]
+            ],
+        }
+
+
+class _SlowThreshold:
+    """Порог медленных по скользящему окну времени выполнения (на процесс)"""
+
+    def __init__(self, window: int):
+        self.recent = deque(maxlen=window)
+        self.ordered: list[float] = []
+        self.lock = threading.Lock()
+
+    def is_slow(self, seconds: float, percent: float) -> bool:
+        with self.lock:
+            if len(self.recent) == self.recent.maxlen:
+                oldest = self.recent.popleft()
+                del self.ordered[bisect_left(self.ordered, oldest)]
+            self.recent.append(seconds)
+            insort(self.ordered, seconds)
+            # Пока окно не набралось, долю медленных не оцениваем
+            if len(self.ordered) < min(100, self.recent.maxlen):
+                return False
+            rank = int(len(self.ordered) * (1 - percent / 100))
+            return seconds >= self.ordered[min(rank, len(self.ordered) - 1)]
+
+
+_thresholds: dict[str, _SlowThreshold] = {}
+
+
+def report(profile: QueryProfile, **extra):
+    """Счетчики — в метрики, образец медленного — в лог"""
+    metrics.PROFILE_QUERIES.labels(kind=profile.kind, name=profile.name).observe(profile.queries)
+    metrics.PROFILE_DB_TIME.labels(kind=profile.kind, name=profile.name).observe(profile.db_seconds)
+    if profile.duplicates:
+        metrics.PROFILE_DUPLICATE_QUERIES.labels(kind=profile.kind, name=profile.name).inc(profile.duplicates)
+
+    threshold = _thresholds.setdefault(profile.kind, _SlowThreshold(settings.SQL_PROFILING_WINDOW))
+    slow = threshold.is_slow(profile.wall_seconds, settings.SQL_PROFILING_SAMPLE_PERCENT)
+    if slow or profile.wall_seconds * 1000 >= settings.SQL_PROFILING_SLOW_MS:
+        logger.warning("Медленный %s %s", profile.kind, profile.name, extra={"profile": {**profile.sample(), **extra}})
+
+
+_context_profile: ContextVar[QueryProfile | None] = ContextVar("sql_profile", default=None)
+
+
+def _context_wrapper(execute, sql, params, many, context):
+    profile = _context_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    return profile(execute, sql, params, many, context)
+
+
+def _install_context_wrapper(sender, connection, **kwargs):
+    if _context_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_context_wrapper)
+
+
+def _report_request(profile: QueryProfile, request, response):
+    match = request.resolver_match
+    profile.name = match.view_name if match is not None else "unresolved"
+    report(profile, method=request.method, path=request.path, status=response.status_code)
+
+
+class SqlProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            connection_created.connect(_install_context_wrapper, dispatch_uid="sql_profiling_context_wrapper")
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.SQL_PROFILING_ENABLED:
+            return self.get_response(request)
+        profile = QueryProfile("request")
+        profile.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.finish()
+        _report_request(profile, request, response)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.SQL_PROFILING_ENABLED:
+            return await self.get_response(request)
+        profile = QueryProfile("request")
+        profile.started = time.perf_counter()
+        token = _context_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _context_profile.reset(token)
+            profile.wall_seconds = time.perf_counter() - profile.started
+        _report_request(profile, request, response)
+        return response
+
+
+_task_profiles: dict[str, QueryProfile] = {}
+
+
+def task_started(task_id: str, task_name: str):
+    if not settings.SQL_PROFILING_ENABLED:
+        return
+    profile = QueryProfile("task")
+    profile.name = task_name
+    _task_profiles[task_id] = profile
+    profile.start()
+
+
+def task_finished(task_id: str, state: str | None):
+    profile = _task_profiles.pop(task_id, None)
+    if profile is None:
+        return
+    profile.finish()
+    report(profile, task_id=task_id, state=state)
@@ -1,4 +1,5 @@
 import redis
+import redis.asyncio
 from django.conf import settings
 
 # Подключение к Redis
@@ -7,4 +8,16 @@ redis_client = redis.Redis(
     port=settings.REDIS_PORT,
     db=settings.REDIS_DB,
     decode_responses=settings.REDIS_DECODE_RESPONSES,
-)
\ No newline at end of file
+)
+
+def async_redis_client() -> "redis.asyncio.Redis":
+    """
+    Отдельный asyncio-клиент для долгих подписок (pub/sub) в async-представлениях.
+    Соединения asyncio привязаны к event loop, поэтому клиент создается на запрос и закрывается им.
+    """
+    return redis.asyncio.Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        decode_responses=settings.REDIS_DECODE_RESPONSES,
+    )
@@ -0,0 +1,37 @@
+"""
+Очереди Celery и маршрутизация задач.
+
+- charges.priority / charges — обработка счетов; крупные суммы (CELERY_PRIORITY_AMOUNT) и счета
+  приоритетных мерчантов (CELERY_PRIORITY_MERCHANTS) идут в приоритетную полосу. Воркер слушает
+  обе очереди и с queue_order_strategy = "priority" сначала выбирает приоритетную;
+- refunds — возвраты, в том числе массовые, не занимают воркеры списаний;
+- maintenance — периодические задачи (свертка, выравнивание шардов, восстановление, capture, outbox).
+
+Очереди и маршруты задаются в settings (CELERY_TASK_QUEUES, CELERY_TASK_ROUTES),
+здесь — выбор полосы для счетов при отправке.
+"""
+from decimal import Decimal
+from django.conf import settings
+from app.models import Invoice
+
+QUEUE_CHARGES = "charges"
+QUEUE_CHARGES_PRIORITY = "charges.priority"
+QUEUE_REFUNDS = "refunds"
+QUEUE_MAINTENANCE = "maintenance"
+
+
+def invoice_lanes(invoice_ids: list[str]) -> dict[str, list[str]]:
+    """Раскладываем счета по полосам очереди списаний одним запросом"""
+    threshold = settings.CELERY_PRIORITY_AMOUNT
+    merchants = {str(merchant) for merchant in settings.CELERY_PRIORITY_MERCHANTS}
+    if threshold is None and not merchants:
+        return {QUEUE_CHARGES: list(invoice_ids)}
+
+    threshold = Decimal(threshold) if threshold is not None else None
+    lanes = {}
+    for invoice_id, user_id, amount in Invoice.objects.filter(pk__in=invoice_ids).values_list(
+        "id", "user_id", "amount",
+    ):
+        priority = str(user_id) in merchants or (threshold is not None and amount >= threshold)
+        lanes.setdefault(QUEUE_CHARGES_PRIORITY if priority else QUEUE_CHARGES, []).append(str(invoice_id))
+    return lanes
@@ -0,0 +1,35 @@
+import uuid
+from unittest import mock
+from django.test import SimpleTestCase
+from app.api.payments.services import circuit_breaker
+from app.redis_client import redis_client
+
+
+class HalfOpenProbeTests(SimpleTestCase):
+    """Место пробы half_open, занятое упавшим воркером, освобождается через probe_ttl"""
+
+    def setUp(self):
+        self.breaker = circuit_breaker.CircuitBreaker(
+            f"test-{uuid.uuid4().hex}", failure_threshold=1, recovery_timeout=10, half_open_probes=1, probe_ttl=60,
+        )
+        self.addCleanup(redis_client.delete, self.breaker.key, self.breaker.probes_key, self.breaker.transitions_key)
+        self.now = 1_000_000.0
+        patcher = mock.patch.object(circuit_breaker, "time")
+        patcher.start().time.side_effect = lambda: self.now
+        self.addCleanup(patcher.stop)
+        self.breaker.record(success=False)
+        self.now += 10
+
+    def test_abandoned_probe_expires(self):
+        self.assertIsNotNone(self.breaker.before_call())  # воркер упал, результат не записан
+        with self.assertRaises(circuit_breaker.CircuitOpen):
+            self.breaker.before_call()
+        self.now += 61
+        probe = self.breaker.before_call()
+        self.assertIsNotNone(probe)
+        self.breaker.record(success=True, probe=probe)
+        self.assertEqual(self.breaker.state(), circuit_breaker.STATE_CLOSED)
+
+    def test_released_probe_frees_slot(self):
+        self.breaker.release_probe(self.breaker.before_call())
+        self.assertIsNotNone(self.breaker.before_call())
@@ -0,0 +1,36 @@
+from decimal import Decimal
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.test import TransactionTestCase
+from app.models import Invoice
+from app.api.payments.serializers import ExportFilterSerializer
+from app.api.payments.services import export
+from app.benchmarks.fixtures import create_user
+
+
+async def _collect(chunks) -> list[str]:
+    return [chunk async for chunk in chunks]
+
+
+class AsyncExportTests(TransactionTestCase):
+    """astream (ASGI) отдает то же, что stream, и теми же порциями"""
+
+    def setUp(self):
+        user = create_user(balance=Decimal("100.00"))
+        Invoice.objects.bulk_create(Invoice(user=user, amount=Decimal(index + 1)) for index in range(5))
+
+    def assert_same_as_sync(self):
+        for export_format in (ExportFilterSerializer.FORMAT_NDJSON, ExportFilterSerializer.FORMAT_CSV):
+            with self.subTest(export_format=export_format):
+                queryset, fields = export.invoices_queryset({})
+                expected = list(export.stream(queryset, fields, export_format, chunk_size=2))
+                chunks = async_to_sync(_collect)(export.astream(queryset, fields, export_format, chunk_size=2))
+                self.assertEqual(chunks, expected)
+                self.assertEqual(len(chunks), 3)
+
+    def test_server_side_cursor(self):
+        self.assert_same_as_sync()
+
+    def test_keyset_chunks_without_server_side_cursors(self):
+        with mock.patch.object(export, "_server_side_cursors", return_value=False):
+            self.assert_same_as_sync()
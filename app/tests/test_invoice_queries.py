@@ -0,0 +1,31 @@
+from unittest import mock
+from django.test import TransactionTestCase, override_settings
+from app.api.celery_tasks import process_invoice_task
+from app.api.payments.services import payment_processor
+from app.benchmarks.queries import QUERY_BUDGETS, prepare_outcome
+
+
+@override_settings(BILLING_BALANCE_STRATEGY="locking", PAYMENT_FLOW="charge")
+class InvoiceQueryBudgetTests(TransactionTestCase):
+    """
+    Число SQL-запросов на один прогон process_invoice_task для каждого исхода.
+    TransactionTestCase: транзакции задачи настоящие, BEGIN/COMMIT входят в счет.
+    """
+
+    def assert_budget(self, outcome: str):
+        invoice, charge = prepare_outcome(outcome)
+        with mock.patch.object(payment_processor, "charge", charge):
+            with self.assertNumQueries(QUERY_BUDGETS[outcome]):
+                process_invoice_task.apply(args=[str(invoice.pk)])
+
+    def test_success(self):
+        self.assert_budget("success")
+
+    def test_insufficient_funds(self):
+        self.assert_budget("insufficient_funds")
+
+    def test_provider_failure(self):
+        self.assert_budget("provider_failure")
+
+    def test_retry(self):
+        self.assert_budget("retry")
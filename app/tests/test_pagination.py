@@ -0,0 +1,31 @@
+import base64
+import json
+import uuid
+from django.test import RequestFactory, SimpleTestCase
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from app.api.pagination import KeysetPagination
+
+
+def _cursor(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+class DecodeCursorTests(SimpleTestCase):
+
+    def decode(self, value: str):
+        return KeysetPagination().decode_cursor(RequestFactory().get("/", {"cursor": value}))
+
+    def test_round_trip(self):
+        created_at, pk = timezone.now(), uuid.uuid4()
+        self.assertEqual(self.decode(KeysetPagination.encode_cursor_values(created_at, pk)), (created_at, pk))
+
+    def test_invalid_id_is_rejected(self):
+        created_at = timezone.now().isoformat()
+        for pk in ("not-a-uuid", 42, None):
+            with self.subTest(pk=pk), self.assertRaises(ValidationError):
+                self.decode(_cursor({"c": created_at, "i": pk}))
+
+    def test_garbage_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            self.decode("%%%")
@@ -0,0 +1,50 @@
+from decimal import Decimal
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+from app.models import Invoice, Payment
+from app.api.payments.services import billing, redis_balance
+from app.benchmarks.fixtures import create_user
+
+
+class _Rollback(Exception):
+    pass
+
+
+@override_settings(BILLING_BALANCE_STRATEGY=redis_balance.STRATEGY)
+class RedisBalanceRollbackTests(TransactionTestCase):
+    """Откат транзакции Postgres после изменения баланса в Redis"""
+
+    def setUp(self):
+        self.user = create_user(balance=Decimal("100.00"))
+        self.addCleanup(redis_balance.forget, [self.user.pk])
+        invoice = Invoice.objects.create(user=self.user, amount=Decimal("10.00"))
+        with transaction.atomic():
+            self.payment = billing.begin_payment(invoice)
+
+    def settle_rolled_back(self, settle):
+        with self.assertRaises(_Rollback), transaction.atomic():
+            settle(self.payment)
+            raise _Rollback
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.STATUS_PENDING)
+        self.payment.invoice.refresh_from_db()
+        self.assertEqual(self.payment.invoice.status, Invoice.STATUS_RESERVED)
+
+    def assert_balance(self, balance: str, reserved: str):
+        state = redis_balance.balance_of(self.user.pk)
+        self.assertEqual((state["balance"], state["reserved"]), (Decimal(balance), Decimal(reserved)))
+
+    def test_complete_is_retried_after_rollback(self):
+        self.settle_rolled_back(billing.complete_payment)
+        self.assertTrue(billing.complete_payment(self.payment))
+        self.assert_balance("90.00", "0.00")
+
+    def test_compensate_after_rolled_back_complete_returns_funds(self):
+        self.settle_rolled_back(billing.complete_payment)
+        self.assertTrue(billing.compensate_payment(self.payment, reason="declined"))
+        self.assert_balance("100.00", "0.00")
+
+    def test_complete_after_rolled_back_compensate_debits(self):
+        self.settle_rolled_back(billing.compensate_payment)
+        self.assertTrue(billing.complete_payment(self.payment))
+        self.assert_balance("90.00", "0.00")
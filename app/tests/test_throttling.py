@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+from app.benchmarks.fixtures import create_user
+
+
+@override_settings(OUTBOX_ENABLED=True)
+class InvoiceBulkCreateThrottleTests(TestCase):
+    """Пакетное создание счетов через ограничение частоты с настройками по умолчанию"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(create_user())
+        self.merchant = create_user()
+
+    def post(self, count: int):
+        items = [{"user_id": str(self.merchant.pk), "amount": "1.00", "currency": "USD"} for _ in range(count)]
+        return self.client.post(reverse("payments:invoice-bulk-create"), {"invoices": items}, format="json")
+
+    def test_bulk_above_single_create_burst_is_accepted(self):
+        response = self.post(settings.INVOICE_RATE_LIMITS["user"]["burst"] + 10)
+        self.assertEqual(response.status_code, 201, response.content[:200])
+
+    def test_bulk_of_max_size_is_accepted(self):
+        response = self.post(settings.INVOICE_BULK_MAX_ITEMS)
+        self.assertEqual(response.status_code, 201, response.content[:200])
+        self.assertEqual(response.json()["created"], settings.INVOICE_BULK_MAX_ITEMS)
+
+    def test_bulk_bucket_is_exhausted_by_repeated_batches(self):
+        self.assertEqual(self.post(settings.INVOICE_BULK_MAX_ITEMS).status_code, 201)
+        response = self.post(settings.INVOICE_BULK_MAX_ITEMS)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
@@ -6,3 +6,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app_project.settings')
 application = get_asgi_application()
+
+# Статистика пула соединений процесса — в лог и метрики после запросов
+from app import db_pool  # noqa: E402
+
+db_pool.report_after_requests()
@@ -1,6 +1,7 @@
 from pathlib import Path
 import logging.config
 import environ
+from kombu import Queue
 from app.config import pydantic_settings
 
 env = environ.Env()
@@ -19,7 +20,7 @@ ALLOWED_HOSTS = env.str("ALLOWED_HOSTS", "127.0.0.1,localhost").split(",")
 # Настройка базы данных
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'django.db.backends.postgresql',
         'NAME': env.str('POSTGRES_DB'),
         'USER': env.str('POSTGRES_USER'),
         'PASSWORD': env.str('POSTGRES_PASSWORD'),
@@ -31,6 +32,48 @@ DATABASES = {
 # DATABASES["default"]["ENGINE"] = "django.db.backends.postgresql_async"
 DATABASES["default"]["ENGINE"] = "django.db.backends.postgresql"
 
+# Пул соединений (см. app/db_pool.py): "pool", "pgbouncer" или "none"
+DB_POOL_MODE = env.str("DB_POOL_MODE", "pool")
+# Лимит соединений Postgres делится между всеми процессами с пулом во всех контейнерах docker-compose:
+# runserver, воркеры uvicorn, процессы трех воркеров Celery и ретранслятор outbox.
+# Переменные те же, что в командах сервисов, а .env общий — сумма одинакова в каждом контейнере
+DB_MAX_CONNECTIONS = env.int("DB_MAX_CONNECTIONS", 90)
+DB_POOL_PROCESSES = env.int("DB_POOL_PROCESSES", (
+    1  # runserver
+    + env.int("ASGI_WORKERS", 2)
+    + env.int("CELERY_CHARGES_CONCURRENCY", 8)
+    + env.int("CELERY_REFUNDS_CONCURRENCY", 2)
+    + env.int("CELERY_MAINTENANCE_CONCURRENCY", 2)
+    + 1  # outbox-relay
+))
+DB_POOL_MIN_SIZE = env.int("DB_POOL_MIN_SIZE", 1)
+DB_POOL_MAX_SIZE = env.int("DB_POOL_MAX_SIZE", max(2, DB_MAX_CONNECTIONS // DB_POOL_PROCESSES))
+DB_POOL_TIMEOUT = env.float("DB_POOL_TIMEOUT", 10.0)
+DB_POOL_STATS_LOG_INTERVAL = env.float("DB_POOL_STATS_LOG_INTERVAL", 60.0)
+DB_POOL_METRICS_INTERVAL = env.float("DB_POOL_METRICS_INTERVAL", 10.0)
+
+if DB_POOL_MODE == "pool":
+    from psycopg_pool import ConnectionPool
+
+    DATABASES["default"]["CONN_MAX_AGE"] = 0  # пул несовместим с постоянными соединениями Django
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            # CONN_HEALTH_CHECKS при CONN_MAX_AGE=0 не работает: соединение проверяет пул при выдаче
+            "check": ConnectionPool.check_connection,
+            "min_size": DB_POOL_MIN_SIZE,
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": DB_POOL_TIMEOUT,
+            "max_idle": env.float("DB_POOL_MAX_IDLE", 300.0),
+            "max_lifetime": env.float("DB_POOL_MAX_LIFETIME", 1800.0),
+        },
+    }
+elif DB_POOL_MODE == "pgbouncer":
+    # pgbouncer в transaction mode: соединение сервера не закреплено за клиентом между транзакциями
+    DATABASES["default"]["CONN_MAX_AGE"] = env.int("DB_CONN_MAX_AGE", 60)
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+    DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
+    DATABASES["default"]["OPTIONS"] = {"prepare_threshold": None}
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # Настройка Redis
@@ -43,9 +86,169 @@ REDIS_DECODE_RESPONSES = True
 # Настройка Celery
 CELERY_BROKER_URL = env.str("CELERY_BROKER_URL")  # f"redis://{_REDIS_HOST}:{_REDIS_PORT}/{REDIS_DB}"
 CELERY_RESULT_BACKEND = env.str("CELERY_BROKER_URL")  # f"redis://{_REDIS_HOST}:{_REDIS_PORT}/{REDIS_DB}"
+# Очереди и маршруты задач (app/task_routing.py). Воркер без -Q слушает все очереди
+CELERY_TASK_QUEUES = (
+    Queue("charges.priority"),
+    Queue("charges"),
+    Queue("refunds"),
+    Queue("maintenance"),
+)
+CELERY_TASK_DEFAULT_QUEUE = "maintenance"
+CELERY_TASK_ROUTES = {
+    "app.api.celery_tasks.process_invoice_task": {"queue": "charges"},
+    "app.api.celery_tasks.process_invoice_batch_task": {"queue": "charges"},
+    "app.api.celery_tasks.refund_invoice_task": {"queue": "refunds"},
+    "app.api.celery_tasks.bulk_refund_task": {"queue": "refunds"},
+    "app.api.celery_tasks.refund_user_payments_task": {"queue": "refunds"},
+}
+# Приоритетная полоса списаний: счета от этой суммы и счета перечисленных мерчантов (id пользователей)
+CELERY_PRIORITY_AMOUNT = env.str("CELERY_PRIORITY_AMOUNT", None)
+CELERY_PRIORITY_MERCHANTS = env.list("CELERY_PRIORITY_MERCHANTS", default=[])
+# Подтверждение после выполнения: задачу упавшего воркера получит другой (задачи идемпотентны).
+# По одному сообщению на процесс, чтобы медленный вызов провайдера не держал чужие задачи
+CELERY_TASK_ACKS_LATE = env.bool("CELERY_TASK_ACKS_LATE", True)
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = env.int("CELERY_WORKER_PREFETCH_MULTIPLIER", 1)
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    # Неподтвержденная задача возвращается в очередь через visibility_timeout: он должен быть
+    # больше самой долгой задачи и самой большой задержки (countdown/eta), иначе задача выполнится дважды
+    "visibility_timeout": env.int("CELERY_VISIBILITY_TIMEOUT", 60 * 60),
+    # Очереди воркера опрашиваются в порядке -Q: приоритетная полоса раньше обычной
+    "queue_order_strategy": "priority",
+}
 CELERY_BEAT_SCHEDULE = {
+    "rebalance-striped-balances": {
+        "task": "app.api.celery_tasks.rebalance_striped_balances_task",
+        "schedule": env.float("BALANCE_REBALANCE_INTERVAL", 60.0),
+    },
+    "rollup-ledger": {
+        "task": "app.api.celery_tasks.rollup_ledger_task",
+        "schedule": env.float("LEDGER_ROLLUP_INTERVAL", 30.0),
+    },
+    "persist-redis-balances": {
+        "task": "app.api.celery_tasks.persist_redis_balances_task",
+        "schedule": env.float("REDIS_BALANCE_PERSIST_INTERVAL", 1.0),
+    },
+    "relay-outbox": {
+        "task": "app.api.celery_tasks.relay_outbox_task",
+        "schedule": env.float("OUTBOX_RELAY_FALLBACK_INTERVAL", 5.0),
+    },
+    "capture-authorized-payments": {
+        "task": "app.api.celery_tasks.capture_authorized_payments_task",
+        "schedule": env.float("PAYMENT_CAPTURE_INTERVAL", 5.0),
+    },
+    "release-expired-authorizations": {
+        "task": "app.api.celery_tasks.release_expired_authorizations_task",
+        "schedule": env.float("PAYMENT_AUTHORIZATION_RELEASE_INTERVAL", 60.0),
+    },
+    "drain-parked-invoices": {
+        "task": "app.api.celery_tasks.drain_parked_invoices_task",
+        "schedule": env.float("PARKED_INVOICES_DRAIN_INTERVAL", 5.0),
+    },
+    "sweep-stuck-invoices": {
+        "task": "app.api.celery_tasks.sweep_stuck_invoices_task",
+        "schedule": env.float("STUCK_INVOICE_SWEEP_INTERVAL", 60.0),
+    },
 }
 
+# Стратегия работы с балансом: "locking" (блокировка строки), "ledger" (журнал проводок)
+# "redis" (Lua-скрипты в Redis с отложенной записью в Postgres) или "optimistic" (условные UPDATE без блокировки)
+BILLING_BALANCE_STRATEGY = env.str("BILLING_BALANCE_STRATEGY", "locking")
+# Повторов записи по версии до перехода на блокировку строки (режим optimistic)
+OPTIMISTIC_BALANCE_MAX_RETRIES = env.int("OPTIMISTIC_BALANCE_MAX_RETRIES", 5)
+# Отложенная запись балансов из Redis (app/api/payments/services/redis_balance.py):
+# изменений потока за одну транзакцию и простой, после которого записи упавшего потребителя забираются
+REDIS_BALANCE_PERSIST_BATCH = env.int("REDIS_BALANCE_PERSIST_BATCH", 500)
+REDIS_BALANCE_CLAIM_IDLE_MS = env.int("REDIS_BALANCE_CLAIM_IDLE_MS", 30000)
+# Сколько помнить завершенные в Redis счета, чтобы повтор после отката транзакции был идемпотентным
+REDIS_BALANCE_SETTLED_TTL = env.int("REDIS_BALANCE_SETTLED_TTL", 7 * 24 * 3600)
+
+# Симулятор платежного провайдера (JSON, см. app/api/payments/services/provider_simulator.py)
+PROVIDER_SIMULATOR = env.json("PROVIDER_SIMULATOR", default={})
+
+# Поток оплаты: "charge" (списание одним вызовом) или "authorize_capture"
+# (удержание, затем пакетное списание, app/api/payments/services/capture.py)
+PAYMENT_FLOW = env.str("PAYMENT_FLOW", "charge")
+# Срок удержания средств провайдером (секунды) и размер пакета списания
+PAYMENT_AUTHORIZATION_TTL = env.int("PAYMENT_AUTHORIZATION_TTL", 7 * 24 * 60 * 60)
+PAYMENT_CAPTURE_BATCH_SIZE = env.int("PAYMENT_CAPTURE_BATCH_SIZE", 500)
+PAYMENT_CAPTURE_MAX_BATCHES = env.int("PAYMENT_CAPTURE_MAX_BATCHES", 20)
+
+# Защита вызовов провайдера (app/api/payments/services/circuit_breaker.py)
+PROVIDER_BREAKER_FAILURE_THRESHOLD = env.int("PROVIDER_BREAKER_FAILURE_THRESHOLD", 5)
+PROVIDER_BREAKER_RECOVERY_TIMEOUT = env.float("PROVIDER_BREAKER_RECOVERY_TIMEOUT", 30.0)
+PROVIDER_BREAKER_HALF_OPEN_PROBES = env.int("PROVIDER_BREAKER_HALF_OPEN_PROBES", 3)
+PROVIDER_BULKHEAD_LIMIT = env.int("PROVIDER_BULKHEAD_LIMIT", 20)
+PROVIDER_BULKHEAD_TTL = env.float("PROVIDER_BULKHEAD_TTL", 60.0)
+# Проба half_open дольше этого считается брошенной (воркер упал) и освобождает место
+PROVIDER_BREAKER_PROBE_TTL = env.float("PROVIDER_BREAKER_PROBE_TTL", PROVIDER_BULKHEAD_TTL)
+PROVIDER_BULKHEAD_RETRY_AFTER = env.float("PROVIDER_BULKHEAD_RETRY_AFTER", 1.0)
+PROVIDER_RETRY_BACKOFF_BASE = env.float("PROVIDER_RETRY_BACKOFF_BASE", 2.0)
+PROVIDER_RETRY_BACKOFF_MAX = env.float("PROVIDER_RETRY_BACKOFF_MAX", 60.0)
+PARKED_INVOICES_DRAIN_BATCH = env.int("PARKED_INVOICES_DRAIN_BATCH", 500)
+
+# Восстановление зависших счетов (app/api/payments/services/sweeper.py)
+STUCK_INVOICE_AFTER = env.int("STUCK_INVOICE_AFTER", 600)
+STUCK_INVOICE_CHUNK_SIZE = env.int("STUCK_INVOICE_CHUNK_SIZE", 200)
+STUCK_INVOICE_MAX_CHUNKS = env.int("STUCK_INVOICE_MAX_CHUNKS", 50)
+# Попыток платежа, после которых зависший reserved-счет компенсируется (1 + max_retries задачи)
+STUCK_INVOICE_MAX_ATTEMPTS = env.int("STUCK_INVOICE_MAX_ATTEMPTS", 4)
+
+# Transactional outbox (app/api/payments/services/outbox.py): счета ставятся в обработку
+# сообщением в той же транзакции; ретранслятор публикует их порциями
+OUTBOX_ENABLED = env.bool("OUTBOX_ENABLED", True)
+OUTBOX_RELAY_BATCH_SIZE = env.int("OUTBOX_RELAY_BATCH_SIZE", 500)
+OUTBOX_RELAY_POLL_INTERVAL = env.float("OUTBOX_RELAY_POLL_INTERVAL", 0.05)
+
+# Пакетное создание счетов
+INVOICE_BULK_MAX_ITEMS = env.int("INVOICE_BULK_MAX_ITEMS", 10000)
+INVOICE_BULK_INSERT_BATCH_SIZE = env.int("INVOICE_BULK_INSERT_BATCH_SIZE", 1000)
+
+# Кэш идемпотентности создания счетов (секунды)
+IDEMPOTENCY_CLAIM_TTL = env.int("IDEMPOTENCY_CLAIM_TTL", 30)
+IDEMPOTENCY_RESULT_TTL = env.int("IDEMPOTENCY_RESULT_TTL", 24 * 60 * 60)
+IDEMPOTENCY_WAIT_TIMEOUT = env.float("IDEMPOTENCY_WAIT_TIMEOUT", 5.0)
+IDEMPOTENCY_POLL_INTERVAL = env.float("IDEMPOTENCY_POLL_INTERVAL", 0.05)
+
+# Пакетная обработка счетов: буфер в Redis, одна блокировка баланса на пользователя за пакет
+INVOICE_BATCH_ENABLED = env.bool("INVOICE_BATCH_ENABLED", False)
+INVOICE_BATCH_MAX_SIZE = env.int("INVOICE_BATCH_MAX_SIZE", 500)
+INVOICE_BATCH_MAX_LINGER = env.float("INVOICE_BATCH_MAX_LINGER", 0.5)
+
+# Ограничение частоты создания счетов (app/api/payments/services/rate_limit.py):
+# rate — счетов в секунду, burst — допустимый всплеск; лимит роли заменяет лимит пользователя.
+# bulk — отдельные корзины пакетного создания с той же структурой; burst не меньше
+# INVOICE_BULK_MAX_ITEMS, иначе пакет максимального размера не пройдет никогда
+INVOICE_RATE_LIMITS = env.json("INVOICE_RATE_LIMITS", default={
+    "user": {"rate": 20, "burst": 40},
+    "roles": {"administrator": {"rate": 200, "burst": 400}},
+    "merchant": {"rate": 50, "burst": 100},
+    "global": {"rate": 2000, "burst": 4000},
+    "bulk": {
+        "user": {"rate": 1000, "burst": INVOICE_BULK_MAX_ITEMS},
+        "roles": {"administrator": {"rate": 10000, "burst": 10 * INVOICE_BULK_MAX_ITEMS}},
+        "merchant": {"rate": 1000, "burst": INVOICE_BULK_MAX_ITEMS},
+        "global": {"rate": 20000, "burst": 10 * INVOICE_BULK_MAX_ITEMS},
+    },
+})
+
+# Кэш снимков счетов для опроса статуса (секунды жизни снимка)
+INVOICE_CACHE_TTL = env.int("INVOICE_CACHE_TTL", 300)
+
+# Массовые возвраты: платежей на пакет (одна блокировка баланса), лимит id в запросе, срок хранения прогресса
+REFUND_BATCH_SIZE = env.int("REFUND_BATCH_SIZE", 500)
+REFUND_BULK_MAX_IDS = env.int("REFUND_BULK_MAX_IDS", 100000)
+REFUND_JOB_TTL = env.int("REFUND_JOB_TTL", 7 * 24 * 3600)
+
+# Потоковая выгрузка: строк на одну выборку серверного курсора
+EXPORT_CHUNK_SIZE = env.int("EXPORT_CHUNK_SIZE", 2000)
+
+# Поток статусов счета (SSE) и long-poll, секунды
+INVOICE_STREAM_HEARTBEAT = env.float("INVOICE_STREAM_HEARTBEAT", 15.0)
+INVOICE_STREAM_MAX_DURATION = env.float("INVOICE_STREAM_MAX_DURATION", 300.0)
+INVOICE_LONG_POLL_TIMEOUT = env.float("INVOICE_LONG_POLL_TIMEOUT", 25.0)
+INVOICE_LONG_POLL_MAX_TIMEOUT = env.float("INVOICE_LONG_POLL_MAX_TIMEOUT", 60.0)
+
 # Установленные приложения
 INSTALLED_APPS = [
     'app',
@@ -69,8 +272,17 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.profiling.SqlProfilingMiddleware',
 ]
 
+# Профилирование SQL по запросам и задачам (app/profiling.py)
+SQL_PROFILING_ENABLED = env.bool("SQL_PROFILING_ENABLED", True)
+# Доля самых медленных (в процентах), для которых пишется полный образец, и абсолютный порог
+SQL_PROFILING_SAMPLE_PERCENT = env.float("SQL_PROFILING_SAMPLE_PERCENT", 1.0)
+SQL_PROFILING_SLOW_MS = env.float("SQL_PROFILING_SLOW_MS", 1000.0)
+SQL_PROFILING_WINDOW = env.int("SQL_PROFILING_WINDOW", 1000)
+SQL_PROFILING_SAMPLE_QUERIES = env.int("SQL_PROFILING_SAMPLE_QUERIES", 20)
+
 ROOT_URLCONF = 'app_project.urls'
 
 TEMPLATES = [
@@ -89,7 +301,7 @@ TEMPLATES = [
     },
 ]
 
-# ASGI_APPLICATION = 'app_project.asgi.application'
+ASGI_APPLICATION = 'app_project.asgi.application'
 WSGI_APPLICATION = 'app_project.wsgi.application'
 
 # Статические файлы
@@ -108,6 +320,10 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
 
+# Размер страницы списков по умолчанию (app/api/pagination.py). Не PAGE_SIZE в REST_FRAMEWORK:
+# без DEFAULT_PAGINATION_CLASS DRF предупреждает о нем (rest_framework.W001)
+API_PAGE_SIZE = env.int("API_PAGE_SIZE", 100)
+
 AUTH_USER_MODEL = "app.User"
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -3,3 +3,8 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app_project.settings')
 application = get_wsgi_application()
+
+# Статистика пула соединений процесса — в лог и метрики после запросов
+from app import db_pool  # noqa: E402
+
+db_pool.report_after_requests()
@@ -1,5 +1,8 @@
 import os
 from celery import Celery
+from celery.signals import (
+    task_postrun, task_prerun, task_retry, worker_init, worker_process_init, worker_process_shutdown,
+)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -8,5 +11,45 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app_project.settings")
 
 app = Celery("payment_simulator")
 app.config_from_object("django.conf:settings", namespace="CELERY")
-app.autodiscover_tasks(["app.api.v1"])
+app.autodiscover_tasks(["app.api"], related_name="celery_tasks")
 
+
+@worker_init.connect
+def _start_metrics_server(**kwargs):
+    # Главный процесс воркера отдает метрики всего пула
+    from app import metrics
+    metrics.start_metrics_server()
+
+
+@worker_process_init.connect
+def _reset_db_connections(**kwargs):
+    # Дочерний процесс prefork не должен пользоваться соединениями и пулом родителя
+    from app import db_pool
+    db_pool.reset_after_fork()
+
+
+@worker_process_shutdown.connect
+def _mark_metrics_process_dead(pid=None, **kwargs):
+    from app import metrics
+    metrics.mark_process_dead(pid or os.getpid())
+
+
+@task_prerun.connect
+def _task_started(task_id=None, task=None, **kwargs):
+    from app import metrics, profiling
+    metrics.task_started(task_id)
+    profiling.task_started(task_id, task.name)
+
+
+@task_postrun.connect
+def _task_finished(task_id=None, task=None, state=None, **kwargs):
+    from app import db_pool, metrics, profiling
+    profiling.task_finished(task_id, state)
+    metrics.task_finished(task_id, task.name, state)
+    db_pool.report()
+
+
+@task_retry.connect
+def _task_retried(sender=None, **kwargs):
+    from app import metrics
+    metrics.TASK_RETRIES.labels(task=sender.name).inc()
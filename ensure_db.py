@@ -3,11 +3,11 @@ import sys
 import time
 import django
 import logging
-import psycopg2
+import psycopg
 import subprocess
 import urllib.parse
 from dotenv import load_dotenv
-from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg import sql
 
 load_dotenv()
 
@@ -83,14 +83,14 @@ def ensure_db_exists(db_url_info):
 
     for attempt in range(1, RETRY_COUNT + 1):
         try:
-            conn = psycopg2.connect(
+            conn = psycopg.connect(
                 dbname=maintenance_db,
                 user=user,
                 password=password,
                 host=host,
                 port=port,
+                autocommit=True,
             )
-            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
             cur = conn.cursor()
             cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (db_name,))
             exists = cur.fetchone()
@@ -107,19 +107,19 @@ def ensure_db_exists(db_url_info):
                     "Enable ALLOW_DB_CREATE=1 for local/CI only."
                 )
             logger.info(f"[ensure_db] Создание базы данных '{db_name}'...")
-            cur.execute(f'CREATE DATABASE "{db_name}";')
+            cur.execute(sql.SQL("CREATE DATABASE {};").format(sql.Identifier(db_name)))
             logger.info(f"[ensure_db] Database '{db_name}' создана.")
             cur.close()
             conn.close()
             return True  # база создана
-        except psycopg2.OperationalError as exc:
+        except psycopg.OperationalError as exc:
             # возможно БД ещё не поднята (в docker-compose) — ждём и повторяем
             logger.warning(f"[ensure_db] OperationalError (попытка {attempt}/{RETRY_COUNT}): {exc}")
             if attempt < RETRY_COUNT:
                 time.sleep(RETRY_DELAY)
                 continue
             raise
-        except psycopg2.errors.DuplicateDatabase:
+        except psycopg.errors.DuplicateDatabase:
             # кто-то создал параллельно
             logger.warning(f"[ensure_db] Database '{db_name}' уже существует в другом процессе.")
             return False